@@ -1,10 +1,127 @@
+import asyncio
 import time
 from typing import Dict, List
 
-from src.OpenAIUtils import get_message
+from src.OpenAIUtils import openai_client
 from src.SlackUtils import write_message
 
 SLACK_CHANNENL = "勉強"
+# 同じチャンネルへの投稿の最小間隔 (秒). Slackは1チャンネルあたり1秒に1件程度
+SLACK_POST_INTERVAL = 1.0
+
+
+def _create_paper_message(
+    keyword: str, i: int, paper: Dict[str, str], response: str
+) -> str:
+    """
+    論文の要約からSlackに送信するメッセージを作成する関数
+
+    Args:
+        keyword (str): 検索キーワード
+        i (int): 何本目の論文か
+        paper (Dict[str, str]): 論文情報
+        response (str): ChatGPTからの出力
+
+    Returns:
+        message (str): Slackに送信するメッセージ
+    """
+    title_ja, *body = response.split("\n")
+    body = "\n".join(body)
+
+    # 複数キーワードで検索した場合は、ヒットしたキーワードを表示する
+    paper_keyword = ", ".join(paper.get("Keywords", [])) or keyword
+
+    message = (
+        f"{'=' *40}\n"
+        f"{paper_keyword}: {i}本目\n"
+        f"{'=' *40}\n"
+        f"発行日: {paper['Published']}\n"
+        # f"発行日: {paper.Published}\n"
+        f"{paper['Entry_id']}\n"
+        # f"{paper.Entry_id}\n"
+        f"{title_ja} ({paper['Title']})\n"
+        # f"{title_ja} ({paper.Title})\n"
+        f"{body}\n"
+        f"{'=' *40}"
+    )
+    return message
+
+
+async def _post_messages(channel_id: str, queue: asyncio.Queue) -> int:
+    """
+    キューに入ったメッセージを順番にSlackへ送信する関数
+
+    送信は1つのタスクだけが行うので、メッセージの順番が保たれる。
+    Noneを受け取ると終了する。
+
+    Args:
+        channel_id (str): チャンネルID
+        queue (asyncio.Queue): 送信するメッセージのキュー
+
+    Returns:
+        n_failed (int): 送信に失敗したメッセージの数
+    """
+    n_failed = 0
+    last_posted = 0.0
+    while True:
+        message = await queue.get()
+        if message is None:
+            break
+        # チャンネルごとのレート制限を超えないように間隔を空ける
+        wait = SLACK_POST_INTERVAL - (time.monotonic() - last_posted)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        # Retry-Afterによる待機で要約の生成を止めないように、別スレッドで送信する
+        write_message_flag = await asyncio.to_thread(
+            write_message, channel_id, message
+        )
+        last_posted = time.monotonic()
+        if not write_message_flag:
+            print("Slackへのメッセージの送信に失敗しました")
+            n_failed += 1
+    return n_failed
+
+
+async def _write_summary_async(
+    channel_id: str, keyword: str, result_list: List[Dict[str, str]]
+) -> None:
+    """
+    論文の要約とSlackへの送信を並行して行う関数
+
+    Args:
+        channel_id (str): チャンネルID
+        keyword (str): 検索キーワード
+        result_list (List[Dict[str:str]]): 論文情報のリスト
+    """
+    # ChatGPTに論文の概要を並列に要約してもらう
+    tasks = [
+        asyncio.ensure_future(
+            openai_client.get_message(
+                f"title: {paper['Title']}\nbody: {paper['Summary']}"
+                # f"title: {paper.Title}\nbody: {paper.Summary}"
+            )
+        )
+        for paper in result_list
+    ]
+
+    queue: asyncio.Queue = asyncio.Queue()
+    poster = asyncio.create_task(_post_messages(channel_id, queue))
+
+    # 論文の順番に要約を待ち、完成したものから送信キューに入れる
+    for i, (paper, task) in enumerate(zip(result_list, tasks), start=1):
+        try:
+            response = await task
+            await queue.put(_create_paper_message(keyword, i, paper, response))
+        except Exception as e:
+            # 論文の要約に失敗した場合
+            print(f"論文の要約に失敗しました: {e}")
+            continue
+
+    await queue.put(None)
+    n_failed = await poster
+    if n_failed:
+        print(f"{n_failed}件のメッセージの送信に失敗しました")
+    return
 
 
 def write_summary(
@@ -39,58 +156,47 @@ def write_summary(
         print("Slackへのメッセージの送信に失敗しました")
         return
 
-    # 論文情報をSlackに送信する
-    for i, paper in enumerate(result_list, start=1):
-        try:
-            text = f"title: {paper['Title']}\nbody: {paper['Summary']}"
-            # text = f"title: {paper.Title}\nbody: {paper.Summary}"
-
-            # ChatGPTに論文の概要を要約してもらう
-            response = get_message(text)
-            title_ja, *body = response.split("\n")
-            body = "\n".join(body)
-
-            message = (
-                f"{'=' *40}\n"
-                f"{keyword}: {i}本目\n"
-                f"{'=' *40}\n"
-                f"発行日: {paper['Published']}\n"
-                # f"発行日: {paper.Published}\n"
-                f"{paper['Entry_id']}\n"
-                # f"{paper.Entry_id}\n"
-                f"{title_ja} ({paper['Title']})\n"
-                # f"{title_ja} ({paper.Title})\n"
-                f"{body}\n"
-                f"{'=' *40}"
-            )
-            write_message_flag = write_message(channel_id, message)
-            if not write_message_flag:
-                print("Slackへのメッセージの送信に失敗しました")
-                return
-            time.sleep(10)
-
-        except Exception as e:
-            # 論文の要約に失敗した場合
-            print(f"論文の要約に失敗しました: {e}")
-            continue
+    # 要約の生成とSlackへの送信を並行して行う
+    openai_client.run_sync(
+        _write_summary_async(channel_id, keyword, result_list)
+    )
     return
 
 
 if __name__ == "__main__":
     import os
 
+    import torch
     from slack_bolt.adapter.socket_mode import SocketModeHandler
 
-    from src.arXivUtils import get_paper_info
-    from src.SlackUtils import app
+    from src.arXivStore import ArXivMetadataStore
+    from src.arXivUtils import get_paper_info_multi
+    from src.SlackUtils import app, summary_job_queue
+    from src.Utils import warmup_models
 
     keyword_list = ["AI", "LLM", "Model", "CNN"]
+    # キーワード間で共有する論文情報のキャッシュ
+    arxiv_store = ArXivMetadataStore()
 
-    for keyword in keyword_list:
-        result_list = get_paper_info(keyword, max_result=10)
-        write_summary(
-            channel_id=SLACK_CHANNENL, keyword=keyword, result_list=result_list
-        )
+    # 複数のキーワードにヒットした論文は1回だけ要約する
+    result_list = get_paper_info_multi(
+        keyword_list, max_result=10, store=arxiv_store
+    )
+    write_summary(
+        channel_id=SLACK_CHANNENL,
+        keyword=", ".join(keyword_list),
+        result_list=result_list,
+    )
 
+    # 要約に使用するモデルを事前にロードしておく
+    warmup_models(
+        device="cuda:0" if torch.cuda.is_available() else "cpu",
+        package_name="llama_index",
+        temperature=0.0,
+        context_window=4096,
+        max_tokens=4096,
+    )
+    # 前回完了しなかったジョブを読み込み、ワーカーを起動する
+    summary_job_queue.start()
     # アプリを起動します
     SocketModeHandler(app, os.environ["SLACK_APP_TOKEN"]).start()
@@ -0,0 +1,616 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.XMLUtils import run_grobid
+
+# TEI XMLのキャッシュの保存先と容量の上限
+TEI_CACHE_DIR = os.getenv("GROBID_CACHE_DIR", "./data/grobid_cache")
+TEI_CACHE_DEFAULT_MAX_MB = 1024
+# Grobidの設定ファイルのパス
+GROBID_CONFIG_PATH = "config/grobid_config.json"
+GROBID_VERSION = "0.7.3"
+# processFulltextDocumentに渡すオプション (CLIのprocessFullTextと同じ設定)
+GROBID_FLAGS = {
+    "consolidateHeader": "0",
+    "consolidateCitations": "0",
+}
+
+
+def _get_cache_max_bytes_from_env() -> int:
+    """環境変数GROBID_CACHE_MAX_MBからキャッシュの容量の上限を取得する関数
+
+    Returns:
+        int: 容量の上限 (バイト). 未設定か不正な値の場合はTEI_CACHE_DEFAULT_MAX_MB
+    """
+    max_mb = os.getenv("GROBID_CACHE_MAX_MB")
+    if not max_mb:
+        return TEI_CACHE_DEFAULT_MAX_MB * 1024**2
+    try:
+        return int(float(max_mb) * 1024**2)
+    except ValueError as e:
+        print(f"Error in get_cache_max_bytes_from_env: {e}")
+        return TEI_CACHE_DEFAULT_MAX_MB * 1024**2
+
+
+TEI_CACHE_MAX_BYTES = _get_cache_max_bytes_from_env()
+
+
+def load_grobid_config(config_path: str = GROBID_CONFIG_PATH) -> Dict:
+    """Grobidの設定ファイルを読み込む関数
+
+    Args:
+        config_path (str, optional): 設定ファイルのパス. Defaults to GROBID_CONFIG_PATH.
+
+    Returns:
+        config (Dict): 設定の辞書. 読み込めなかった場合は空の辞書
+    """
+    try:
+        with open(config_path, mode="r", encoding="utf-8") as f:
+            config = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        print(f"Error in load_grobid_config: {e}")
+        return {}
+    else:
+        return config
+
+
+class GrobidServerClient:
+    def __init__(
+        self,
+        server_url: str | None = None,
+        pool_size: int = 4,
+        timeout: float = 300.0,
+        max_retries: int = 3,
+        flags: Dict[str, str] | None = None,
+    ) -> None:
+        """
+        GrobidServerClientクラスのコンストラクタ
+
+        常駐しているGrobidのHTTPサーバーにPDFを送信してTEI XMLを取得する。
+        コネクションはrequests.Sessionのプールで再利用する。
+
+        Args:
+            server_url (str | None, optional): GrobidサーバーのURL. Noneの場合は設定ファイルのgrobid_serverを使う. Defaults to None.
+            pool_size (int, optional): コネクションプールのサイズ兼同時送信数. Defaults to 4.
+            timeout (float, optional): 1リクエストあたりのタイムアウト秒数. Defaults to 300.0.
+            max_retries (int, optional): サーバーがビジー (503) の場合の再試行回数. Defaults to 3.
+            flags (Dict[str, str] | None, optional): Grobidに渡すオプション. Defaults to None.
+        """
+        if server_url is None:
+            server_url = load_grobid_config().get(
+                "grobid_server", "http://localhost:8070"
+            )
+        if not isinstance(pool_size, int) or pool_size < 1:
+            raise ValueError("pool_size must be a positive int")
+
+        self.server_url = server_url.rstrip("/")
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.flags = GROBID_FLAGS.copy() if flags is None else flags.copy()
+
+        # コネクションプールの設定
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def close(self) -> None:
+        """セッションを閉じるメソッド"""
+        self._session.close()
+
+    def is_alive(self) -> bool:
+        """Grobidサーバーが起動しているかを確認するメソッド
+
+        Returns:
+            bool: Trueなら起動している
+        """
+        try:
+            response = self._session.get(
+                f"{self.server_url}/api/isalive", timeout=5
+            )
+        except requests.RequestException as e:
+            print(f"Grobid server is not alive: {e}")
+            return False
+        else:
+            return response.ok
+
+    def process_pdf(
+        self, pdf_path: str, output_path: str | None = None
+    ) -> str | None:
+        """PDFをGrobidサーバーに送信し、TEI XMLを保存するメソッド
+
+        Args:
+            pdf_path (str): PDFファイルのパス
+            output_path (str | None, optional): TEI XMLの保存先. Noneの場合はPDFと同じ場所に"<名前>.tei.xml"で保存する. Defaults to None.
+
+        Returns:
+            output_path (str | None): TEI XMLのパス. 失敗した場合はNone
+        """
+        if not os.path.isfile(pdf_path):
+            print(f"Error in GrobidServerClient.process_pdf: {pdf_path}")
+            return None
+        if output_path is None:
+            output_path = os.path.splitext(pdf_path)[0] + ".tei.xml"
+
+        try:
+            tei_xml = self._post_pdf(pdf_path)
+            _write_text_atomic(output_path, tei_xml)
+        except (requests.RequestException, OSError) as e:
+            print(f"Error in GrobidServerClient.process_pdf: {e}")
+            return None
+        else:
+            return output_path
+
+    def process_pdfs(self, pdf_paths: List[str]) -> Dict[str, str | None]:
+        """複数のPDFを並列にGrobidサーバーへ送信するメソッド
+
+        Args:
+            pdf_paths (List[str]): PDFファイルのパスのリスト
+
+        Returns:
+            Dict[str, str | None]: PDFのパスとTEI XMLのパスの辞書
+        """
+        with ThreadPoolExecutor(max_workers=self.pool_size) as executor:
+            results = executor.map(self.process_pdf, pdf_paths)
+            return dict(zip(pdf_paths, results))
+
+    def _post_pdf(self, pdf_path: str) -> str:
+        """processFulltextDocumentにPDFを送信するメソッド
+
+        Args:
+            pdf_path (str): PDFファイルのパス
+
+        Returns:
+            str: TEI XMLの文字列
+        """
+        url = f"{self.server_url}/api/processFulltextDocument"
+        for cnt in range(self.max_retries + 1):
+            with open(pdf_path, mode="rb") as f:
+                response = self._session.post(
+                    url,
+                    files={
+                        "input": (
+                            os.path.basename(pdf_path),
+                            f,
+                            "application/pdf",
+                        )
+                    },
+                    data=self.flags,
+                    timeout=self.timeout,
+                )
+            # サーバーがビジーの場合は待ってから再試行する
+            if response.status_code == 503 and cnt < self.max_retries:
+                time.sleep(2**cnt)
+                continue
+            response.raise_for_status()
+            break
+        response.encoding = "utf-8"
+        return response.text
+
+
+def _write_text_atomic(path: str, text: str) -> None:
+    """一時ファイルに書き込んでから置き換えることで、ファイルを原子的に書き込む関数
+
+    Args:
+        path (str): 保存先のパス
+        text (str): 書き込むテキスト
+    """
+    dir_path = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path, suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode="w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class TEICache:
+    def __init__(
+        self,
+        cache_dir: str = TEI_CACHE_DIR,
+        max_bytes: int = TEI_CACHE_MAX_BYTES,
+        grobid_version: str = GROBID_VERSION,
+        flags: Dict[str, str] | None = None,
+    ) -> None:
+        """
+        TEICacheクラスのコンストラクタ
+
+        PDFのSHA-256とGrobidのバージョン・オプションをキーにして、
+        GrobidのTEI XMLをディスクにキャッシュする。
+
+        Args:
+            cache_dir (str, optional): キャッシュの保存先ディレクトリ. Defaults to TEI_CACHE_DIR.
+            max_bytes (int, optional): キャッシュの合計サイズの上限. Defaults to TEI_CACHE_MAX_BYTES.
+            grobid_version (str, optional): Grobidのバージョン. Defaults to GROBID_VERSION.
+            flags (Dict[str, str] | None, optional): Grobidに渡すオプション. Defaults to None.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.grobid_version = grobid_version
+        self.flags = GROBID_FLAGS.copy() if flags is None else flags.copy()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def make_key(
+        self,
+        pdf_path: str,
+        backend: str = "server",
+        flags: Dict[str, str] | None = None,
+    ) -> str:
+        """PDFのハッシュとGrobidの設定からキャッシュキーを作成するメソッド
+
+        サーバーとCLIでは出力が一致するとは限らないため、
+        実際に使ったバックエンドとオプションをキーに含める。
+
+        Args:
+            pdf_path (str): PDFファイルのパス
+            backend (str, optional): TEI XMLを作成したバックエンド ("server" または "cli"). Defaults to "server".
+            flags (Dict[str, str] | None, optional): Grobidに渡したオプション. Noneの場合はself.flags. Defaults to None.
+
+        Returns:
+            key (str): キャッシュキー
+        """
+        digest = hashlib.sha256()
+        with open(pdf_path, mode="rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        config = json.dumps(
+            {
+                "version": self.grobid_version,
+                "backend": backend,
+                "flags": self.flags if flags is None else flags,
+            },
+            sort_keys=True,
+        )
+        digest.update(config.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + ".tei.xml")
+
+    def get(self, key: str, output_path: str) -> bool:
+        """キャッシュされたTEI XMLをoutput_pathにコピーするメソッド
+
+        Args:
+            key (str): キャッシュキー
+            output_path (str): コピー先のパス
+
+        Returns:
+            bool: キャッシュにヒットしたかどうか
+        """
+        cache_path = self._get_path(key)
+        try:
+            with open(cache_path, mode="r", encoding="utf-8") as f:
+                tei_xml = f.read()
+            _write_text_atomic(output_path, tei_xml)
+            # 最終利用時刻を更新して、LRUで破棄されにくくする
+            os.utime(cache_path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return False
+        except OSError as e:
+            print(f"Error in TEICache.get: {e}")
+            with self._lock:
+                self.misses += 1
+            return False
+        else:
+            with self._lock:
+                self.hits += 1
+            return True
+
+    def put(self, key: str, tei_path: str) -> None:
+        """TEI XMLをキャッシュに保存するメソッド
+
+        Args:
+            key (str): キャッシュキー
+            tei_path (str): 保存するTEI XMLのパス
+        """
+        cache_path = self._get_path(key)
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(tei_path, mode="r", encoding="utf-8") as f:
+                tei_xml = f.read()
+            _write_text_atomic(cache_path, tei_xml)
+        except OSError as e:
+            print(f"Error in TEICache.put: {e}")
+            return None
+        self.evict()
+        return None
+
+    def evict(self) -> None:
+        """合計サイズが上限を超えた場合に、最終利用時刻が古いものから削除するメソッド"""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for file in files:
+                if not file.endswith(".tei.xml"):
+                    continue
+                path = os.path.join(root, file)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"Error in TEICache.evict: {e}")
+                continue
+            total_size -= size
+
+    def stats(self) -> Dict[str, float]:
+        """キャッシュのヒット数・ミス数・ヒット率を返すメソッド
+
+        Returns:
+            Dict[str, float]: ヒット数・ミス数・ヒット率
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+def process_pdf_with_grobid(
+    dir_path: str,
+    pdf_name: str,
+    client: GrobidServerClient | None = None,
+    cache: TEICache | None = None,
+) -> str | None:
+    """GrobidサーバーでPDFを処理し、使えない場合はCLIにフォールバックする関数
+
+    同じPDFを処理済みの場合は、キャッシュされたTEI XMLを使う。
+
+    Args:
+        dir_path (str): PDFファイルが保存されているディレクトリのパス
+        pdf_name (str): PDFファイル名 (拡張子なし)
+        client (GrobidServerClient | None, optional): Grobidサーバーのクライアント. Defaults to None.
+        cache (TEICache | None, optional): TEI XMLのキャッシュ. Defaults to None.
+
+    Returns:
+        dir_path (str | None): XMLファイルが保存されているディレクトリのパス
+    """
+    if not os.path.exists(dir_path):
+        print("Error in process_pdf_with_grobid: Invalid directory path")
+        return None
+
+    pdf_path = os.path.join(dir_path, pdf_name + ".pdf")
+    tei_path = os.path.join(dir_path, pdf_name + ".tei.xml")
+    if client is None:
+        client = grobid_client
+    if cache is None:
+        cache = tei_cache
+
+    # サーバーが使えない場合はCLIで処理するため、CLIの出力のキャッシュを探す
+    if client.is_alive():
+        backend, flags = "server", client.flags
+    else:
+        backend, flags = "cli", GROBID_FLAGS
+
+    # キャッシュにヒットした場合は、Grobidを実行しない
+    try:
+        cache_key = cache.make_key(pdf_path, backend=backend, flags=flags)
+    except OSError as e:
+        print(f"Error in process_pdf_with_grobid: {e}")
+        cache_key = None
+    if cache_key is not None and cache.get(cache_key, tei_path):
+        print("Use cached grobid output")
+        return dir_path
+
+    if backend == "server" and client.process_pdf(pdf_path) is not None:
+        print("Success to run grobid server")
+    else:
+        print("Failed to run grobid server. Fallback to grobid CLI.")
+        if run_grobid(dir_path) is None:
+            return None
+        if backend == "server" and cache_key is not None:
+            # CLIの出力は、サーバーのキーではなくCLIのキーで保存する
+            backend = "cli"
+            cache_key = cache.make_key(
+                pdf_path, backend=backend, flags=GROBID_FLAGS
+            )
+
+    if cache_key is not None and os.path.exists(tei_path):
+        cache.put(cache_key, tei_path)
+    return dir_path
+
+
+# Grobidのスタブサーバーが返すTEI XML
+STUB_TEI_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<TEI xmlns="http://www.tei-c.org/ns/1.0" xml:lang="en">
+  <teiHeader>
+    <fileDesc>
+      <sourceDesc>
+        <biblStruct>
+          <analytic>
+            <title level="a" type="main">Stub Paper</title>
+            <author><persName><forename>Stub</forename><surname>Author</surname></persName></author>
+          </analytic>
+          <monogr><imprint><date>1 Jan 2023</date></imprint></monogr>
+          <idno type="arXiv">arXiv:0000.00000</idno>
+        </biblStruct>
+      </sourceDesc>
+    </fileDesc>
+    <profileDesc><abstract><p>Stub abstract.</p></abstract></profileDesc>
+  </teiHeader>
+  <text>
+    <body>
+      <div><head>Introduction</head><p>Stub introduction.</p></div>
+      <div><head>Conclusion</head><p>Stub conclusion.</p></div>
+    </body>
+  </text>
+</TEI>
+"""
+
+
+class _StubGrobidHandler(BaseHTTPRequestHandler):
+    """Javaなしで動作確認するためのGrobidスタブのハンドラ"""
+
+    tei_xml = STUB_TEI_XML
+    latency = 0.0
+
+    def do_GET(self) -> None:
+        if self.path == "/api/isalive":
+            self._send(200, "true", "text/plain")
+        elif self.path == "/api/version":
+            self._send(200, GROBID_VERSION, "text/plain")
+        else:
+            self._send(404, "Not Found", "text/plain")
+
+    def do_POST(self) -> None:
+        # リクエストボディは読み捨てる
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if self.path != "/api/processFulltextDocument":
+            self._send(404, "Not Found", "text/plain")
+            return
+        time.sleep(self.latency)
+        self._send(200, self.tei_xml, "application/xml")
+
+    def _send(self, status: int, body: str, content_type: str) -> None:
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args) -> None:
+        return None
+
+
+def start_stub_grobid_server(
+    host: str = "127.0.0.1",
+    port: int = 0,
+    tei_xml: str = STUB_TEI_XML,
+    latency: float = 0.0,
+) -> ThreadingHTTPServer:
+    """Grobidのスタブサーバーを別スレッドで起動する関数
+
+    Args:
+        host (str, optional): ホスト名. Defaults to "127.0.0.1".
+        port (int, optional): ポート番号. 0の場合は空いているポートを使う. Defaults to 0.
+        tei_xml (str, optional): 返すTEI XML. Defaults to STUB_TEI_XML.
+        latency (float, optional): 1リクエストあたりの疑似処理時間. Defaults to 0.0.
+
+    Returns:
+        server (ThreadingHTTPServer): 起動したサーバー. server.shutdown()で停止する
+    """
+    handler = type(
+        "StubGrobidHandler",
+        (_StubGrobidHandler,),
+        {"tei_xml": tei_xml, "latency": latency},
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def benchmark_grobid(
+    pdf_paths: List[str],
+    client: GrobidServerClient | None = None,
+    use_cli: bool = True,
+) -> Dict[str, Dict[str, float]]:
+    """CLIとサーバーでのPDF1本あたりの処理時間を計測する関数
+
+    Args:
+        pdf_paths (List[str]): PDFファイルのパスのリスト
+        client (GrobidServerClient | None, optional): Grobidサーバーのクライアント. Defaults to None.
+        use_cli (bool, optional): CLIの計測も行うかどうか. Defaults to True.
+
+    Returns:
+        Dict[str, Dict[str, float]]: 方式ごとの平均・最大処理時間 (秒)
+    """
+    if client is None:
+        client = grobid_client
+    results = {}
+
+    # サーバーでの処理時間
+    latencies = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for pdf_path in pdf_paths:
+            output_path = os.path.join(
+                tmp_dir, os.path.basename(pdf_path) + ".tei.xml"
+            )
+            start = time.perf_counter()
+            client.process_pdf(pdf_path, output_path=output_path)
+            latencies.append(time.perf_counter() - start)
+    results["server"] = _summarize_latencies(latencies)
+
+    # CLIでの処理時間 (1本ずつ別ディレクトリで実行する)
+    if use_cli:
+        latencies = []
+        for pdf_path in pdf_paths:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                shutil.copy(pdf_path, tmp_dir)
+                start = time.perf_counter()
+                run_grobid(tmp_dir)
+                latencies.append(time.perf_counter() - start)
+        results["cli"] = _summarize_latencies(latencies)
+
+    return results
+
+
+def _summarize_latencies(latencies: List[float]) -> Dict[str, float]:
+    """処理時間のリストから平均と最大を計算する関数
+
+    Args:
+        latencies (List[float]): 処理時間のリスト
+
+    Returns:
+        Dict[str, float]: 平均・最大処理時間
+    """
+    if not latencies:
+        return {"mean": 0.0, "max": 0.0}
+    return {
+        "mean": sum(latencies) / len(latencies),
+        "max": max(latencies),
+    }
+
+
+# プロセス全体で共有するGrobidサーバーのクライアントとキャッシュ
+grobid_client = GrobidServerClient()
+tei_cache = TEICache()
+
+
+if __name__ == "__main__":
+    import glob
+
+    base_path = "/home/paper_translator/data"
+    pdf_paths = glob.glob(f"{base_path}/documents/*/*.pdf")
+
+    # Grobidサーバーが起動していない場合は、スタブサーバーで計測する
+    if grobid_client.is_alive():
+        client = grobid_client
+        use_cli = True
+    else:
+        stub_server = start_stub_grobid_server()
+        host, port = stub_server.server_address
+        client = GrobidServerClient(server_url=f"http://{host}:{port}")
+        use_cli = False
+
+    print(benchmark_grobid(pdf_paths, client=client, use_cli=use_cli))
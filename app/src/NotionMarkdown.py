@@ -0,0 +1,298 @@
+import re
+import time
+from typing import Any, Dict, Iterable, Iterator, List
+
+# 1つのrich_textに書き込める最大文字数
+NOTION_MAX_TEXT_LENGTH = 2000
+# 1つのブロックに入れられるrich_textの最大数
+NOTION_MAX_RICH_TEXTS = 100
+# Notionのcodeブロックで使える言語のうち、よく使うもの
+NOTION_CODE_LANGUAGES = {
+    "bash",
+    "c",
+    "c++",
+    "c#",
+    "css",
+    "go",
+    "html",
+    "java",
+    "javascript",
+    "json",
+    "latex",
+    "markdown",
+    "python",
+    "rust",
+    "shell",
+    "sql",
+    "typescript",
+    "yaml",
+}
+_CODE_LANGUAGE_ALIASES = {
+    "cpp": "c++",
+    "js": "javascript",
+    "py": "python",
+    "sh": "shell",
+    "ts": "typescript",
+    "yml": "yaml",
+    "tex": "latex",
+    "md": "markdown",
+}
+
+# "#include"などを見出しにしないように、空白を省略できるのは"##"以降に限る
+_HEADING_PATTERN = re.compile(r"^(#(?=\s)|#{2,6})\s*([^#\s].*?)\s*#*\s*$")
+_BULLET_PATTERN = re.compile(r"^\s*[-*+]\s+(.*)$")
+# "2023. 年に"のような年から始まる文を番号付きリストにしないように、3桁までにする
+_NUMBERED_PATTERN = re.compile(r"^\s*\d{1,3}[.)]\s+(.*)$")
+_FENCE_PATTERN = re.compile(r"^\s*(```|~~~)\s*([\w#+-]*)")
+
+
+def split_rich_text(text: str) -> List[Dict]:
+    """テキストをNOTION_MAX_TEXT_LENGTH文字ごとのrich_textに分割する関数
+
+    Args:
+        text (str): テキスト
+
+    Returns:
+        List[Dict]: rich_textのリスト
+    """
+    return [
+        {
+            "type": "text",
+            "text": {"content": text[i : i + NOTION_MAX_TEXT_LENGTH]},
+        }
+        for i in range(0, max(len(text), 1), NOTION_MAX_TEXT_LENGTH)
+    ]
+
+
+def _create_blocks(
+    block_type: str, text: str, **options: Any
+) -> Iterator[Dict]:
+    """テキストのブロックを作成するジェネレータ
+
+    rich_textがNOTION_MAX_RICH_TEXTSを超える場合は、同じ種類のブロックに分ける。
+
+    Args:
+        block_type (str): ブロックの種類
+        text (str): テキスト
+        options (Any): ブロックに追加する項目. codeブロックのlanguageなど
+
+    Yields:
+        Dict: ブロック
+    """
+    rich_text = split_rich_text(text)
+    for i in range(0, len(rich_text), NOTION_MAX_RICH_TEXTS):
+        yield {
+            "object": "block",
+            "type": block_type,
+            block_type: {
+                "rich_text": rich_text[i : i + NOTION_MAX_RICH_TEXTS],
+                **options,
+            },
+        }
+
+
+def _to_code_language(language: str) -> str:
+    """コードフェンスの言語名をNotionの言語名に変換する関数
+
+    Args:
+        language (str): コードフェンスの言語名
+
+    Returns:
+        str: Notionの言語名. 対応していない場合は"plain text"
+    """
+    language = language.lower()
+    language = _CODE_LANGUAGE_ALIASES.get(language, language)
+    return language if language in NOTION_CODE_LANGUAGES else "plain text"
+
+
+def iter_lines(chunks: Iterable[str]) -> Iterator[str]:
+    """生成されたトークンなどの文字列を、行ごとにまとめて返すジェネレータ
+
+    Args:
+        chunks (Iterable[str]): 文字列のイテレータ
+
+    Yields:
+        str: 改行を含まない1行
+    """
+    buffer = ""
+    for chunk in chunks:
+        buffer += chunk
+        if "\n" not in chunk:
+            continue
+        *lines, buffer = buffer.split("\n")
+        yield from lines
+    if buffer:
+        yield buffer
+
+
+def iter_notion_blocks(lines: Iterable[str]) -> Iterator[Dict]:
+    """Markdownの行からNotionのブロックを順に作成するジェネレータ
+
+    行を1回だけ走査し、ブロックが確定した時点で返すため、
+    要約の生成中でもブロックを作成できる。見出し (#〜###. "##"以降は"###Title"のように
+    空白がなくてもよい)・箇条書き・番号付きリスト・コードブロックに対応し、
+    空行で区切られた連続する行は1つの段落ブロックにまとめる。
+
+    Args:
+        lines (Iterable[str]): Markdownの行のイテレータ
+
+    Yields:
+        Dict: Notionのブロック
+    """
+    paragraph: List[str] = []
+    code: List[str] | None = None
+    fence = ""
+    language = ""
+
+    for line in lines:
+        line = line.rstrip("\r")
+        if code is not None:
+            # コードブロックの中は、閉じるフェンスまでそのまま保持する
+            if line.strip().startswith(fence):
+                yield from _create_blocks(
+                    "code", "\n".join(code), language=language
+                )
+                code = None
+            else:
+                code.append(line)
+            continue
+
+        match = _FENCE_PATTERN.match(line)
+        if match:
+            if paragraph:
+                yield from _create_blocks("paragraph", "\n".join(paragraph))
+                paragraph = []
+            fence = match.group(1)
+            language = _to_code_language(match.group(2))
+            code = []
+            continue
+
+        if not line.strip():
+            if paragraph:
+                yield from _create_blocks("paragraph", "\n".join(paragraph))
+                paragraph = []
+            continue
+
+        match = _HEADING_PATTERN.match(line)
+        if match:
+            block_type, text = (
+                f"heading_{len(match.group(1))}",
+                match.group(2),
+            )
+            # Notionの見出しは3段階までのため、それより深い見出しは段落にする
+            if len(match.group(1)) > 3:
+                block_type = "paragraph"
+        else:
+            match = _BULLET_PATTERN.match(line)
+            if match:
+                block_type, text = "bulleted_list_item", match.group(1)
+            else:
+                match = _NUMBERED_PATTERN.match(line)
+                if match:
+                    block_type, text = "numbered_list_item", match.group(1)
+                else:
+                    paragraph.append(line)
+                    continue
+
+        if paragraph:
+            yield from _create_blocks("paragraph", "\n".join(paragraph))
+            paragraph = []
+        yield from _create_blocks(block_type, text)
+
+    if code is not None:
+        # 閉じていないコードブロックも、最後まで書き込む
+        yield from _create_blocks("code", "\n".join(code), language=language)
+    if paragraph:
+        yield from _create_blocks("paragraph", "\n".join(paragraph))
+
+
+def markdown_to_blocks(markdown_text: str) -> List[Dict]:
+    """MarkdownのテキストをNotionのブロックのリストに変換する関数
+
+    Args:
+        markdown_text (str): Markdownのテキスト
+
+    Returns:
+        List[Dict]: ブロックのリスト
+    """
+    return list(iter_notion_blocks(markdown_text.split("\n")))
+
+
+def _create_benchmark_markdown(n_sections: int) -> str:
+    """ベンチマーク用のMarkdownを作成する関数
+
+    Args:
+        n_sections (int): セクション数
+
+    Returns:
+        str: Markdownのテキスト
+    """
+    section = "\n".join(
+        [
+            "###Section {i}",
+            "この節では、提案手法の概要を説明する。" * 5,
+            "続く行も同じ段落に含まれる。",
+            "",
+            "- 箇条書きの項目1",
+            "- 箇条書きの項目2",
+            "1. 番号付きの項目1",
+            "2. 番号付きの項目2",
+            "",
+            "```python",
+            "def f(x):",
+            "    return x",
+            "```",
+            "長い段落" * 600,
+            "",
+            "",
+        ]
+    )
+    return "".join(section.format(i=i) for i in range(n_sections))
+
+
+def benchmark_markdown_to_blocks(
+    n_sections: int = 2000, repeat: int = 3
+) -> Dict[str, float]:
+    """大きなMarkdownをブロックに変換する速度を計測する関数
+
+    Args:
+        n_sections (int, optional): セクション数. Defaults to 2000.
+        repeat (int, optional): 計測回数. 最速の結果を使う. Defaults to 3.
+
+    Returns:
+        Dict[str, float]: 文字数・行数・ブロック数・処理時間・1秒あたりの処理量
+    """
+    markdown_text = _create_benchmark_markdown(n_sections)
+    lines = markdown_text.split("\n")
+    elapsed = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        n_blocks = sum(1 for _ in iter_notion_blocks(lines))
+        elapsed = min(elapsed, time.perf_counter() - start)
+    return {
+        "chars": len(markdown_text),
+        "lines": len(lines),
+        "blocks": n_blocks,
+        "seconds": elapsed,
+        "mchars_per_second": len(markdown_text) / elapsed / 1e6,
+        "blocks_per_second": n_blocks / elapsed,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="MarkdownをNotionのブロックに変換する速度を計測する"
+    )
+    parser.add_argument("--sections", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    result = benchmark_markdown_to_blocks(args.sections, args.repeat)
+    print(
+        f"{result['chars']} chars, {result['lines']} lines -> "
+        f"{result['blocks']} blocks in {result['seconds']:.3f}s "
+        f"({result['mchars_per_second']:.1f} Mchars/s, "
+        f"{result['blocks_per_second']:.0f} blocks/s)"
+    )
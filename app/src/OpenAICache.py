@@ -0,0 +1,175 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict
+
+from src.SQLiteUtils import SQLiteDatabase
+
+# レスポンスキャッシュの保存先
+OPENAI_CACHE_PATH = "./data/openai_cache.sqlite3"
+# キャッシュの有効期限 (秒) と保存件数の上限
+OPENAI_CACHE_TTL = 30 * 24 * 60 * 60
+OPENAI_CACHE_MAX_ENTRIES = 10000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    response TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_last_access
+    ON responses (last_access);
+"""
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        db_path: str = OPENAI_CACHE_PATH,
+        ttl: float | None = OPENAI_CACHE_TTL,
+        max_entries: int = OPENAI_CACHE_MAX_ENTRIES,
+    ) -> None:
+        """
+        ResponseCacheクラスのコンストラクタ
+
+        (モデル名, システムプロンプト, 入力) をキーにして、
+        ChatGPTの出力をSQLiteに保存する。
+
+        Args:
+            db_path (str, optional): SQLiteファイルのパス. Defaults to OPENAI_CACHE_PATH.
+            ttl (float | None, optional): 有効期限 (秒). Noneの場合は無期限. Defaults to OPENAI_CACHE_TTL.
+            max_entries (int, optional): 保存件数の上限. Defaults to OPENAI_CACHE_MAX_ENTRIES.
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = SQLiteDatabase(db_path, _SCHEMA)
+
+    @staticmethod
+    def make_key(model_name: str, system: str, text: str) -> str:
+        """モデル名・システムプロンプト・入力からキャッシュキーを作成するメソッド
+
+        Args:
+            model_name (str): OpenAIのモデル名
+            system (str): システムプロンプト
+            text (str): ユーザーからの入力
+
+        Returns:
+            str: キャッシュキー
+        """
+        raw = json.dumps([model_name, system, text], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, model_name: str, system: str, text: str) -> str | None:
+        """キャッシュされた出力を取得するメソッド
+
+        Args:
+            model_name (str): OpenAIのモデル名
+            system (str): システムプロンプト
+            text (str): ユーザーからの入力
+
+        Returns:
+            str | None: キャッシュされた出力. 存在しないか期限切れの場合はNone
+        """
+        key = self.make_key(model_name, system, text)
+        now = time.time()
+        try:
+            with self._db.connect() as conn:
+                row = conn.execute(
+                    "SELECT response, created FROM responses WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if row is not None and (
+                    self.ttl is None or now - row[1] <= self.ttl
+                ):
+                    conn.execute(
+                        "UPDATE responses SET last_access = ? WHERE key = ?",
+                        (now, key),
+                    )
+                else:
+                    row = None
+        except sqlite3.Error as e:
+            print(f"Error in ResponseCache.get: {e}")
+            row = None
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return row[0]
+
+    def put(
+        self, model_name: str, system: str, text: str, response: str
+    ) -> None:
+        """出力をキャッシュに保存するメソッド
+
+        Args:
+            model_name (str): OpenAIのモデル名
+            system (str): システムプロンプト
+            text (str): ユーザーからの入力
+            response (str): ChatGPTからの出力
+        """
+        key = self.make_key(model_name, system, text)
+        now = time.time()
+        try:
+            with self._db.connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses"
+                    " (key, model, response, created, last_access)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (key, model_name, response, now, now),
+                )
+                self._evict(conn, now)
+        except sqlite3.Error as e:
+            print(f"Error in ResponseCache.put: {e}")
+        return None
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        """期限切れの出力と、上限を超えた古い出力を削除するメソッド
+
+        Args:
+            conn (sqlite3.Connection): SQLiteの接続
+            now (float): 現在時刻
+        """
+        if self.ttl is not None:
+            conn.execute(
+                "DELETE FROM responses WHERE created < ?", (now - self.ttl,)
+            )
+        conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            " SELECT key FROM responses ORDER BY last_access DESC"
+            " LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def clear(self) -> None:
+        """キャッシュを全て削除するメソッド"""
+        with self._db.connect() as conn:
+            conn.execute("DELETE FROM responses")
+
+    def stats(self) -> Dict[str, float]:
+        """キャッシュのヒット数・ミス数・ヒット率・保存件数を返すメソッド
+
+        Returns:
+            Dict[str, float]: ヒット数・ミス数・ヒット率・保存件数
+        """
+        with self._db.connect() as conn:
+            n_entries = conn.execute(
+                "SELECT COUNT(*) FROM responses"
+            ).fetchone()[0]
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": n_entries,
+            }
@@ -1,14 +1,26 @@
+import asyncio
 import os
+import random
+import re
+import threading
 import time
-from typing import List
+from typing import Any, Coroutine, List, Mapping
 
+import aiohttp
 import openai
 
+from src.OpenAICache import ResponseCache
+
 # OpenAIのAPIを使うための準備
 openai.organization = "org-Iag9C9eT1CKuntaQKeCdZdXm"
 openai.api_key = os.getenv("OPENAI_API_KEY")
 MODEL_NAME = "gpt-3.5-turbo-0301"  # OpenAIのモデル名
 TEMPERATURE = 0.15  # OpenAIのtemperature
+# gpt-3.5-turboの既定のレート制限 (レスポンスヘッダーで上書きされる)
+DEFAULT_RPM = 3500
+DEFAULT_TPM = 90000
+MAX_CONCURRENCY = 8  # 同時に送信するリクエスト数の上限
+MAX_RETRIES = 5  # 再試行回数の上限
 
 SYSTEM = """
 ### 指示 ###
@@ -49,8 +61,370 @@ def OpenAIModelList() -> List[str]:
     return model_list
 
 
+class TokenBucket:
+    def __init__(self, capacity: float, refill_per_sec: float) -> None:
+        """
+        TokenBucketクラスのコンストラクタ
+
+        Args:
+            capacity (float): バケットの容量
+            refill_per_sec (float): 1秒あたりに補充される量
+        """
+        self.capacity = capacity
+        self.refill_per_sec = refill_per_sec
+        self.tokens = capacity
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._last
+        self._last = now
+        self.tokens = min(
+            self.capacity, self.tokens + elapsed * self.refill_per_sec
+        )
+
+    async def acquire(self, amount: float) -> None:
+        """必要な量が貯まるまで待ってから消費するメソッド
+
+        Args:
+            amount (float): 消費する量
+        """
+        # 容量を超える要求は、容量いっぱいまで貯まれば通す
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return None
+                await asyncio.sleep(
+                    (amount - self.tokens) / self.refill_per_sec
+                )
+
+    def update(self, limit: float | None, remaining: float | None) -> None:
+        """サーバーから返された上限と残量でバケットを更新するメソッド
+
+        Args:
+            limit (float | None): 1分あたりの上限
+            remaining (float | None): 現在の残量
+        """
+        self._refill()
+        if limit:
+            self.capacity = limit
+            self.refill_per_sec = limit / 60
+        if remaining is not None:
+            self.tokens = min(self.capacity, remaining)
+
+
+def _parse_header_float(headers: Mapping[str, str], key: str) -> float | None:
+    """レスポンスヘッダーの値を数値に変換する関数
+
+    Args:
+        headers (Mapping[str, str]): レスポンスヘッダー
+        key (str): ヘッダー名
+
+    Returns:
+        float | None: 値. 存在しない場合はNone
+    """
+    value = headers.get(key)
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _parse_retry_after(
+    headers: Mapping[str, str], status: int | None = 429
+) -> float | None:
+    """Retry-Afterまたはx-ratelimit-reset-*から待ち時間 (秒) を取得する関数
+
+    x-ratelimit-reset-*はレート制限の回復までの時間のため、429の場合だけ使う。
+
+    Args:
+        headers (Mapping[str, str]): レスポンスヘッダー
+        status (int | None, optional): ステータスコード. Defaults to 429.
+
+    Returns:
+        float | None: 待ち時間. 不明な場合はNone
+    """
+    retry_after = _parse_header_float(headers, "retry-after")
+    if retry_after is not None:
+        return retry_after
+    if status != 429:
+        return None
+    # "6m0s" や "120ms" の形式を秒に変換する
+    waits = []
+    for key in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+        value = headers.get(key)
+        if not value:
+            continue
+        seconds = 0.0
+        for number, unit in re.findall(r"([\d.]+)(ms|s|m|h)", value):
+            scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+            seconds += float(number) * scale
+        waits.append(seconds)
+    return max(waits) if waits else None
+
+
+def _estimate_tokens(*texts: str) -> int:
+    """プロンプトのトークン数を概算する関数
+
+    日本語は1文字が1トークン前後になるため、文字数をそのまま使い、
+    出力分として256トークンを加える。
+
+    Args:
+        texts (str): プロンプトのテキスト
+
+    Returns:
+        int: 概算したトークン数
+    """
+    return sum(len(text) for text in texts) + 256
+
+
+class AsyncOpenAIClient:
+    def __init__(
+        self,
+        rpm: int = DEFAULT_RPM,
+        tpm: int = DEFAULT_TPM,
+        max_concurrency: int = MAX_CONCURRENCY,
+        max_retries: int = MAX_RETRIES,
+        timeout: float = 120.0,
+        cache: ResponseCache | None = None,
+    ) -> None:
+        """
+        AsyncOpenAIClientクラスのコンストラクタ
+
+        OpenAIのRPM/TPMのレスポンスヘッダーに合わせてトークンバケットを
+        更新しながら、同時実行数を制限してChatCompletionを呼び出す。
+        同期関数からは、専用スレッドのイベントループ上で実行する。
+
+        Args:
+            rpm (int, optional): 1分あたりのリクエスト数の初期値. Defaults to DEFAULT_RPM.
+            tpm (int, optional): 1分あたりのトークン数の初期値. Defaults to DEFAULT_TPM.
+            max_concurrency (int, optional): 同時に送信するリクエスト数. Defaults to MAX_CONCURRENCY.
+            max_retries (int, optional): 再試行回数の上限. Defaults to MAX_RETRIES.
+            timeout (float, optional): 1リクエストあたりのタイムアウト秒数. Defaults to 120.0.
+            cache (ResponseCache | None, optional): 出力のキャッシュ. Defaults to None.
+        """
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.cache = cache
+        self._loop = None
+        self._loop_lock = threading.Lock()
+        self._session = None
+        self._semaphore = None
+        self._request_bucket = None
+        self._token_bucket = None
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        """専用のイベントループをバックグラウンドスレッドで起動するメソッド"""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=self._loop.run_forever, daemon=True
+                )
+                thread.start()
+        return self._loop
+
+    def run_sync(self, coro: Coroutine) -> Any:
+        """コルーチンを専用のイベントループで実行し、結果を待つメソッド
+
+        Args:
+            coro (Coroutine): 実行するコルーチン
+
+        Returns:
+            Any: コルーチンの戻り値
+        """
+        loop = self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    def _init_async(self) -> None:
+        """イベントループ上で使うオブジェクトを作成するメソッド"""
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._request_bucket = TokenBucket(self.rpm, self.rpm / 60)
+            self._token_bucket = TokenBucket(self.tpm, self.tpm / 60)
+
+    def _update_limits(self, headers: Mapping[str, str]) -> None:
+        """レスポンスヘッダーのレート制限でトークンバケットを更新するメソッド
+
+        Args:
+            headers (Mapping[str, str]): レスポンスヘッダー
+        """
+        self._request_bucket.update(
+            _parse_header_float(headers, "x-ratelimit-limit-requests"),
+            _parse_header_float(headers, "x-ratelimit-remaining-requests"),
+        )
+        self._token_bucket.update(
+            _parse_header_float(headers, "x-ratelimit-limit-tokens"),
+            _parse_header_float(headers, "x-ratelimit-remaining-tokens"),
+        )
+
+    async def get_message(
+        self,
+        text: str,
+        model_name: str = MODEL_NAME,
+        system: str = SYSTEM,
+        use_cache: bool = True,
+    ) -> str:
+        """ChatGPTに文章を生成させる非同期メソッド
+
+        Args:
+            text (str): ユーザーからの入力
+            model_name (str, optional): OpenAIのモデル名. Defaults to MODEL_NAME.
+            system (str, optional): ChatGPTのシステムの入力. Defaults to SYSTEM.
+            use_cache (bool, optional): キャッシュを使うかどうか. Defaults to True.
+
+        Returns:
+            message (str): ChatGPTからの出力
+        """
+        use_cache = use_cache and self.cache is not None
+        # SQLiteの読み書きでイベントループを止めないように、別スレッドで実行する
+        if use_cache:
+            message = await asyncio.to_thread(
+                self.cache.get, model_name, system, text
+            )
+            if message is not None:
+                return message
+
+        message = await self._request_message(text, model_name, system)
+        if use_cache:
+            await asyncio.to_thread(
+                self.cache.put, model_name, system, text, message
+            )
+        return message
+
+    async def _request_message(
+        self, text: str, model_name: str, system: str
+    ) -> str:
+        """ChatCompletionを呼び出す非同期メソッド
+
+        Args:
+            text (str): ユーザーからの入力
+            model_name (str): OpenAIのモデル名
+            system (str): ChatGPTのシステムの入力
+
+        Returns:
+            message (str): ChatGPTからの出力
+        """
+        self._init_async()
+        payload = {
+            "model": model_name,
+            "messages": [
+                {"role": "system", "content": system},
+                {"role": "user", "content": text},
+            ],
+        }
+        headers = {"Authorization": f"Bearer {openai.api_key}"}
+        if openai.organization:
+            headers["OpenAI-Organization"] = openai.organization
+        url = f"{openai.api_base}/chat/completions"
+        n_tokens = _estimate_tokens(system, text)
+
+        for cnt in range(self.max_retries + 1):
+            await self._request_bucket.acquire(1)
+            await self._token_bucket.acquire(n_tokens)
+            async with self._semaphore:
+                try:
+                    async with self._session.post(
+                        url, json=payload, headers=headers
+                    ) as response:
+                        self._update_limits(response.headers)
+                        status = response.status
+                        retry_after = _parse_retry_after(
+                            response.headers, status
+                        )
+                        try:
+                            body = await response.json(content_type=None)
+                        except ValueError as e:
+                            # プロキシのHTMLなど、JSONでない場合はステータスで判断する
+                            print(
+                                f"Error in AsyncOpenAIClient.get_message: {e}"
+                            )
+                            body = {}
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    print(f"Error in AsyncOpenAIClient.get_message: {e}")
+                    status, body, retry_after = None, {}, None
+
+            if status == 200 and "choices" in body:
+                return body["choices"][0]["message"]["content"]
+
+            message = body.get("error", {}).get("message", f"HTTP {status}")
+            # 429と5xx、通信エラーのみ再試行する
+            retryable = status is None or status == 429 or status >= 500
+            if not retryable or cnt == self.max_retries:
+                raise _create_openai_error(message, status)
+            print(message)
+
+            # 指数バックオフ (ジッター付き) で待ってから再試行する
+            wait = retry_after if retry_after else 2**cnt
+            await asyncio.sleep(wait + random.uniform(0, 1))
+
+    async def get_messages(
+        self,
+        texts: List[str],
+        model_name: str = MODEL_NAME,
+        system: str = SYSTEM,
+        use_cache: bool = True,
+    ) -> List[str | Exception]:
+        """複数の入力を並列にChatGPTへ送信する非同期メソッド
+
+        Args:
+            texts (List[str]): ユーザーからの入力のリスト
+            model_name (str, optional): OpenAIのモデル名. Defaults to MODEL_NAME.
+            system (str, optional): ChatGPTのシステムの入力. Defaults to SYSTEM.
+            use_cache (bool, optional): キャッシュを使うかどうか. Defaults to True.
+
+        Returns:
+            List[str | Exception]: textsと同じ順番の出力. 失敗した場合は例外
+        """
+        return await asyncio.gather(
+            *(
+                self.get_message(text, model_name, system, use_cache)
+                for text in texts
+            ),
+            return_exceptions=True,
+        )
+
+
+def _create_openai_error(message: str, status: int | None) -> Exception:
+    """HTTPステータスに対応するopenaiの例外を作成する関数
+
+    Args:
+        message (str): エラーメッセージ
+        status (int | None): HTTPステータス
+
+    Returns:
+        Exception: openaiの例外
+    """
+    if status == 429:
+        return openai.error.RateLimitError(message, http_status=status)
+    if status is not None and 400 <= status < 500:
+        return openai.error.InvalidRequestError(
+            message, param=None, http_status=status
+        )
+    return openai.error.APIError(message, http_status=status)
+
+
+# プロセス全体で共有するOpenAIのクライアント
+openai_client = AsyncOpenAIClient(cache=ResponseCache())
+
+
 def get_message(
-    text: str, model_name: str = MODEL_NAME, system: str = SYSTEM
+    text: str,
+    model_name: str = MODEL_NAME,
+    system: str = SYSTEM,
+    use_cache: bool = True,
 ) -> str:
     """OpenAI APIを使って，ChatGPTに文章を生成させる関数
 
@@ -58,36 +432,36 @@ def get_message(
         text (str): ユーザーからの入力
         model_name (str, optional): OpenAIのモデル名. Defaults to MODEL_NAME.
         system (str, optional): ChatGPTのシステムの入力. Defaults to SYSTEM.
+        use_cache (bool, optional): キャッシュを使うかどうか. Defaults to True.
 
     Returns:
         message (str): ChatGPTからの出力
     """
-    cnt = 0
-    while True:
-        try:
-            response = openai.ChatCompletion.create(
-                model=model_name,
-                messages=[
-                    {"role": "system", "content": system},
-                    {"role": "user", "content": text},
-                ],
-            )
-            break
-        # OpenAIのAPIのエラー処理
-        except (
-            openai.error.RateLimitError,
-            openai.error.InvalidRequestError,
-        ) as e:
-            print(e.user_message)
-            time.sleep(20)
-            cnt += 1
-            # 3回失敗したら終了
-            if cnt == 3:
-                raise e
-
-    time.sleep(5)
-    message = response.choices[0]["message"]["content"]
-    return message
+    return openai_client.run_sync(
+        openai_client.get_message(text, model_name, system, use_cache)
+    )
+
+
+def get_messages(
+    texts: List[str],
+    model_name: str = MODEL_NAME,
+    system: str = SYSTEM,
+    use_cache: bool = True,
+) -> List[str | Exception]:
+    """OpenAI APIを使って，複数の入力を並列にChatGPTへ送信する関数
+
+    Args:
+        texts (List[str]): ユーザーからの入力のリスト
+        model_name (str, optional): OpenAIのモデル名. Defaults to MODEL_NAME.
+        system (str, optional): ChatGPTのシステムの入力. Defaults to SYSTEM.
+        use_cache (bool, optional): キャッシュを使うかどうか. Defaults to True.
+
+    Returns:
+        List[str | Exception]: textsと同じ順番の出力. 失敗した場合は例外
+    """
+    return openai_client.run_sync(
+        openai_client.get_messages(texts, model_name, system, use_cache)
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,56 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class SQLiteDatabase:
+    def __init__(self, db_path: str, schema: str, timeout: float = 30) -> None:
+        """
+        SQLiteDatabaseクラスのコンストラクタ
+
+        最初に接続するときにSQLiteファイルとテーブルを作成し、
+        以降は呼び出しごとに接続を開いて、トランザクションを確定してから閉じる。
+
+        Args:
+            db_path (str): SQLiteファイルのパス
+            schema (str): テーブルを作成するSQL. CREATE ... IF NOT EXISTSで書く
+            timeout (float, optional): ロックを待つ秒数. Defaults to 30.
+        """
+        self.db_path = db_path
+        self.schema = schema
+        self.timeout = timeout
+        self._is_initialized = False
+        self._init_lock = threading.Lock()
+
+    def _initialize(self) -> None:
+        """SQLiteファイルとテーブルを作成するメソッド"""
+        with self._init_lock:
+            if self._is_initialized:
+                return
+            dir_path = os.path.dirname(os.path.abspath(self.db_path))
+            os.makedirs(dir_path, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout)
+            try:
+                with conn:
+                    conn.executescript(self.schema)
+            finally:
+                conn.close()
+            self._is_initialized = True
+
+    @contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        """トランザクションを確定してから接続を閉じるコンテキストマネージャ
+
+        Yields:
+            sqlite3.Connection: SQLiteの接続
+        """
+        if not self._is_initialized:
+            self._initialize()
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
@@ -1,50 +1,50 @@
+import hashlib
+import json
 import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Dict
+from typing import Any, Callable, Dict, List, Tuple
 
 import notion_client as client
 from notion_client import errors
 
-PROPERTIES = {
-    "Title": {
-        "title": [
-            {
-                "type": "text",
-                "text": {
-                    "content": "",
-                },
-            }
-        ]
-    },
-    "URL": {
-        "url": "",
-    },
-    "Type": {
-        "select": {
-            "name": "paper",
-        }
-    },
-    "Author": {
-        "rich_text": [
-            {
-                "type": "text",
-                "text": {
-                    "content": "",
-                },
-            }
-        ]
-    },
-    "Conference": {
-        "select": {
-            "name": "arXiv",
-        }
-    },
-    "Published": {
-        "date": {
-            "start": "",
-        }
-    },
-}
+from src.NotionMarkdown import markdown_to_blocks, split_rich_text
+from src.SQLiteUtils import SQLiteDatabase
+
+# 1回のリクエストで送れるブロック数の上限
+NOTION_MAX_CHILDREN = 100
+# リクエストの再試行回数の上限
+NOTION_MAX_RETRIES = 5
+# Notion APIの平均リクエスト数の上限 (1秒あたり)
+NOTION_REQUESTS_PER_SECOND = float(
+    os.getenv("NOTION_REQUESTS_PER_SECOND", "3.0")
+)
+# 同時に送るリクエスト数の上限
+NOTION_MAX_CONCURRENCY = int(os.getenv("NOTION_MAX_CONCURRENCY", "3"))
+# 複数の論文をまとめて書き込むときに、同時に作成するページ数
+NOTION_PAGE_WORKERS = int(os.getenv("NOTION_PAGE_WORKERS", "3"))
+
+# Entry_idとNotionページの対応の保存先
+NOTION_PAGE_INDEX_PATH = "./data/notion_pages.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    entry_id TEXT PRIMARY KEY,
+    page_id TEXT NOT NULL,
+    page_url TEXT,
+    properties_hash TEXT,
+    block_hashes TEXT,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS seeded_databases (
+    database_id TEXT PRIMARY KEY,
+    seeded REAL NOT NULL
+);
+"""
 
 # インスタンスの作成
 notion_client = client.Client(auth=os.getenv("NOTION_API_KEY"))
@@ -78,170 +78,758 @@ def check_connect_notion() -> None:
         return None
 
 
-def set_title_property(doc_info: Dict[str, str]) -> None:
-    """Notionページのタイトルプロパティを設定する関数
+def _to_notion_date(published: str | None) -> str | None:
+    """GROBIDの日付 ("%d %b %Y") をNotionの日付 ("%Y-%m-%d") に変換する関数
 
     Args:
-        doc_info (Dict[str, str]): ページの情報
+        published (str | None): 投稿日
+
+    Returns:
+        str | None: Notionの日付. 変換できない場合はNone
     """
-    PROPERTIES["Title"]["title"][0]["text"]["content"] = doc_info["Title"]
+    if not published:
+        return None
+    try:
+        return datetime.strptime(published, "%d %b %Y").strftime("%Y-%m-%d")
+    except ValueError as e:
+        print(f"Error parsing published date: {e}")
+        return None
 
 
-def set_url_property(doc_info: Dict[str, str]) -> None:
-    """NotionページのURLプロパティを設定する関数
+@dataclass(frozen=True)
+class PageProperties:
+    """Notionページのプロパティ
+
+    論文ごとに作成し、ページを作成するたびに新しい辞書に変換するため、
+    並列に書き込んでも他の論文のプロパティと混ざらない。
 
     Args:
-        doc_info (Dict[str, str]): ページの情報
+        title (str): 論文のタイトル
+        url (str): 論文のURL
+        authors (str): 著者
+        published (str | None): 投稿日 ("%Y-%m-%d")
+        type (str): ページの種類
+        conference (str): 会議名
     """
-    PROPERTIES["URL"]["url"] = doc_info["Entry_id"]
+
+    title: str = ""
+    url: str = ""
+    authors: str = ""
+    published: str | None = None
+    type: str = "paper"
+    conference: str = "arXiv"
+
+    @classmethod
+    def from_doc_info(cls, doc_info: Dict[str, str]) -> "PageProperties":
+        """論文の情報からプロパティを作成するメソッド
+
+        Args:
+            doc_info (Dict[str, str]): ページの情報
+
+        Returns:
+            PageProperties: プロパティ
+        """
+        return cls(
+            title=doc_info["Title"],
+            url=doc_info["Entry_id"],
+            authors=doc_info["Authors"],
+            published=_to_notion_date(doc_info.get("Published")),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """pages.createに渡すプロパティの辞書に変換するメソッド
+
+        Returns:
+            Dict[str, Any]: プロパティの辞書
+        """
+        properties = {
+            "Title": {"title": split_rich_text(self.title)},
+            "URL": {"url": self.url},
+            "Type": {"select": {"name": self.type}},
+            "Author": {"rich_text": split_rich_text(self.authors)},
+            "Conference": {"select": {"name": self.conference}},
+        }
+        if self.published is not None:
+            properties["Published"] = {"date": {"start": self.published}}
+        return properties
+
+
+class NotionRateLimiter:
+    def __init__(
+        self,
+        requests_per_second: float = NOTION_REQUESTS_PER_SECOND,
+        max_concurrency: int = NOTION_MAX_CONCURRENCY,
+    ) -> None:
+        """
+        NotionRateLimiterクラスのコンストラクタ
+
+        プロセス全体でNotion APIへの同時リクエスト数を制限し、
+        リクエストの開始間隔を1 / requests_per_second秒以上空ける。
+
+        Args:
+            requests_per_second (float, optional): 1秒あたりのリクエスト数の上限. Defaults to NOTION_REQUESTS_PER_SECOND.
+            max_concurrency (int, optional): 同時リクエスト数の上限. Defaults to NOTION_MAX_CONCURRENCY.
+        """
+        self.interval = (
+            1.0 / requests_per_second if requests_per_second else 0.0
+        )
+        self._semaphore = threading.BoundedSemaphore(max(max_concurrency, 1))
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+
+    def __enter__(self) -> "NotionRateLimiter":
+        self._semaphore.acquire()
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self._semaphore.release()
 
 
-def set_type_property() -> None:
-    """NotionページのTypeプロパティを設定する関数"""
-    PROPERTIES["Type"]["select"]["name"] = "paper"
+# プロセス全体で共有するレートリミッター
+notion_rate_limiter = NotionRateLimiter()
 
 
-def set_author_property(doc_info: Dict[str, str]) -> None:
-    """NotionページのAuthorプロパティを設定する関数
+def _get_retry_after(e: Exception, attempt: int) -> float | None:
+    """再試行までの待ち時間を取得する関数
 
     Args:
-        doc_info (Dict[str, str]): ページの情報
+        e (Exception): Notion APIのエラー
+        attempt (int): 何回目の試行か
+
+    Returns:
+        float | None: 待ち時間 (秒). 再試行しないエラーの場合はNone
     """
-    PROPERTIES["Author"]["rich_text"][0]["text"]["content"] = doc_info[
-        "Authors"
-    ]
+    if isinstance(e, errors.RequestTimeoutError):
+        return float(2**attempt)
+    if not isinstance(e, errors.HTTPResponseError):
+        return None
+    if e.status == 429:
+        # Retry-Afterヘッダーに従う
+        return float(e.headers.get("Retry-After", 2**attempt))
+    if e.status >= 500:
+        return float(2**attempt)
+    return None
 
 
-def set_conference_property() -> None:
-    """NotionページのConferenceプロパティを設定する関数"""
-    PROPERTIES["Conference"]["select"]["name"] = "arXiv"
+def _is_page_gone_error(e: Exception) -> bool:
+    """ページが削除またはアーカイブされたことを示すエラーかを判定する関数
 
+    Args:
+        e (Exception): Notion APIのエラー
 
-def set_published_property(doc_info: Dict[str, str]) -> None:
-    """NotionページのPublishedプロパティを設定する関数
+    Returns:
+        bool: 削除またはアーカイブされたページへの操作で起きたエラーの場合はTrue
+    """
+    status = getattr(e, "status", None)
+    if status == 404:
+        return True
+    # アーカイブ済みのページやブロックを編集すると、400のvalidation_errorになる
+    return status == 400 and "archived" in str(e).lower()
+
+
+def _is_page_archived(page: Dict) -> bool:
+    """pages.retrieveのレスポンスから、ページがアーカイブ済みかを判定する関数
 
     Args:
-        doc_info (Dict[str, str]): ページの情報
+        page (Dict): pages.retrieveのレスポンス
+
+    Returns:
+        bool: アーカイブ済み、またはゴミ箱にある場合はTrue
     """
-    if doc_info["Published"] is None:
-        return
-    PROPERTIES["Published"]["date"]["start"] = datetime.strptime(
-        doc_info["Published"], "%d %b %Y"
-    ).strftime("%Y-%m-%d")
+    return bool(page.get("archived") or page.get("in_trash"))
 
 
-def set_page_properties(doc_info: Dict[str, str]) -> None:
-    """Notionページのプロパティを設定する関数
+def call_notion_api(
+    func: Callable[..., Dict],
+    max_retries: int = NOTION_MAX_RETRIES,
+    limiter: NotionRateLimiter | None = None,
+    **kwargs: Any,
+) -> Dict:
+    """レート制限を守りながらNotion APIを呼び出し、失敗した場合は再試行する関数
 
     Args:
-        doc_info (Dict[str, str]): ページの情報
+        func (Callable[..., Dict]): notion_clientのメソッド
+        max_retries (int, optional): 再試行回数の上限. Defaults to NOTION_MAX_RETRIES.
+        limiter (NotionRateLimiter | None, optional): レートリミッター. Defaults to None.
+
+    Returns:
+        Dict: Notion APIのレスポンス
     """
-    set_title_property(doc_info)
-    set_url_property(doc_info)
-    set_type_property()
-    set_author_property(doc_info)
-    set_conference_property()
-    set_published_property(doc_info)
+    if limiter is None:
+        limiter = notion_rate_limiter
+    for attempt in range(max_retries + 1):
+        try:
+            with limiter:
+                return func(**kwargs)
+        except (errors.HTTPResponseError, errors.RequestTimeoutError) as e:
+            retry_after = _get_retry_after(e, attempt)
+            if retry_after is None or attempt == max_retries:
+                raise
+            print(f"Notion API error: {e}. Retrying in {retry_after}s.")
+            time.sleep(retry_after)
+
+
+def _chunk_blocks(blocks: List[Dict], size: int) -> List[List[Dict]]:
+    """ブロックのリストをsize個ずつに分割する関数
 
+    Args:
+        blocks (List[Dict]): ブロックのリスト
+        size (int): 1つあたりのブロック数
 
-def create_notion_page(payload: Dict) -> None:
-    """Notionページを作成する関数
+    Returns:
+        List[List[Dict]]: 分割したブロックのリスト
+    """
+    return [blocks[i : i + size] for i in range(0, len(blocks), size)]
+
+
+def _hash_json(value: Any) -> str:
+    """JSONに変換できる値のハッシュ値を作成する関数
 
     Args:
-        payload (Dict): ページの情報
+        value (Any): プロパティやブロック
+
+    Returns:
+        str: SHA-256のハッシュ値
     """
-    try:
-        notion_client.pages.create(
-            **{
-                "parent": {"database_id": os.getenv("NOTION_DATABASE_ID")},
-                "icon": {
-                    "type": "emoji",
-                    "emoji": "📄",
-                },
-                "properties": PROPERTIES,
-                **payload,
-            }
+    raw = json.dumps(value, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class NotionPageIndex:
+    def __init__(self, db_path: str = NOTION_PAGE_INDEX_PATH) -> None:
+        """
+        NotionPageIndexクラスのコンストラクタ
+
+        論文のEntry_idと、書き込んだNotionページのID・プロパティのハッシュ値・
+        ブロックごとのハッシュ値を対応付けてSQLiteに保存する。
+        既存のページは、データベースを1度だけ走査して登録する。
+
+        Args:
+            db_path (str, optional): SQLiteファイルのパス. Defaults to NOTION_PAGE_INDEX_PATH.
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = SQLiteDatabase(db_path, _SCHEMA)
+
+    def get(self, entry_id: str) -> Dict[str, Any] | None:
+        """Entry_idのページの情報を取得するメソッド
+
+        Args:
+            entry_id (str): 論文のID
+
+        Returns:
+            Dict[str, Any] | None: ページの情報. 登録されていない場合はNone
+        """
+        with self._db.connect() as conn:
+            row = conn.execute(
+                "SELECT page_id, page_url, properties_hash, block_hashes"
+                " FROM pages WHERE entry_id = ?",
+                (entry_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "page_id": row[0],
+            "page_url": row[1],
+            "properties_hash": row[2],
+            # 走査で登録したページは、ブロックの内容が分からない
+            "block_hashes": None if row[3] is None else json.loads(row[3]),
+        }
+
+    def put(
+        self,
+        entry_id: str,
+        page_id: str,
+        page_url: str | None,
+        properties_hash: str | None = None,
+        block_hashes: List[str] | None = None,
+    ) -> None:
+        """ページの情報を保存するメソッド
+
+        Args:
+            entry_id (str): 論文のID
+            page_id (str): NotionページのID
+            page_url (str | None): NotionページのURL
+            properties_hash (str | None, optional): プロパティのハッシュ値. Defaults to None.
+            block_hashes (List[str] | None, optional): ブロックごとのハッシュ値. Defaults to None.
+        """
+        with self._lock, self._db.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO pages (entry_id, page_id, page_url,"
+                " properties_hash, block_hashes, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    entry_id,
+                    page_id,
+                    page_url,
+                    properties_hash,
+                    None if block_hashes is None else json.dumps(block_hashes),
+                    time.time(),
+                ),
+            )
+        return None
+
+    def remove(self, entry_id: str) -> None:
+        """ページの情報を削除するメソッド
+
+        Args:
+            entry_id (str): 論文のID
+        """
+        with self._lock, self._db.connect() as conn:
+            conn.execute("DELETE FROM pages WHERE entry_id = ?", (entry_id,))
+        return None
+
+    def is_seeded(self, database_id: str) -> bool:
+        """データベースを走査済みかどうかを返すメソッド
+
+        Args:
+            database_id (str): NotionデータベースのID
+
+        Returns:
+            bool: 走査済みの場合はTrue
+        """
+        with self._db.connect() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM seeded_databases WHERE database_id = ?",
+                (database_id,),
+            ).fetchone()
+        return row is not None
+
+    def seed(
+        self,
+        database_id: str,
+        notion: Any = None,
+        limiter: "NotionRateLimiter | None" = None,
+    ) -> int:
+        """データベースのページを走査し、URLプロパティのEntry_idを登録するメソッド
+
+        Args:
+            database_id (str): NotionデータベースのID
+            notion (Any, optional): notion_clientのClient. Defaults to None.
+            limiter (NotionRateLimiter | None, optional): レートリミッター. Defaults to None.
+
+        Returns:
+            int: 新しく登録したページ数
+        """
+        if notion is None:
+            notion = notion_client
+        n_pages = 0
+        start_cursor = None
+        while True:
+            kwargs = {"database_id": database_id, "page_size": 100}
+            if start_cursor is not None:
+                kwargs["start_cursor"] = start_cursor
+            response = call_notion_api(
+                notion.databases.query, limiter=limiter, **kwargs
+            )
+            for page in response.get("results", []):
+                entry_id = page.get("properties", {}).get("URL", {}).get("url")
+                if not entry_id or _is_page_archived(page):
+                    continue
+                # このプロセスで書き込んだページの情報は上書きしない
+                if self.get(entry_id) is None:
+                    self.put(entry_id, page["id"], page.get("url"))
+                    n_pages += 1
+            if not response.get("has_more"):
+                break
+            start_cursor = response.get("next_cursor")
+
+        with self._lock, self._db.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO seeded_databases (database_id, seeded)"
+                " VALUES (?, ?)",
+                (database_id, time.time()),
+            )
+        return n_pages
+
+
+# プロセス全体で共有するページの対応表
+notion_page_index = NotionPageIndex()
+
+
+class NotionPageWriter:
+    def __init__(
+        self,
+        notion: Any = None,
+        limiter: NotionRateLimiter | None = None,
+        max_children: int = NOTION_MAX_CHILDREN,
+        max_retries: int = NOTION_MAX_RETRIES,
+    ) -> None:
+        """
+        NotionPageWriterクラスのコンストラクタ
+
+        ページを最初のNOTION_MAX_CHILDREN個のブロックで作成し、残りのブロックは
+        blocks.children.appendで同じ数ずつ追記する。Notionは追記した順に
+        ブロックを並べるため、1つのページへの追記は順番に行い、
+        並列化はプロセス全体で共有するレートリミッターの範囲で、ページ単位に行う。
+
+        Args:
+            notion (Any, optional): notion_clientのClient. Defaults to None.
+            limiter (NotionRateLimiter | None, optional): レートリミッター. Defaults to None.
+            max_children (int, optional): 1回のリクエストで送るブロック数. Defaults to NOTION_MAX_CHILDREN.
+            max_retries (int, optional): 再試行回数の上限. Defaults to NOTION_MAX_RETRIES.
+        """
+        self.notion = notion if notion is not None else notion_client
+        self.limiter = limiter if limiter is not None else notion_rate_limiter
+        self.max_children = min(max_children, NOTION_MAX_CHILDREN)
+        self.max_retries = max_retries
+
+    def _call(self, func: Callable[..., Dict], **kwargs: Any) -> Dict:
+        return call_notion_api(
+            func, max_retries=self.max_retries, limiter=self.limiter, **kwargs
+        )
+
+    def create_page(self, page: Dict, blocks: List[Dict]) -> str | None:
+        """ブロックを分割して送りながらNotionページを作成するメソッド
+
+        Args:
+            page (Dict): childrenを除いたpages.createの引数
+            blocks (List[Dict]): ページに書き込むブロックのリスト
+
+        Returns:
+            str | None: 作成したページのURL. 失敗した場合はNone
+        """
+        response, _ = self._create_page(page, blocks)
+        return None if response is None else response.get("url")
+
+    def _create_page(
+        self, page: Dict, blocks: List[Dict]
+    ) -> Tuple[Dict | None, bool]:
+        """Notionページを作成し、レスポンスと全てのブロックを書き込めたかを返すメソッド
+
+        Args:
+            page (Dict): childrenを除いたpages.createの引数
+            blocks (List[Dict]): ページに書き込むブロックのリスト
+
+        Returns:
+            Tuple[Dict | None, bool]: pages.createのレスポンスと、全てのブロックを書き込めたかどうか
+        """
+        chunks = _chunk_blocks(blocks, self.max_children) or [[]]
+        try:
+            response = self._call(
+                self.notion.pages.create, **page, children=chunks[0]
+            )
+        except (errors.HTTPResponseError, errors.RequestTimeoutError) as e:
+            print(f"Error writing message: {e}")
+            return None, False
+
+        page_url = response.get("url")
+        for chunk in chunks[1:]:
+            try:
+                self._call(
+                    self.notion.blocks.children.append,
+                    block_id=response["id"],
+                    children=chunk,
+                )
+            except (errors.HTTPResponseError, errors.RequestTimeoutError) as e:
+                # 作成済みのページは残し、書き込めたところまでを返す
+                print(f"Error appending blocks to {page_url}: {e}")
+                return response, False
+        return response, True
+
+    def upsert_page(
+        self,
+        entry_id: str,
+        page: Dict,
+        blocks: List[Dict],
+        index: NotionPageIndex | None = None,
+    ) -> str | None:
+        """Entry_idのページがあれば更新し、なければ作成するメソッド
+
+        プロパティとブロックが前回と同じ場合は、ページが残っていることだけを確認する。
+        ブロックが変わった場合は、先頭と末尾の変わっていないブロックを残し、
+        間のブロックだけを置き換える。ページが削除・アーカイブされていた場合は作り直す。
+
+        Args:
+            entry_id (str): 論文のID
+            page (Dict): childrenを除いたpages.createの引数
+            blocks (List[Dict]): ページに書き込むブロックのリスト
+            index (NotionPageIndex | None, optional): ページの対応表. Defaults to None.
+
+        Returns:
+            str | None: 作成・更新したページのURL. 失敗した場合はNone
+        """
+        if index is None:
+            index = notion_page_index
+        record = index.get(entry_id)
+        database_id = page.get("parent", {}).get("database_id")
+        if record is None and database_id and not index.is_seeded(database_id):
+            # 対応表を作る前に作成されたページを登録する
+            try:
+                n_pages = index.seed(database_id, self.notion, self.limiter)
+                print(f"Indexed {n_pages} existing Notion pages")
+            except (errors.HTTPResponseError, errors.RequestTimeoutError) as e:
+                print(f"Error indexing Notion pages: {e}")
+            record = index.get(entry_id)
+
+        properties_hash = _hash_json(page.get("properties", {}))
+        block_hashes = [_hash_json(block) for block in blocks]
+        if record is None:
+            response, is_complete = self._create_page(page, blocks)
+            if response is None:
+                return None
+            index.put(
+                entry_id,
+                response["id"],
+                response.get("url"),
+                properties_hash,
+                block_hashes if is_complete else None,
+            )
+            return response.get("url")
+
+        if (
+            record["properties_hash"] == properties_hash
+            and record["block_hashes"] == block_hashes
+        ):
+            # 書き込む内容が同じでも、アーカイブされたページのURLは返さない
+            if self.is_page_alive(record["page_id"]):
+                return record["page_url"]
+            index.remove(entry_id)
+            return self.upsert_page(entry_id, page, blocks, index)
+
+        try:
+            if record["properties_hash"] != properties_hash:
+                self._call(
+                    self.notion.pages.update,
+                    page_id=record["page_id"],
+                    properties=page.get("properties", {}),
+                )
+            self._replace_blocks(
+                record["page_id"], record["block_hashes"], blocks, block_hashes
+            )
+        except (errors.HTTPResponseError, errors.RequestTimeoutError) as e:
+            if _is_page_gone_error(e):
+                # ページが削除・アーカイブされていた場合は、作り直す
+                index.remove(entry_id)
+                return self.upsert_page(entry_id, page, blocks, index)
+            print(f"Error updating {record['page_url']}: {e}")
+            # ページの状態が分からないため、次回は全てのブロックを置き換える
+            index.put(
+                entry_id, record["page_id"], record["page_url"], None, None
+            )
+            return None
+
+        index.put(
+            entry_id,
+            record["page_id"],
+            record["page_url"],
+            properties_hash,
+            block_hashes,
+        )
+        return record["page_url"]
+
+    def is_page_alive(self, page_id: str) -> bool:
+        """ページが削除・アーカイブされていないかを確認するメソッド
+
+        Args:
+            page_id (str): NotionページのID
+
+        Returns:
+            bool: 削除・アーカイブされていない場合はTrue. 確認できなかった場合もTrue
+        """
+        try:
+            page = self._call(self.notion.pages.retrieve, page_id=page_id)
+        except (errors.HTTPResponseError, errors.RequestTimeoutError) as e:
+            if _is_page_gone_error(e):
+                return False
+            # 一時的なエラーでページを作り直さないように、存在するとみなす
+            print(f"Error retrieving Notion page {page_id}: {e}")
+            return True
+        return not _is_page_archived(page)
+
+    def _list_block_ids(self, page_id: str) -> List[str]:
+        """ページ直下のブロックのIDを順に取得するメソッド
+
+        Args:
+            page_id (str): NotionページのID
+
+        Returns:
+            List[str]: ブロックのIDのリスト
+        """
+        block_ids = []
+        start_cursor = None
+        while True:
+            kwargs = {"block_id": page_id, "page_size": self.max_children}
+            if start_cursor is not None:
+                kwargs["start_cursor"] = start_cursor
+            response = self._call(self.notion.blocks.children.list, **kwargs)
+            block_ids.extend(block["id"] for block in response["results"])
+            if not response.get("has_more"):
+                return block_ids
+            start_cursor = response.get("next_cursor")
+
+    def _replace_blocks(
+        self,
+        page_id: str,
+        old_hashes: List[str] | None,
+        blocks: List[Dict],
+        new_hashes: List[str],
+    ) -> None:
+        """変わったブロックだけを削除・追加するメソッド
+
+        Args:
+            page_id (str): NotionページのID
+            old_hashes (List[str] | None): 前回書き込んだブロックのハッシュ値. 不明な場合はNone
+            blocks (List[Dict]): 新しいブロックのリスト
+            new_hashes (List[str]): 新しいブロックのハッシュ値
+        """
+        if old_hashes == new_hashes:
+            return None
+        block_ids = self._list_block_ids(page_id)
+        start, n_suffix = 0, 0
+        if old_hashes is not None and len(old_hashes) == len(block_ids):
+            n_common = min(len(old_hashes), len(new_hashes))
+            while start < n_common and old_hashes[start] == new_hashes[start]:
+                start += 1
+            while (
+                n_suffix < n_common - start
+                and old_hashes[-1 - n_suffix] == new_hashes[-1 - n_suffix]
+            ):
+                n_suffix += 1
+        if start == 0:
+            # afterを指定しない追記は末尾に入るため、先頭から全て置き換える
+            n_suffix = 0
+
+        end_old = len(block_ids) - n_suffix
+        end_new = len(blocks) - n_suffix
+        for block_id in block_ids[start:end_old]:
+            self._call(self.notion.blocks.delete, block_id=block_id)
+        after = block_ids[start - 1] if start > 0 else None
+        for chunk in _chunk_blocks(blocks[start:end_new], self.max_children):
+            kwargs = {"block_id": page_id, "children": chunk}
+            if after is not None:
+                kwargs["after"] = after
+            response = self._call(self.notion.blocks.children.append, **kwargs)
+            after = response["results"][-1]["id"]
+        print(
+            f"Replaced {end_old - start} blocks with {end_new - start} blocks"
         )
-    except errors.APIResponseError as e:
-        print(f"Error writing message: {e}")
+        return None
+
+
+def is_notion_page_alive(page_url: str) -> bool:
+    """NotionページのURLから、ページが削除・アーカイブされていないかを確認する関数
+
+    Args:
+        page_url (str): NotionページのURL
+
+    Returns:
+        bool: 削除・アーカイブされていない場合はTrue. 確認できなかった場合もTrue
+    """
+    # URLの末尾の32桁の16進数がページのID
+    match = re.search(r"([0-9a-f]{32})(?:[?#].*)?$", page_url)
+    if match is None:
+        print(f"Invalid Notion page URL: {page_url}")
+        return True
+    return NotionPageWriter().is_page_alive(match.group(1))
+
+
+def create_notion_page(
+    payload: Dict,
+    properties: PageProperties | Dict[str, Any],
+    entry_id: str | None = None,
+) -> str | None:
+    """Notionページを作成する関数
+
+    Args:
+        payload (Dict): ページの情報. childrenは100個を超えてもよい
+        properties (PageProperties | Dict[str, Any]): ページのプロパティ
+        entry_id (str | None, optional): 指定した場合は、同じ論文のページを作らずに更新する. Defaults to None.
+
+    Returns:
+        str | None: 作成したページのURL. 失敗した場合はNone
+    """
+    if isinstance(properties, PageProperties):
+        properties = properties.to_dict()
+    payload = dict(payload)
+    blocks = payload.pop("children", [])
+    page = {
+        "parent": {"database_id": os.getenv("NOTION_DATABASE_ID")},
+        "icon": {
+            "type": "emoji",
+            "emoji": "📄",
+        },
+        "properties": properties,
+        **payload,
+    }
+    if entry_id is not None:
+        return NotionPageWriter().upsert_page(entry_id, page, blocks)
+    return NotionPageWriter().create_page(page, blocks)
 
 
 def set_page_properties_and_create_notion_page(
-    markdown_text: str, doc_info: Dict[str, str]
-) -> None:
+    markdown_text: str, doc_info: Dict[str, str], upsert: bool = False
+) -> str | None:
     """Notionページのプロパティを設定し、ページを作成する関数
 
     Args:
         markdown_text (str): Markdownのテキスト
         doc_info (Dict[str, str]): ページの情報
-    """
-    set_page_properties(doc_info)
-    payload = {"children": []}
-    for sentence in markdown_text.split("\n"):
-        if "#" in sentence:
-            n_head = len(sentence.split(" ")[0])
-            if n_head >= 4:
-                payload["children"].append(
-                    {
-                        "object": "block",
-                        "paragraph": {
-                            "rich_text": [
-                                {
-                                    "text": {
-                                        "content": " ".join(
-                                            sentence.split(" ")[1:]
-                                        )
-                                    }
-                                }
-                            ],
-                        },
-                    }
-                )
-            else:
-                payload["children"].append(
-                    {
-                        "object": "block",
-                        "type": f"heading_{n_head}",
-                        f"heading_{n_head}": {
-                            "rich_text": [
-                                {
-                                    "text": {
-                                        "content": " ".join(
-                                            sentence.split(" ")[1:]
-                                        )
-                                    }
-                                }
-                            ]
-                        },
-                    }
-                )
-        else:
-            payload["children"].append(
-                {
-                    "object": "block",
-                    "paragraph": {
-                        "rich_text": [
-                            {"text": {"content": sentence}},
-                        ]
-                    },
-                }
-            )
+        upsert (bool, optional): Trueの場合は、同じEntry_idのページを更新する. Defaults to False.
 
-    create_notion_page(payload)
+    Returns:
+        str | None: 作成したページのURL. 失敗した場合はNone
+    """
+    properties = PageProperties.from_doc_info(doc_info)
+    payload = {"children": markdown_to_blocks(markdown_text)}
+    entry_id = properties.url if upsert else None
+    return create_notion_page(payload, properties, entry_id=entry_id)
 
 
 def write_markdown_to_notion(
-    markdown_text: str, doc_info: Dict[str, str]
-) -> None:
+    markdown_text: str, doc_info: Dict[str, str], upsert: bool = False
+) -> str | None:
     """NotionページにMarkdownを書き込む関数
 
     Args:
         markdown_text (str): Markdownのテキスト
         doc_info (Dict[str, str]): ページの情報
+        upsert (bool, optional): Trueの場合は、同じEntry_idのページがあれば、変わったブロックだけを書き換える. Defaults to False.
+
+    Returns:
+        str | None: 作成したページのURL. 失敗した場合はNone
     """
     if not isinstance(markdown_text, str) or not isinstance(doc_info, dict):
         raise TypeError("Invalid input type")
-    set_page_properties_and_create_notion_page(markdown_text, doc_info)
+    return set_page_properties_and_create_notion_page(
+        markdown_text, doc_info, upsert=upsert
+    )
+
+
+def write_markdowns_to_notion(
+    papers: List[Tuple[str, Dict[str, str]]],
+    max_workers: int = NOTION_PAGE_WORKERS,
+    upsert: bool = False,
+) -> List[str | None]:
+    """複数の論文のNotionページを並列に作成する関数
+
+    全てのページは同じnotion_clientとレートリミッターを共有する。
+
+    Args:
+        papers (List[Tuple[str, Dict[str, str]]]): (Markdownのテキスト, ページの情報) のリスト
+        max_workers (int, optional): 同時に作成するページ数. Defaults to NOTION_PAGE_WORKERS.
+        upsert (bool, optional): Trueの場合は、同じEntry_idのページを更新する. Defaults to False.
+
+    Returns:
+        List[str | None]: papersと同じ順番の、作成したページのURL. 失敗した場合はNone
+    """
+
+    def _write(paper: Tuple[str, Dict[str, str]]) -> str | None:
+        try:
+            return write_markdown_to_notion(*paper, upsert=upsert)
+        except Exception as e:
+            # 1本の失敗で、他の論文の書き込みを止めない
+            print(f"Error writing markdown to notion: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+        return list(executor.map(_write, papers))
 
 
 if __name__ == "__main__":
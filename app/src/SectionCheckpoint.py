@@ -0,0 +1,225 @@
+import hashlib
+import sqlite3
+import time
+from typing import Any, Dict
+
+from src.SQLiteUtils import SQLiteDatabase
+
+# セクション要約のチェックポイントの保存先
+SECTION_CHECKPOINT_PATH = "./data/section_checkpoints.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS section_summaries (
+    paper_id TEXT NOT NULL,
+    section_index INTEGER NOT NULL,
+    prompt_hash TEXT NOT NULL,
+    model_id TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (paper_id, section_index, prompt_hash, model_id)
+);
+"""
+
+
+def hash_prompt(*texts: str) -> str:
+    """プロンプトを構成するテキストからハッシュ値を作成する関数
+
+    Args:
+        texts (str): システムプロンプト・テンプレート・セクションのテキストなど
+
+    Returns:
+        str: SHA-256のハッシュ値
+    """
+    sha256 = hashlib.sha256()
+    for text in texts:
+        sha256.update(text.encode("utf-8"))
+        # 区切りを入れて、("ab", "c") と ("a", "bc") を区別する
+        sha256.update(b"\0")
+    return sha256.hexdigest()
+
+
+class SectionCheckpointStore:
+    def __init__(self, db_path: str = SECTION_CHECKPOINT_PATH) -> None:
+        """
+        SectionCheckpointStoreクラスのコンストラクタ
+
+        セクションの要約が完成するたびに、
+        (論文ID, セクション番号, プロンプトのハッシュ値, モデルID) をキーにして保存する。
+        要約が途中で失敗しても、再実行時には保存済みのセクションを飛ばして再開できる。
+        プロンプトやモデルを変えた場合は、キーが変わるので要約し直される。
+
+        Args:
+            db_path (str, optional): SQLiteファイルのパス. Defaults to SECTION_CHECKPOINT_PATH.
+        """
+        self.db_path = db_path
+        self._db = SQLiteDatabase(db_path, _SCHEMA)
+
+    def get(
+        self, paper_id: str, section_index: int, prompt_hash: str, model_id: str
+    ) -> str | None:
+        """保存済みのセクションの要約を取得するメソッド
+
+        Args:
+            paper_id (str): 論文のID
+            section_index (int): セクションの番号
+            prompt_hash (str): プロンプトのハッシュ値
+            model_id (str): モデルのID
+
+        Returns:
+            str | None: 要約. 保存されていない場合はNone
+        """
+        try:
+            with self._db.connect() as conn:
+                row = conn.execute(
+                    "SELECT summary FROM section_summaries"
+                    " WHERE paper_id = ? AND section_index = ?"
+                    " AND prompt_hash = ? AND model_id = ?",
+                    (paper_id, section_index, prompt_hash, model_id),
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Error in SectionCheckpointStore.get: {e}")
+            return None
+        return None if row is None else row[0]
+
+    def put(
+        self,
+        paper_id: str,
+        section_index: int,
+        prompt_hash: str,
+        model_id: str,
+        summary: str,
+    ) -> None:
+        """セクションの要約を保存するメソッド
+
+        Args:
+            paper_id (str): 論文のID
+            section_index (int): セクションの番号
+            prompt_hash (str): プロンプトのハッシュ値
+            model_id (str): モデルのID
+            summary (str): 要約
+        """
+        try:
+            with self._db.connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO section_summaries"
+                    " (paper_id, section_index, prompt_hash, model_id,"
+                    " summary, created) VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        paper_id,
+                        section_index,
+                        prompt_hash,
+                        model_id,
+                        summary,
+                        time.time(),
+                    ),
+                )
+        except sqlite3.Error as e:
+            print(f"Error in SectionCheckpointStore.put: {e}")
+        return None
+
+    def remove(self, paper_id: str) -> None:
+        """論文のチェックポイントを全て削除するメソッド
+
+        Args:
+            paper_id (str): 論文のID
+        """
+        try:
+            with self._db.connect() as conn:
+                conn.execute(
+                    "DELETE FROM section_summaries WHERE paper_id = ?",
+                    (paper_id,),
+                )
+        except sqlite3.Error as e:
+            print(f"Error in SectionCheckpointStore.remove: {e}")
+        return None
+
+    def stats(self, paper_id: str) -> Dict[str, int]:
+        """論文の保存済みセクション数を返すメソッド
+
+        Args:
+            paper_id (str): 論文のID
+
+        Returns:
+            Dict[str, int]: 保存済みのセクション数
+        """
+        with self._db.connect() as conn:
+            n_sections = conn.execute(
+                "SELECT COUNT(DISTINCT section_index) FROM section_summaries"
+                " WHERE paper_id = ?",
+                (paper_id,),
+            ).fetchone()[0]
+        return {"sections": n_sections}
+
+
+# プロセス全体で共有するチェックポイント
+section_checkpoint_store = SectionCheckpointStore()
+
+
+class SectionCheckpoint:
+    def __init__(
+        self,
+        paper_id: str,
+        model_id: str,
+        prompt_texts: tuple = (),
+        store: SectionCheckpointStore | None = None,
+    ) -> None:
+        """
+        SectionCheckpointクラスのコンストラクタ
+
+        1本の論文の要約で使う、論文IDとモデルIDを固定したチェックポイント。
+
+        Args:
+            paper_id (str): 論文のID
+            model_id (str): モデルのID
+            prompt_texts (tuple, optional): セクション以外のプロンプトのテキスト. Defaults to ().
+            store (SectionCheckpointStore | None, optional): 保存先. Defaults to None.
+        """
+        self.paper_id = paper_id
+        self.model_id = model_id
+        self.prompt_texts = tuple(prompt_texts)
+        self.store = store if store is not None else section_checkpoint_store
+        self.hits = 0
+
+    def _prompt_hash(self, document: Any) -> str:
+        # セクションのタイトルと本文が変わった場合も、要約し直す
+        title = document.metadata.get("Section Title", "")
+        return hash_prompt(*self.prompt_texts, title, document.text)
+
+    def get(self, section_index: int, document: Any) -> str | None:
+        """保存済みのセクションの要約を取得するメソッド
+
+        Args:
+            section_index (int): セクションの番号
+            document (Any): セクションのDocument
+
+        Returns:
+            str | None: 要約. 保存されていない場合はNone
+        """
+        summary = self.store.get(
+            self.paper_id,
+            section_index,
+            self._prompt_hash(document),
+            self.model_id,
+        )
+        if summary is not None:
+            self.hits += 1
+        return summary
+
+    def put(self, section_index: int, document: Any, summary: str) -> None:
+        """セクションの要約を保存するメソッド
+
+        Args:
+            section_index (int): セクションの番号
+            document (Any): セクションのDocument
+            summary (str): 要約
+        """
+        if not summary:
+            return None
+        self.store.put(
+            self.paper_id,
+            section_index,
+            self._prompt_hash(document),
+            self.model_id,
+            summary,
+        )
+        return None
@@ -0,0 +1,409 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Tuple
+
+from src.SQLiteUtils import SQLiteDatabase
+
+# ジョブキューの保存先
+SLACK_JOB_DB_PATH = "./data/slack_jobs.sqlite3"
+# ワーカー数・キューの上限・1ユーザーあたりの待ちジョブ数の上限
+SLACK_JOB_WORKERS = int(os.getenv("SLACK_JOB_WORKERS", "2"))
+SLACK_JOB_QUEUE_MAX = int(os.getenv("SLACK_JOB_QUEUE_MAX", "20"))
+SLACK_JOB_USER_MAX = int(os.getenv("SLACK_JOB_USER_MAX", "5"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    user TEXT NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created);
+"""
+
+_RESULT_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    entry_id TEXT PRIMARY KEY,
+    page_url TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+
+@dataclass
+class SummaryJob:
+    """PDF要約ジョブ
+
+    Args:
+        job_id (str): ジョブID. Slackの再送で重複しないようにイベントから作る
+        user (str): 依頼したユーザーID
+        channel_id (str): チャンネルID
+        thread_ts (str): スレッドのタイムスタンプ
+        message (str): ユーザーからの入力
+        thread_message (dict): スレッドの最初のメッセージ
+        entry_id (str): 論文のID. 同じ論文のジョブを1つにまとめるために使う
+        created (float): 受け付けた時刻
+    """
+
+    job_id: str
+    user: str
+    channel_id: str
+    thread_ts: str
+    message: str
+    thread_message: Dict[str, Any] = field(default_factory=dict)
+    entry_id: str = ""
+    created: float = field(default_factory=time.time)
+
+
+class SummaryJobQueue:
+    def __init__(
+        self,
+        handler: Callable[[SummaryJob], Any],
+        db_path: str = SLACK_JOB_DB_PATH,
+        n_workers: int = SLACK_JOB_WORKERS,
+        max_depth: int = SLACK_JOB_QUEUE_MAX,
+        max_per_user: int = SLACK_JOB_USER_MAX,
+        notifier: Callable[[SummaryJob, Any, Exception | None], Any]
+        | None = None,
+    ) -> None:
+        """
+        SummaryJobQueueクラスのコンストラクタ
+
+        受け付けたジョブをSQLiteに保存し、ワーカースレッドで順に処理する。
+        ジョブはユーザーごとのキューに入れ、ユーザー間でラウンドロビンに
+        取り出すので、1人が大量に依頼しても他のユーザーが待たされない。
+        再起動時には、未完了のジョブを読み込んで処理を再開する。
+        同じ論文 (entry_id) のジョブが待機中または実行中の場合は、
+        新しいジョブを実行せずにそのジョブに相乗りさせ、結果をnotifierで通知する。
+
+        Args:
+            handler (Callable[[SummaryJob], Any]): ジョブを処理する関数
+            db_path (str, optional): SQLiteファイルのパス. Defaults to SLACK_JOB_DB_PATH.
+            n_workers (int, optional): ワーカー数. Defaults to SLACK_JOB_WORKERS.
+            max_depth (int, optional): 待ちジョブ数の上限. Defaults to SLACK_JOB_QUEUE_MAX.
+            max_per_user (int, optional): 1ユーザーあたりの待ちジョブ数の上限. Defaults to SLACK_JOB_USER_MAX.
+            notifier (Callable[[SummaryJob, Any, Exception | None], Any] | None, optional): 相乗りしたジョブに結果を通知する関数. Defaults to None.
+        """
+        self.handler = handler
+        self.db_path = db_path
+        self.n_workers = max(n_workers, 1)
+        self.max_depth = max_depth
+        self.max_per_user = max_per_user
+        self.notifier = notifier
+        # ユーザーID -> 待ちジョブのキュー. 先頭のユーザーから取り出す
+        self._user_queues: "OrderedDict[str, Deque[SummaryJob]]" = OrderedDict()
+        self._job_ids = set()
+        # entry_id -> 待機中または実行中のジョブ / 相乗りしているジョブ
+        self._leaders: Dict[str, SummaryJob] = {}
+        self._followers: Dict[str, List[SummaryJob]] = {}
+        self._n_running = 0
+        self._cond = threading.Condition()
+        self._workers: List[threading.Thread] = []
+        self._db = SQLiteDatabase(db_path, _SCHEMA)
+
+    def start(self) -> None:
+        """未完了のジョブを読み込み、ワーカースレッドを起動するメソッド"""
+        with self._cond:
+            if self._workers:
+                return None
+            for job, status in self._load_pending_jobs():
+                if status == "attached" and job.entry_id in self._leaders:
+                    self._attach(job)
+                else:
+                    self._push(job)
+            for i in range(self.n_workers):
+                worker = threading.Thread(
+                    target=self._run_worker,
+                    name=f"SummaryJobWorker-{i}",
+                    daemon=True,
+                )
+                worker.start()
+                self._workers.append(worker)
+            self._cond.notify_all()
+        return None
+
+    def submit(self, job: SummaryJob) -> int | None:
+        """ジョブをキューに追加するメソッド
+
+        Args:
+            job (SummaryJob): 追加するジョブ
+
+        Returns:
+            int | None: 自分より前に待っているジョブ数. キューが一杯の場合はNone
+        """
+        self.start()
+        with self._cond:
+            if job.job_id in self._job_ids or self._is_saved(job.job_id):
+                # Slackの再送などで同じジョブが届いた場合は、追加しない
+                return self._position(job.job_id)
+            leader = self._leaders.get(job.entry_id) if job.entry_id else None
+            if leader is not None:
+                # 同じ論文を処理中の場合は、そのジョブの結果を待つ
+                self._save(job, "attached")
+                self._attach(job)
+                return self._position(leader.job_id)
+            if self.depth() >= self.max_depth:
+                return None
+            user_queue = self._user_queues.get(job.user, ())
+            if len(user_queue) >= self.max_per_user:
+                return None
+            self._save(job, "queued")
+            self._push(job)
+            position = self._position(job.job_id)
+            self._cond.notify()
+        return position
+
+    def is_in_flight(self, entry_id: str) -> bool:
+        """論文のジョブが待機中または実行中かを返すメソッド
+
+        Args:
+            entry_id (str): 論文のID
+
+        Returns:
+            bool: 待機中または実行中かどうか
+        """
+        with self._cond:
+            return bool(entry_id) and entry_id in self._leaders
+
+    def depth(self) -> int:
+        """待ちジョブ数を返すメソッド
+
+        Returns:
+            int: 待ちジョブ数
+        """
+        with self._cond:
+            return sum(len(q) for q in self._user_queues.values())
+
+    def stats(self) -> Dict[str, int]:
+        """キューの状態を返すメソッド
+
+        Returns:
+            Dict[str, int]: 待ちジョブ数・実行中のジョブ数・ユーザー数
+        """
+        with self._cond:
+            return {
+                "queued": self.depth(),
+                "running": self._n_running,
+                "users": len(self._user_queues),
+                "attached": sum(len(f) for f in self._followers.values()),
+            }
+
+    def _push(self, job: SummaryJob) -> None:
+        """ユーザーごとのキューにジョブを追加するメソッド"""
+        self._user_queues.setdefault(job.user, deque()).append(job)
+        self._job_ids.add(job.job_id)
+        if job.entry_id:
+            self._leaders.setdefault(job.entry_id, job)
+
+    def _attach(self, job: SummaryJob) -> None:
+        """同じ論文を処理するジョブにジョブを相乗りさせるメソッド"""
+        self._followers.setdefault(job.entry_id, []).append(job)
+        self._job_ids.add(job.job_id)
+
+    def _pop(self) -> SummaryJob | None:
+        """ユーザー間でラウンドロビンにジョブを取り出すメソッド"""
+        if not self._user_queues:
+            return None
+        user, user_queue = self._user_queues.popitem(last=False)
+        job = user_queue.popleft()
+        if user_queue:
+            # まだジョブが残っているユーザーは末尾に回す
+            self._user_queues[user] = user_queue
+        return job
+
+    def _position(self, job_id: str) -> int:
+        """取り出される順番を計算するメソッド"""
+        queues = [list(q) for q in self._user_queues.values()]
+        order = []
+        for i in range(max((len(q) for q in queues), default=0)):
+            order.extend(q[i].job_id for q in queues if i < len(q))
+        return order.index(job_id) if job_id in order else 0
+
+    def _run_worker(self) -> None:
+        """ジョブを取り出して処理し続けるメソッド"""
+        while True:
+            with self._cond:
+                job = self._pop()
+                while job is None:
+                    self._cond.wait()
+                    job = self._pop()
+                self._n_running += 1
+            self._save(job, "running")
+            result, error = None, None
+            try:
+                result = self.handler(job)
+            except Exception as e:
+                print(f"Error in SummaryJobQueue: {e}")
+                error = e
+            status = "done" if error is None else "failed"
+            self._save(job, status)
+            with self._cond:
+                self._n_running -= 1
+                self._job_ids.discard(job.job_id)
+                followers = []
+                if self._leaders.get(job.entry_id) is job:
+                    del self._leaders[job.entry_id]
+                    followers = self._followers.pop(job.entry_id, [])
+            self._notify_followers(followers, result, error)
+
+    def _notify_followers(
+        self,
+        followers: List[SummaryJob],
+        result: Any,
+        error: Exception | None,
+    ) -> None:
+        """相乗りしたジョブに結果を通知するメソッド"""
+        status = "done" if error is None else "failed"
+        for follower in followers:
+            try:
+                if self.notifier is not None:
+                    self.notifier(follower, result, error)
+            except Exception as e:
+                print(f"Error in SummaryJobQueue._notify_followers: {e}")
+            self._save(follower, status)
+            with self._cond:
+                self._job_ids.discard(follower.job_id)
+
+    def _save(self, job: SummaryJob, status: str) -> None:
+        """ジョブの状態をSQLiteに保存するメソッド"""
+        try:
+            with self._db.connect() as conn:
+                conn.execute(
+                    "INSERT INTO jobs"
+                    " (job_id, user, status, payload, created, updated)"
+                    " VALUES (?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT (job_id) DO UPDATE"
+                    " SET status = excluded.status, updated = excluded.updated",
+                    (
+                        job.job_id,
+                        job.user,
+                        status,
+                        json.dumps(asdict(job), ensure_ascii=False),
+                        job.created,
+                        time.time(),
+                    ),
+                )
+        except sqlite3.Error as e:
+            print(f"Error in SummaryJobQueue._save: {e}")
+
+    def _is_saved(self, job_id: str) -> bool:
+        """ジョブが既に保存されているかを調べるメソッド"""
+        try:
+            with self._db.connect() as conn:
+                row = conn.execute(
+                    "SELECT 1 FROM jobs WHERE job_id = ?", (job_id,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Error in SummaryJobQueue._is_saved: {e}")
+            return False
+        return row is not None
+
+    def get_status(self, job_id: str) -> str | None:
+        """保存されているジョブの状態を返すメソッド
+
+        Args:
+            job_id (str): ジョブID
+
+        Returns:
+            str | None: "queued", "attached", "running", "done", "failed" のいずれか. 保存されていない場合はNone
+        """
+        try:
+            with self._db.connect() as conn:
+                row = conn.execute(
+                    "SELECT status FROM jobs WHERE job_id = ?", (job_id,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Error in SummaryJobQueue.get_status: {e}")
+            return None
+        return None if row is None else row[0]
+
+    def _load_pending_jobs(self) -> List[Tuple[SummaryJob, str]]:
+        """前回の実行で完了しなかったジョブを読み込むメソッド"""
+        try:
+            with self._db.connect() as conn:
+                rows = conn.execute(
+                    "SELECT payload, status FROM jobs"
+                    " WHERE status IN ('queued', 'running', 'attached')"
+                    " ORDER BY created"
+                ).fetchall()
+        except sqlite3.Error as e:
+            print(f"Error in SummaryJobQueue._load_pending_jobs: {e}")
+            return []
+        return [
+            (SummaryJob(**json.loads(payload)), status)
+            for payload, status in rows
+        ]
+
+
+class SummaryResultIndex:
+    def __init__(self, db_path: str = SLACK_JOB_DB_PATH) -> None:
+        """
+        SummaryResultIndexクラスのコンストラクタ
+
+        要約が完了した論文のIDと、書き込んだNotionページのURLを保存する。
+
+        Args:
+            db_path (str, optional): SQLiteファイルのパス. Defaults to SLACK_JOB_DB_PATH.
+        """
+        self.db_path = db_path
+        self._db = SQLiteDatabase(db_path, _RESULT_SCHEMA)
+
+    def get(self, entry_id: str) -> str | None:
+        """要約済みの論文のNotionページのURLを取得するメソッド
+
+        Args:
+            entry_id (str): 論文のID
+
+        Returns:
+            str | None: NotionページのURL. 要約していない場合はNone
+        """
+        try:
+            with self._db.connect() as conn:
+                row = conn.execute(
+                    "SELECT page_url FROM results WHERE entry_id = ?",
+                    (entry_id,),
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Error in SummaryResultIndex.get: {e}")
+            return None
+        return None if row is None else row[0]
+
+    def put(self, entry_id: str, page_url: str) -> None:
+        """要約した論文のNotionページのURLを保存するメソッド
+
+        Args:
+            entry_id (str): 論文のID
+            page_url (str): NotionページのURL
+        """
+        try:
+            with self._db.connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO results"
+                    " (entry_id, page_url, updated) VALUES (?, ?, ?)",
+                    (entry_id, page_url, time.time()),
+                )
+        except sqlite3.Error as e:
+            print(f"Error in SummaryResultIndex.put: {e}")
+        return None
+
+    def remove(self, entry_id: str) -> None:
+        """保存した論文を削除するメソッド. 要約をやり直したい場合に使う
+
+        Args:
+            entry_id (str): 論文のID
+        """
+        try:
+            with self._db.connect() as conn:
+                conn.execute(
+                    "DELETE FROM results WHERE entry_id = ?", (entry_id,)
+                )
+        except sqlite3.Error as e:
+            print(f"Error in SummaryResultIndex.remove: {e}")
+        return None
@@ -1,6 +1,7 @@
 import os
 import shutil
-from typing import Any, Dict, List, Tuple
+import time
+from typing import Any, Callable, Dict, List, Tuple
 
 import torch
 from slack_bolt import App
@@ -8,12 +9,35 @@ from slack_bolt.adapter.socket_mode import SocketModeHandler
 from slack_sdk.errors import SlackApiError
 
 from src.arXivUtils import create_paper_info, download_pdf, get_paper_by_id
-from src.SaveToNotion import write_markdown_to_notion
-from src.Utils import write_markdown
-from src.XMLUtils import DocumentCreator, run_grobid
+from src.GrobidUtils import process_pdf_with_grobid
+from src.SaveToNotion import is_notion_page_alive, write_markdown_to_notion
+from src.SectionCheckpoint import section_checkpoint_store
+from src.SlackJobQueue import (
+    SummaryJob,
+    SummaryJobQueue,
+    SummaryResultIndex,
+)
+from src.Utils import (
+    MarkdownFileSink,
+    consume_markdown_stream,
+    warmup_models,
+    write_markdown,
+    write_markdown_stream,
+)
+from src.XMLUtils import DocumentCreator
 
 # ボットトークンとソケットモードハンドラーを使ってアプリを初期化します
 app = App(token=os.environ["SLACK_BOT_TOKEN"])
+# メッセージ送信の再試行回数の上限
+SLACK_MAX_RETRIES = 5
+# ストリーミング中のメッセージを更新する最小間隔 (秒). chat.updateは1分あたり50回程度まで
+SLACK_UPDATE_INTERVAL = 1.5
+# ストリーミングで1つのメッセージに書き込む最大文字数. 超えたら次のメッセージに続ける
+SLACK_STREAM_MAX_CHARS = 3000
+# 要約の方法. "index"の場合は、DocumentSummaryIndexを保存して次回から再利用する
+SLACK_SUMMARIZER_TYPE = os.getenv("SLACK_SUMMARIZER_TYPE", "batch")
+# DocumentSummaryIndexの保存先. 要約後に削除するPDFのディレクトリとは分けておく
+SUMMARY_INDEX_DIR = os.getenv("SUMMARY_INDEX_DIR", "./data/summary_index")
 
 
 def get_thread_messages(channel_id: str, thread_ts: List[str]) -> List[dict]:
@@ -98,10 +122,21 @@ def _split_thread_text(thread_text: str) -> List[str]:
 
 
 class PDFProcessor:
-    def __init__(self, dir_path: str, pdf_name: str, pdf_info: Dict[str, str]):
+    def __init__(
+        self,
+        dir_path: str,
+        pdf_name: str,
+        pdf_info: Dict[str, str],
+        sinks: List[Any] | None = None,
+        persist_dir: str | None = None,
+    ):
         self.dir_path = dir_path
         self.pdf_name = pdf_name
         self.pdf_info = pdf_info
+        # 指定した場合は、DocumentSummaryIndexを保存して次回から再利用する
+        self.persist_dir = persist_dir
+        # 指定した場合は、要約をトークンごとに書き込む
+        self.sinks = sinks
         self.device = self._get_device()
         self.creator = DocumentCreator()
 
@@ -122,7 +157,9 @@ class PDFProcessor:
     def get_summary_markdown_text(self) -> Dict[str, Any]:
         try:
             self._is_valid_dir_path(self.dir_path)
-            self.dir_path = run_grobid(self.dir_path)
+            self.dir_path = process_pdf_with_grobid(
+                self.dir_path, self.pdf_name
+            )
             if self.dir_path is None:
                 return self._handle_error("Error running Grobid.")
             xml_path = self.dir_path + self.pdf_name + ".tei.xml"
@@ -130,13 +167,19 @@ class PDFProcessor:
             self.creator.input_pdf_info(self.pdf_info)
             docs = self._create_docs()
             doc_info = self.creator.get_doc_info()
+            if self.sinks is not None:
+                markdown_text = self._write_markdown_stream(docs)
+                return {"markdown_text": markdown_text, "doc_info": doc_info}
             markdown_text = write_markdown(
                 documents=docs,
+                persist_dir=self.persist_dir,
                 device=self.device,
                 package_name="llama_index",
                 temperature=0.0,
                 context_window=4096,
                 max_tokens=4096,
+                summarizer_type=SLACK_SUMMARIZER_TYPE,
+                paper_id=self._get_paper_id(),
             )
             with open(f"{self.dir_path}/tmp_markdown.md", mode="w") as f:
                 f.write(markdown_text)
@@ -144,6 +187,25 @@ class PDFProcessor:
         except Exception as e:
             return self._handle_error(str(e))
 
+    def _write_markdown_stream(self, docs: List[Any]) -> str:
+        events = write_markdown_stream(
+            documents=docs,
+            persist_dir=self.persist_dir,
+            device=self.device,
+            package_name="llama_index",
+            temperature=0.0,
+            context_window=4096,
+            max_tokens=4096,
+            summarizer_type=SLACK_SUMMARIZER_TYPE,
+            paper_id=self._get_paper_id(),
+        )
+        file_sink = MarkdownFileSink(f"{self.dir_path}/tmp_markdown.md")
+        return consume_markdown_stream(events, [file_sink, *self.sinks])
+
+    def _get_paper_id(self) -> str:
+        # 要約が途中で失敗しても、再実行時に完成済みのセクションから再開する
+        return self.pdf_info.get("Entry_id") or self.pdf_name
+
     @staticmethod
     def _is_valid_dir_path(dir_path: str) -> None:
         if not os.path.exists(dir_path):
@@ -175,7 +237,11 @@ def process_ping_request(user: str, thread_ts: str, say) -> None:
 
 
 def process_pdf_request(
-    thread_message: dict, user: str, thread_ts: str, say
+    thread_message: dict,
+    user: str,
+    thread_ts: str,
+    say,
+    progress: Callable[[str], None] | None = None,
 ) -> bool:
     """
     PDFファイルの要約を作成する関数
@@ -184,24 +250,71 @@ def process_pdf_request(
         user (str): ユーザーID
         thread_ts (str): スレッドのタイムスタンプ
         say (function): botの発言を行う関数
+        progress (Callable[[str], None] | None, optional): 進捗を通知する関数. Defaults to None.
     """
     try:
-        document_dir_path = _get_document_dir_path()
-        entry_id = _get_entry_id(thread_message)
-        paper = _get_paper(entry_id)
-        pdf_info = _create_pdf_info(paper)
-        dir_path, pdf_name = _download_pdf(paper, document_dir_path)
-        pdf_processor = PDFProcessor(dir_path, pdf_name, pdf_info)
-        summary = pdf_processor.get_summary_markdown_text()
-        write_markdown_to_notion(summary["markdown_text"], summary["doc_info"])
-        _say_summary_complete(user, thread_ts, say)
-        _remove_pdf(dir_path)
+        page_url = summarize_paper(thread_message, progress=progress)
+        _say_summary_complete(user, thread_ts, say, page_url)
         return False
     except Exception as e:
         _handle_error_output_slack(e, thread_ts, say)
         return True
 
 
+def summarize_paper(
+    thread_message: dict,
+    progress: Callable[[str], None] | None = None,
+    sinks: List[Any] | None = None,
+) -> str | None:
+    """
+    スレッドの論文を要約してNotionに書き込む関数
+
+    Args:
+        thread_message (dict): スレッドのメッセージ
+        progress (Callable[[str], None] | None, optional): 進捗を通知する関数. Defaults to None.
+        sinks (List[Any] | None, optional): 要約をトークンごとに書き込む先. Defaults to None.
+
+    Returns:
+        page_url (str | None): 書き込んだNotionページのURL
+    """
+    if progress is None:
+        progress = _ignore_progress
+    document_dir_path = _get_document_dir_path()
+    entry_id = _get_entry_id(thread_message)
+    paper = _get_paper(entry_id)
+    pdf_info = _create_pdf_info(paper)
+    progress("PDFファイルをダウンロードしています")
+    dir_path, pdf_name = _download_pdf(paper, document_dir_path)
+    progress("要約を作成しています")
+    pdf_processor = PDFProcessor(
+        dir_path,
+        pdf_name,
+        pdf_info,
+        sinks=sinks,
+        persist_dir=_get_index_dir_path(pdf_name),
+    )
+    summary = pdf_processor.get_summary_markdown_text()
+    progress("Notionに書き込んでいます")
+    # 同じ論文のページがある場合は、作り直さずに更新する
+    page_url = write_markdown_to_notion(
+        summary["markdown_text"], summary["doc_info"], upsert=True
+    )
+    if page_url:
+        # 次に同じ論文が依頼されたときは、このページを返す
+        summary_result_index.put(entry_id, page_url)
+        # 書き込みが完了した論文のセクションの要約は不要になる
+        section_checkpoint_store.remove(pdf_info.get("Entry_id") or pdf_name)
+    _remove_pdf(dir_path)
+    return page_url
+
+
+def _ignore_progress(text: str) -> None:
+    """
+    進捗を通知しない場合に使う関数
+    """
+    return None
+
+
 def _get_document_dir_path() -> str:
     """
     PDFファイルを保存するディレクトリのパスを取得する関数
@@ -212,6 +325,15 @@ def _get_document_dir_path() -> str:
     return document_dir_path
 
 
+def _get_index_dir_path(pdf_name: str) -> str:
+    """
+    論文のDocumentSummaryIndexを保存するディレクトリのパスを取得する関数
+
+    _remove_pdfで削除されないように、PDFファイルとは別のディレクトリにする
+    """
+    return os.path.join(SUMMARY_INDEX_DIR, pdf_name)
+
+
 def _get_entry_id(thread_message: dict) -> str:
     """
     スレッドメッセージから論文IDを取得する関数
@@ -253,11 +375,16 @@ def _download_pdf(paper: dict, document_dir_path: str) -> Tuple[str, str]:
     return dir_path, pdf_name
 
 
-def _say_summary_complete(user: str, thread_ts: str, say) -> None:
+def _say_summary_complete(
+    user: str, thread_ts: str, say, page_url: str | None = None
+) -> None:
     """
     Slackに要約を書き込む関数
     """
-    say(text=f"<@{user}> 要約が完了しました :robot_face:", thread_ts=thread_ts)
+    text = f"<@{user}> 要約が完了しました :robot_face:"
+    if page_url:
+        text += f"\n{page_url}"
+    say(text=text, thread_ts=thread_ts)
     return None
 
 
@@ -279,7 +406,13 @@ def _handle_error_output_slack(e: Exception, thread_ts: str, say) -> None:
 
 
 def process_thread_message(
-    message: str, thread_message: dict, user: str, thread_ts: str, say
+    message: str,
+    thread_message: dict,
+    user: str,
+    thread_ts: str,
+    say,
+    channel_id: str | None = None,
+    event_ts: str | None = None,
 ) -> bool:
     """
     スレッドのメッセージを処理する関数
@@ -290,6 +423,8 @@ def process_thread_message(
         user (str): ユーザーID
         thread_ts (str): スレッドのタイムスタンプ
         say (function): botの発言を行う関数
+        channel_id (str | None, optional): チャンネルID. 指定した場合は要約をジョブキューで処理する. Defaults to None.
+        event_ts (str | None, optional): イベントのタイムスタンプ. Defaults to None.
     """
     err_flag = True
     if "subtype" in thread_message.keys():
@@ -298,7 +433,13 @@ def process_thread_message(
 
     try:
         err_flag = _process_message(
-            message, thread_message, user, thread_ts, say
+            message,
+            thread_message,
+            user,
+            thread_ts,
+            say,
+            channel_id=channel_id,
+            event_ts=event_ts,
         )
     except ValueError as e:
         # エラーが発生した場合は、エラーメッセージを表示してNoneを返す
@@ -313,7 +454,13 @@ def process_thread_message(
 
 
 def _process_message(
-    message: str, thread_message: dict, user: str, thread_ts: str, say
+    message: str,
+    thread_message: dict,
+    user: str,
+    thread_ts: str,
+    say,
+    channel_id: str | None = None,
+    event_ts: str | None = None,
 ) -> bool:
     """
     メッセージを処理する関数
@@ -324,8 +471,35 @@ def _process_message(
         user (str): ユーザーID
         thread_ts (str): スレッドのタイムスタンプ
         say (function): botの発言を行う関数
-    """
-    if "要約" in message:
+        channel_id (str | None, optional): チャンネルID. Defaults to None.
+        event_ts (str | None, optional): イベントのタイムスタンプ. Defaults to None.
+    """
+    if channel_id is not None and ("要約" in message or "pdf" in message):
+        entry_id = get_entry_id_from_thread_text(thread_message.get("text"))
+        page_url = summary_result_index.get(entry_id) if entry_id else None
+        if page_url is not None and not is_notion_page_alive(page_url):
+            # Notionでページが削除・アーカイブされていた場合は、要約し直す
+            summary_result_index.remove(entry_id)
+            page_url = None
+        if page_url is not None:
+            # 要約済みの論文の場合は、既存のNotionページを返す
+            say(
+                text=f"<@{user}> この論文は要約済みです :robot_face:\n{page_url}",
+                thread_ts=thread_ts,
+            )
+            return False
+        # 時間のかかる処理はジョブキューに入れて、すぐに応答する
+        job = SummaryJob(
+            job_id=f"{channel_id}:{event_ts or thread_ts}",
+            user=user,
+            channel_id=channel_id,
+            thread_ts=thread_ts,
+            message=message,
+            thread_message=thread_message,
+            entry_id=entry_id,
+        )
+        return submit_summary_job(job, say)
+    elif "要約" in message:
         # 要約を作成する
         return process_pdf_request(thread_message, user, thread_ts, say)
     elif "pdf" in message:
@@ -369,7 +543,13 @@ def process_mention_event(body, logger, say):
     thread_message = thread_messages[0]
 
     err_flag = process_thread_message(
-        message, thread_message, user, thread_ts, say
+        message,
+        thread_message,
+        user,
+        thread_ts,
+        say,
+        channel_id=channel_id,
+        event_ts=body["event"]["ts"],
     )
 
     if err_flag:
@@ -379,30 +559,279 @@ def process_mention_event(body, logger, say):
         logger.info("指示の処理が完了しました。")
 
 
-def write_message(channel_id: str, message: str) -> bool:
+def submit_summary_job(job: SummaryJob, say) -> bool:
+    """
+    要約ジョブをキューに追加し、受付結果をスレッドに書き込む関数
+
+    Args:
+        job (SummaryJob): 要約ジョブ
+        say (function): botの発言を行う関数
+
+    Returns:
+        err_flag (bool): 受け付けられなかった場合はTrue
+    """
+    if summary_job_queue.get_status(job.job_id) == "done":
+        # Slackの再送などで完了済みのジョブが届いた場合は、受付ではなく結果を返す
+        page_url = (
+            summary_result_index.get(job.entry_id) if job.entry_id else None
+        )
+        _say_summary_complete(job.user, job.thread_ts, say, page_url)
+        return False
+    is_in_flight = summary_job_queue.is_in_flight(job.entry_id)
+    position = summary_job_queue.submit(job)
+    if position is None:
+        text = "現在混み合っているため受け付けられませんでした。しばらくしてから再度お試しください。"
+        say(text=f"<@{job.user}> {text}", thread_ts=job.thread_ts)
+        return True
+    if is_in_flight:
+        # 同じ論文の要約が処理中の場合は、その結果を待つ
+        text = "同じ論文の要約を処理中です。完了したらお知らせします"
+    else:
+        text = f"要約を受け付けました (待ち: {position}件)"
+    say(text=f"<@{job.user}> {text} :robot_face:", thread_ts=job.thread_ts)
+    return False
+
+
+class SlackStreamWriter:
+    def __init__(
+        self,
+        channel_id: str,
+        thread_ts: str,
+        min_interval: float = SLACK_UPDATE_INTERVAL,
+        max_chars: int = SLACK_STREAM_MAX_CHARS,
+    ) -> None:
+        """
+        SlackStreamWriterクラスのコンストラクタ
+
+        受け取ったテキストをスレッドのメッセージに追記していく。
+        chat.updateの回数を抑えるため、更新はmin_interval秒に1回にまとめ、
+        max_charsを超えたら新しいメッセージに続きを書く。
+
+        Args:
+            channel_id (str): チャンネルID
+            thread_ts (str): スレッドのタイムスタンプ
+            min_interval (float, optional): 更新の最小間隔 (秒). Defaults to SLACK_UPDATE_INTERVAL.
+            max_chars (int, optional): 1つのメッセージの最大文字数. Defaults to SLACK_STREAM_MAX_CHARS.
+        """
+        self.channel_id = channel_id
+        self.thread_ts = thread_ts
+        self.min_interval = min_interval
+        self.max_chars = max_chars
+        self._text = ""
+        self._message_ts = None
+        self._is_dirty = False
+        self._next_update = 0.0
+
+    def write(self, text: str) -> None:
+        """テキストを追記するメソッド
+
+        Args:
+            text (str): 追記するテキスト
+        """
+        if self._text and len(self._text) + len(text) > self.max_chars:
+            # 今のメッセージを確定させて、次のメッセージに続ける
+            self._flush(force=True)
+            self._text, self._message_ts = "", None
+        self._text += text
+        self._is_dirty = True
+        self._flush()
+
+    def close(self) -> None:
+        """書き込んでいないテキストを全て送信するメソッド"""
+        self._flush(force=True)
+
+    def _flush(self, force: bool = False) -> None:
+        """メッセージを投稿または更新するメソッド
+
+        Args:
+            force (bool, optional): 間隔を待たずに送信するかどうか. Defaults to False.
+        """
+        # 空白だけのメッセージはSlackに拒否されるので、送信しない
+        if not self._is_dirty or not self._text.strip():
+            return None
+        for attempt in range(SLACK_MAX_RETRIES + 1):
+            wait = self._next_update - time.monotonic()
+            if wait > 0:
+                if not force:
+                    return None
+                time.sleep(wait)
+            try:
+                if self._message_ts is None:
+                    response = app.client.chat_postMessage(
+                        channel=self.channel_id,
+                        thread_ts=self.thread_ts,
+                        text=self._text,
+                    )
+                    self._message_ts = response["ts"]
+                else:
+                    app.client.chat_update(
+                        channel=self.channel_id,
+                        ts=self._message_ts,
+                        text=self._text,
+                    )
+            except SlackApiError as e:
+                retry_after = _get_retry_after(e, attempt)
+                if retry_after is None:
+                    print(f"Error writing stream message: {e}")
+                    return None
+                # レート制限の場合は、Retry-Afterまで更新を控える
+                self._next_update = time.monotonic() + retry_after
+                continue
+            self._is_dirty = False
+            self._next_update = time.monotonic() + self.min_interval
+            return None
+        return None
+
+
+def _create_say(channel_id: str) -> Callable[..., None]:
+    """
+    イベントの外からスレッドに書き込むための関数を作成する関数
+
+    Args:
+        channel_id (str): チャンネルID
+
+    Returns:
+        say (Callable[..., None]): botの発言を行う関数
+    """
+
+    def say(text: str, thread_ts: str | None = None) -> None:
+        app.client.chat_postMessage(
+            channel=channel_id, text=text, thread_ts=thread_ts
+        )
+
+    return say
+
+
+def _run_summary_job(job: SummaryJob) -> str | None:
+    """
+    ワーカースレッドで要約ジョブを処理する関数
+
+    Args:
+        job (SummaryJob): 要約ジョブ
+
+    Returns:
+        page_url (str | None): 書き込んだNotionページのURL
+    """
+    say = _create_say(job.channel_id)
+
+    def progress(text: str) -> None:
+        try:
+            say(
+                text=f"{text} :hourglass_flowing_sand:", thread_ts=job.thread_ts
+            )
+        except SlackApiError as e:
+            # 進捗の通知に失敗しても、要約は続ける
+            print(f"Error writing progress: {e}")
+
+    progress("要約を開始しました")
+    # 要約は生成されたそばからスレッドに書き込む
+    sinks = [SlackStreamWriter(job.channel_id, job.thread_ts)]
+    try:
+        page_url = summarize_paper(
+            job.thread_message, progress=progress, sinks=sinks
+        )
+    except Exception as e:
+        _handle_error_output_slack(e, job.thread_ts, say)
+        raise
+    _say_summary_complete(job.user, job.thread_ts, say, page_url)
+    return page_url
+
+
+def _notify_attached_job(
+    job: SummaryJob, page_url: str | None, error: Exception | None
+) -> None:
+    """
+    同じ論文のジョブに相乗りしたジョブに結果を書き込む関数
+
+    Args:
+        job (SummaryJob): 相乗りしたジョブ
+        page_url (str | None): 書き込んだNotionページのURL
+        error (Exception | None): 要約に失敗した場合の例外
+    """
+    say = _create_say(job.channel_id)
+    if error is not None:
+        _handle_error_output_slack(error, job.thread_ts, say)
+        return None
+    _say_summary_complete(job.user, job.thread_ts, say, page_url)
+    return None
+
+
+# 要約済みの論文とNotionページの対応
+summary_result_index = SummaryResultIndex()
+# メンションで受け付けた要約ジョブを処理するキュー
+summary_job_queue = SummaryJobQueue(
+    handler=_run_summary_job, notifier=_notify_attached_job
+)
+
+
+def _get_retry_after(e: SlackApiError, attempt: int) -> float | None:
+    """Slack APIエラーから再試行までの待ち時間を求める関数
+
+    Args:
+        e (SlackApiError): Slack APIエラー
+        attempt (int): 何回目の再試行か
+
+    Returns:
+        float | None: 待ち時間 (秒). 再試行しないエラーの場合はNone
+    """
+    response = getattr(e, "response", None)
+    status_code = getattr(response, "status_code", None)
+    if status_code == 429:
+        # レート制限の場合は、Retry-Afterヘッダーの秒数だけ待つ
+        headers = getattr(response, "headers", None) or {}
+        try:
+            return float(headers.get("Retry-After", 1))
+        except (TypeError, ValueError):
+            return 1.0
+    if status_code is not None and status_code >= 500:
+        return float(2**attempt)
+    return None
+
+
+def write_message(
+    channel_id: str, message: str, max_retries: int = SLACK_MAX_RETRIES
+) -> bool:
     """
     Slackにメッセージを書き込む関数
 
     Args:
         channel_id (str): チャンネルID
         message (str): 書き込むメッセージ
+        max_retries (int, optional): 再試行回数の上限. Defaults to SLACK_MAX_RETRIES.
 
     Returns:
         completed_flag (bool): 書き込みが正常に終了したか
     """
     completed_flag = False
-    try:
-        app.client.chat_postMessage(
-            channel=channel_id,
-            text=message,
-        )
-        completed_flag = True
-    except SlackApiError as e:
-        # Slack APIエラーが発生した場合は、エラーメッセージを表示してFalseを返す
-        print(f"Error writing message: {e}")
+    for attempt in range(max_retries + 1):
+        try:
+            app.client.chat_postMessage(
+                channel=channel_id,
+                text=message,
+            )
+            completed_flag = True
+            break
+        except SlackApiError as e:
+            retry_after = _get_retry_after(e, attempt)
+            if retry_after is None or attempt >= max_retries:
+                # Slack APIエラーが発生した場合は、エラーメッセージを表示してFalseを返す
+                print(f"Error writing message: {e}")
+                break
+            print(f"Slack API is busy. Retrying in {retry_after} seconds.")
+            time.sleep(retry_after)
     return completed_flag
 
 
 if __name__ == "__main__":
+    # 前回完了しなかったジョブを読み込み、ワーカーを起動する
+    summary_job_queue.start()
+    # 要約に使用するモデルを事前にロードしておく
+    warmup_models(
+        device="cuda:0" if torch.cuda.is_available() else "cpu",
+        package_name="llama_index",
+        temperature=0.0,
+        context_window=4096,
+        max_tokens=4096,
+    )
     # アプリを起動します
     SocketModeHandler(app, os.environ["SLACK_APP_TOKEN"]).start()
@@ -1,4 +1,6 @@
-from typing import Any, List, Literal
+import os
+from functools import partial
+from typing import Any, Callable, Iterator, List, Literal, Tuple
 
 import torch
 from llama_index import Document
@@ -6,7 +8,24 @@ from llama_index.embeddings import HuggingFaceEmbedding
 
 from src.model.huggingface import create_huggingface_model
 from src.model.llama_cpp import create_llama_cpp_model
-from src.translator.llamaindex_summarizer import LlamaIndexSummarizer
+from src.model.registry import ModelKey, model_registry
+from src.SectionCheckpoint import SectionCheckpoint
+from src.translator.batch_summarizer import (
+    BATCH_SUMMARY_PROMPT,
+    BatchSummarizer,
+    BatchSummaryIndex,
+)
+from src.translator.llamaindex_summarizer import (
+    SUMMARY_QUERY,
+    SUMMARY_SYSTEM_PROMPT,
+    LlamaIndexSummarizer,
+)
+
+HUGGINGFACE_MODEL_NAME = (
+    "mmnga/ELYZA-japanese-Llama-2-7b-fast-instruct-GPTQ-calib-ja-2k"
+)
+LLAMA_CPP_MODEL_PATH = "/home/paper_translator/data/models/ELYZA-japanese-Llama-2-7b-fast-instruct-q4_K_M.gguf"
+EMBED_MODEL_NAME = "sentence-transformers/all-MiniLM-l6-v2"
 
 
 def _create_huggingface_embeddings(
@@ -28,6 +47,123 @@ def _create_huggingface_embeddings(
     return embed_model
 
 
+def _get_llm_model_spec(
+    package_name: Literal["huggingface", "llama_index", "langchain"],
+    device: torch.device = "cpu",
+    temperature: float = 0.0,
+    context_window: int = 4096,
+    max_tokens: int = 2048,
+) -> Tuple[ModelKey, Callable[[], Any]]:
+    """LLMモデルのレジストリキーとロード関数を作成する関数
+
+    Args:
+        package_name (Literal["huggingface", "llama_index", "langchain"]): パッケージ名
+        device (torch.device, optional): デバイス. Defaults to "cpu".
+        temperature (float, optional): 温度パラメータ. Defaults to 0.0.
+        context_window (int, optional): コンテキストウィンドウのサイズ. Defaults to 4096.
+        max_tokens (int, optional): 最大トークン数. Defaults to 2048.
+
+    Returns:
+        Tuple[ModelKey, Callable[[], Any]]: レジストリキーとロード関数
+    """
+    if package_name == "huggingface":
+        key = ModelKey(
+            backend=package_name,
+            model_path=HUGGINGFACE_MODEL_NAME,
+            context_window=context_window,
+            max_tokens=max_tokens,
+            device=str(device),
+            temperature=temperature,
+        )
+        loader = partial(
+            create_huggingface_model,
+            model_url_or_path=HUGGINGFACE_MODEL_NAME,
+            device=device,
+            max_length=max_tokens,
+            context_window=context_window,
+            temperature=temperature,
+        )
+    else:
+        key = ModelKey(
+            backend=package_name,
+            model_path=LLAMA_CPP_MODEL_PATH,
+            context_window=context_window,
+            max_tokens=max_tokens,
+            device=str(device),
+            temperature=temperature,
+        )
+        loader = partial(
+            create_llama_cpp_model,
+            package_name=package_name,
+            model_path=LLAMA_CPP_MODEL_PATH,
+            max_tokens=max_tokens,
+            context_window=context_window,
+            temperature=temperature,
+            # 全セクションで共通のシステムプロンプトは、1度だけ評価する
+            system_prompt=SUMMARY_SYSTEM_PROMPT,
+        )
+    return key, loader
+
+
+def _get_embed_model_spec(
+    device: torch.device = "cpu", max_tokens: int = 512
+) -> Tuple[ModelKey, Callable[[], Any]]:
+    """Embeddingモデルのレジストリキーとロード関数を作成する関数
+
+    Args:
+        device (torch.device, optional): デバイス. Defaults to "cpu".
+        max_tokens (int, optional): 最大トークン数. Defaults to 512.
+
+    Returns:
+        Tuple[ModelKey, Callable[[], Any]]: レジストリキーとロード関数
+    """
+    key = ModelKey(
+        backend="embedding",
+        model_path=EMBED_MODEL_NAME,
+        max_tokens=max_tokens,
+        device=str(device),
+    )
+    loader = partial(
+        _create_huggingface_embeddings,
+        model_name=EMBED_MODEL_NAME,
+        max_length=max_tokens,
+        device=device,
+    )
+    return key, loader
+
+
+def warmup_models(
+    device: torch.device = "cpu",
+    package_name: Literal[
+        "huggingface", "llama_index", "langchain"
+    ] = "llama_index",
+    temperature: float = 0.0,
+    context_window: int = 4096,
+    max_tokens: int = 2048,
+) -> None:
+    """write_markdownで使用するモデルを事前にロードする関数
+
+    Args:
+        device (torch.device, optional): デバイス. Defaults to "cpu".
+        package_name (Literal["huggingface", "llama_index", "langchain"], optional): パッケージ名. Defaults to "llama_index".
+        temperature (float, optional): 温度パラメータ. Defaults to 0.0.
+        context_window (int, optional): コンテキストウィンドウのサイズ. Defaults to 4096.
+        max_tokens (int, optional): 最大トークン数. Defaults to 2048.
+    """
+    model_registry.warmup(
+        [
+            _get_llm_model_spec(
+                package_name=package_name,
+                device=device,
+                temperature=temperature,
+                context_window=context_window,
+                max_tokens=max_tokens,
+            ),
+            _get_embed_model_spec(device=device, max_tokens=max_tokens),
+        ]
+    )
+
+
 def create_doc_summary_index(documents: List[Document], summarizer: Any) -> Any:
     """doc_summary_indexを作成する関数
 
@@ -42,6 +178,83 @@ def create_doc_summary_index(documents: List[Document], summarizer: Any) -> Any:
     return doc_summary_index
 
 
+def _get_model_id(key: ModelKey) -> str:
+    """レジストリキーから、要約の保存に使うモデルのIDを作成する関数
+
+    Args:
+        key (ModelKey): モデルのレジストリキー
+
+    Returns:
+        str: モデルのID
+    """
+    return f"{key.backend}:{key.model_path}"
+
+
+def _create_section_checkpoint(
+    paper_id: str | None, llm_key: ModelKey, prompt_texts: Tuple[str, ...]
+) -> SectionCheckpoint | None:
+    """セクションの要約のチェックポイントを作成する関数
+
+    Args:
+        paper_id (str | None): 論文のID. Noneの場合はチェックポイントを使わない
+        llm_key (ModelKey): LLMモデルのレジストリキー
+        prompt_texts (Tuple[str, ...]): セクション以外のプロンプトのテキスト
+
+    Returns:
+        SectionCheckpoint | None: チェックポイント
+    """
+    if not paper_id:
+        return None
+    return SectionCheckpoint(
+        paper_id=paper_id,
+        model_id=_get_model_id(llm_key),
+        prompt_texts=prompt_texts,
+    )
+
+
+def create_checkpointed_summary_index(
+    documents: List[Document], summarizer: Any, checkpoint: SectionCheckpoint
+) -> BatchSummaryIndex:
+    """保存されていないセクションをまとめて要約し、インデックスを作成する関数
+
+    from_documentsを1回だけ呼ぶため、インデックスの保存も1回で済む。
+    保存済みのセクションは要約せずに、保存した要約を使う。
+
+    Args:
+        documents (List[Document]): LlamaIndexのDocumentリスト
+        summarizer (Any): llamaindex_summaryzer
+        checkpoint (SectionCheckpoint): チェックポイント
+
+    Returns:
+        BatchSummaryIndex: doc_idで要約を取得できるインデックス
+    """
+    summaries = {}
+    missing = []
+    for i, document in enumerate(documents):
+        summary = checkpoint.get(i, document)
+        if summary is None:
+            missing.append((i, document))
+        else:
+            summaries[document.doc_id] = summary
+    if checkpoint.hits:
+        print(f"Resumed {checkpoint.hits} sections from checkpoint")
+    if not missing:
+        return BatchSummaryIndex(summaries)
+
+    doc_summary_index = create_doc_summary_index(
+        [document for _, document in missing], summarizer
+    )
+    for i, document in missing:
+        try:
+            summary = doc_summary_index.get_document_summary(document.doc_id)
+        except Exception as e:
+            print(f"Get summary from doc_summary_index error occurred: {e}")
+            continue
+        checkpoint.put(i, document, summary)
+        summaries[document.doc_id] = summary
+    return BatchSummaryIndex(summaries)
+
+
 def get_document_summary(doc_summary_index: Any, i: int) -> str | None:
     """doc_summary_indexから要約を取得する関数
 
@@ -156,6 +369,8 @@ def write_markdown(
     temperature: float = 0.0,
     context_window: int = 4096,
     max_tokens: int = 2048,
+    summarizer_type: Literal["index", "batch"] = "index",
+    paper_id: str | None = None,
 ) -> str:
     """Markdownファイルを作成する関数
 
@@ -164,6 +379,8 @@ def write_markdown(
         persist_dir: Contextの保存先ディレクトリ
         prompt_temp_path (str | None, optional): プロンプトテンプレートのパス. Defaults to None.
         device (torch.device, optional): デバイス. Defaults to "cpu".
+        summarizer_type (Literal["index", "batch"], optional): "batch"の場合は、複数のセクションをまとめて要約する. Defaults to "index".
+        paper_id (str | None, optional): 論文のID. 指定した場合は、セクションの要約を保存して途中から再開する. Defaults to None.
 
     Returns:
         markdown_text (str): Markdownのテキスト
@@ -172,36 +389,65 @@ def write_markdown(
     #    prompt_temp_path = (
     #        "/home/paper_translator/data/prompt_temp/translate.txt"
     #    )
-    if package_name == "huggingface":
-        llm_model = create_huggingface_model(
-            model_url_or_path="mmnga/ELYZA-japanese-Llama-2-7b-fast-instruct-GPTQ-calib-ja-2k",
-            device=device,
-            max_length=max_tokens,
-            context_window=context_window,
-            temperature=temperature,
-        )
-    else:
-        llm_model = create_llama_cpp_model(
-            package_name=package_name,
-            model_path="/home/paper_translator/data/models/ELYZA-japanese-Llama-2-7b-fast-instruct-q4_K_M.gguf",
-            max_tokens=max_tokens,
-            context_window=context_window,
-            temperature=temperature,
-        )
-    model_name = "sentence-transformers/all-MiniLM-l6-v2"
-    embed_model = _create_huggingface_embeddings(
-        model_name=model_name, max_length=max_tokens, device=device
+    llm_key, llm_loader = _get_llm_model_spec(
+        package_name=package_name,
+        device=device,
+        temperature=temperature,
+        context_window=context_window,
+        max_tokens=max_tokens,
     )
-    # summarizer = _create_summarizer(llm_model, prompt_temp_path)
-    summarizer = LlamaIndexSummarizer(
-        llm_model=llm_model,
-        embed_model=embed_model,
-        persist_dir=persist_dir,
-        node_parser="sentence",
-        is_debug=False,
+    if summarizer_type == "batch":
+        # 短いセクションを1つのプロンプトにまとめて要約する
+        with model_registry.use(llm_key, llm_loader) as llm_model:
+            checkpoint = _create_section_checkpoint(
+                paper_id,
+                llm_key,
+                (SUMMARY_SYSTEM_PROMPT, BATCH_SUMMARY_PROMPT),
+            )
+            summarizer = BatchSummarizer(
+                llm_model=llm_model,
+                context_window=context_window,
+                max_tokens=max_tokens,
+                checkpoint=checkpoint,
+            )
+            doc_summary_index = create_doc_summary_index(documents, summarizer)
+        print(
+            f"Summarized {len(documents)} sections in {summarizer.n_calls} calls"
+        )
+        if checkpoint is not None and checkpoint.hits:
+            print(f"Resumed {checkpoint.hits} sections from checkpoint")
+        try:
+            return create_markdown_text(documents, doc_summary_index)
+        except Exception as e:
+            print(f"Create markdown error occurred: {e}")
+            return ""
+
+    embed_key, embed_loader = _get_embed_model_spec(
+        device=device, max_tokens=max_tokens
     )
+    # レジストリからロード済みのモデルを借りる
+    with model_registry.use(
+        llm_key, llm_loader
+    ) as llm_model, model_registry.use(embed_key, embed_loader) as embed_model:
+        # summarizer = _create_summarizer(llm_model, prompt_temp_path)
+        summarizer = LlamaIndexSummarizer(
+            llm_model=llm_model,
+            embed_model=embed_model,
+            persist_dir=persist_dir,
+            node_parser="sentence",
+            is_debug=False,
+            model_id=f"{_get_model_id(llm_key)}:{_get_model_id(embed_key)}",
+        )
 
-    doc_summary_index = create_doc_summary_index(documents, summarizer)
+        checkpoint = _create_section_checkpoint(
+            paper_id, llm_key, (SUMMARY_SYSTEM_PROMPT, SUMMARY_QUERY)
+        )
+        if checkpoint is None:
+            doc_summary_index = create_doc_summary_index(documents, summarizer)
+        else:
+            doc_summary_index = create_checkpointed_summary_index(
+                documents, summarizer, checkpoint
+            )
 
     try:
         markdown_text = create_markdown_text(documents, doc_summary_index)
@@ -212,6 +458,198 @@ def write_markdown(
         return markdown_text
 
 
+def write_markdown_stream(
+    documents: List[Document],
+    persist_dir: str | None = None,
+    device: torch.device = "cpu",
+    package_name: Literal[
+        "huggingface", "llama_index", "langchain"
+    ] = "llama_index",
+    temperature: float = 0.0,
+    context_window: int = 4096,
+    max_tokens: int = 2048,
+    summarizer_type: Literal["index", "batch"] = "index",
+    paper_id: str | None = None,
+) -> Iterator[Tuple[str, str]]:
+    """セクションの要約を、生成されたトークンごとに返すジェネレータ
+
+    summarizer_typeが"batch"の場合は、BatchSummarizerでまとめて要約し、
+    生成された出力を見出し行でセクションに振り分けながら返す。
+    summarizer_typeが"index"でpersist_dirを指定した場合は、保存したインデックスを
+    再利用して本文が変わったセクションだけを要約し、セクションごとに要約をまとめて返す。
+
+    Args:
+        documents (List[Document]): LlamaIndexのDocumentリスト
+        persist_dir (str | None, optional): DocumentSummaryIndexの保存先ディレクトリ. "index"の場合だけ使う. Defaults to None.
+        device (torch.device, optional): デバイス. Defaults to "cpu".
+        package_name (Literal["huggingface", "llama_index", "langchain"], optional): パッケージ名. Defaults to "llama_index".
+        temperature (float, optional): 温度パラメータ. Defaults to 0.0.
+        context_window (int, optional): コンテキストウィンドウのサイズ. Defaults to 4096.
+        max_tokens (int, optional): 最大トークン数. Defaults to 2048.
+        summarizer_type (Literal["index", "batch"], optional): "batch"の場合は、複数のセクションをまとめて要約する. Defaults to "index".
+        paper_id (str | None, optional): 論文のID. 指定した場合は、保存済みのセクションの要約をまとめて返し、残りのセクションから再開する. Defaults to None.
+
+    Yields:
+        Tuple[str, str]: (セクションのタイトル, 生成されたトークン)
+    """
+    llm_key, llm_loader = _get_llm_model_spec(
+        package_name=package_name,
+        device=device,
+        temperature=temperature,
+        context_window=context_window,
+        max_tokens=max_tokens,
+    )
+    if summarizer_type == "batch":
+        with model_registry.use(llm_key, llm_loader) as llm_model:
+            checkpoint = _create_section_checkpoint(
+                paper_id,
+                llm_key,
+                (SUMMARY_SYSTEM_PROMPT, BATCH_SUMMARY_PROMPT),
+            )
+            summarizer = BatchSummarizer(
+                llm_model=llm_model,
+                context_window=context_window,
+                max_tokens=max_tokens,
+                checkpoint=checkpoint,
+            )
+            try:
+                for i, token in summarizer.stream_summaries(documents):
+                    yield get_section_title(documents[i]), token
+            except Exception as e:
+                # 完成したセクションはチェックポイントに保存されている
+                print(f"Error in write_markdown_stream: {e}")
+        return
+
+    embed_key, embed_loader = _get_embed_model_spec(
+        device=device, max_tokens=max_tokens
+    )
+    # ジェネレータが最後まで消費されるか閉じられるまで、モデルを借りておく
+    with model_registry.use(
+        llm_key, llm_loader
+    ) as llm_model, model_registry.use(embed_key, embed_loader) as embed_model:
+        summarizer = LlamaIndexSummarizer(
+            llm_model=llm_model,
+            embed_model=embed_model,
+            persist_dir=persist_dir,
+            node_parser="sentence",
+            is_debug=False,
+            model_id=f"{_get_model_id(llm_key)}:{_get_model_id(embed_key)}",
+        )
+        if persist_dir is not None:
+            # 保存したインデックスから、セクションの要約をまとめて返す
+            doc_summary_index = create_doc_summary_index(documents, summarizer)
+            for document in documents:
+                try:
+                    summary = doc_summary_index.get_document_summary(
+                        document.doc_id
+                    )
+                except Exception as e:
+                    print(f"Error in write_markdown_stream: {e}")
+                    continue
+                yield get_section_title(document), summary
+            return
+
+        checkpoint = _create_section_checkpoint(
+            paper_id, llm_key, (SUMMARY_SYSTEM_PROMPT, SUMMARY_QUERY)
+        )
+        if checkpoint is None:
+            for i, token in summarizer.stream_summaries(documents):
+                yield get_section_title(documents[i]), token
+            return
+
+        for i, document in enumerate(documents):
+            section_title = get_section_title(document)
+            summary = checkpoint.get(i, document)
+            if summary is not None:
+                yield section_title, summary
+                continue
+            tokens = []
+            try:
+                for token in summarizer.stream_summary(document):
+                    tokens.append(token)
+                    yield section_title, token
+            except Exception as e:
+                # 1つのセクションの失敗で、残りの要約を止めない
+                print(f"Error in write_markdown_stream: {e}")
+                continue
+            # 最後まで生成できたセクションだけを保存する
+            checkpoint.put(i, document, "".join(tokens))
+
+
+class MarkdownFileSink:
+    def __init__(self, file_path: str) -> None:
+        """
+        MarkdownFileSinkクラスのコンストラクタ
+
+        受け取ったテキストを、その都度ファイルに追記する。
+
+        Args:
+            file_path (str): Markdownファイルのパス
+        """
+        self.file_path = file_path
+        dir_path = os.path.dirname(os.path.abspath(file_path))
+        os.makedirs(dir_path, exist_ok=True)
+        self._file = open(file_path, mode="w")
+
+    def write(self, text: str) -> None:
+        """テキストを追記するメソッド
+
+        Args:
+            text (str): 追記するテキスト
+        """
+        self._file.write(text)
+        self._file.flush()
+
+    def close(self) -> None:
+        """ファイルを閉じるメソッド"""
+        if not self._file.closed:
+            self._file.close()
+
+
+def consume_markdown_stream(
+    events: Iterator[Tuple[str, str]], sinks: List[Any] | None = None
+) -> str:
+    """write_markdown_streamの出力をMarkdownに組み立て、sinkに順に書き込む関数
+
+    sinkはwrite(text)とclose()を持つオブジェクトで、create_markdown_textと同じ
+    形式のMarkdownが少しずつ渡される。
+
+    Args:
+        events (Iterator[Tuple[str, str]]): (セクションのタイトル, トークン) のイテレータ
+        sinks (List[Any] | None, optional): 書き込み先のリスト. Defaults to None.
+
+    Returns:
+        markdown_text (str): 組み立てたMarkdownのテキスト
+    """
+    sinks = sinks or []
+    pieces = []
+
+    def _write(text: str) -> None:
+        pieces.append(text)
+        for sink in sinks:
+            try:
+                sink.write(text)
+            except Exception as e:
+                # 書き込み先の失敗で、要約を止めない
+                print(f"Error writing markdown stream: {e}")
+
+    current_title = None
+    try:
+        for section_title, token in events:
+            if section_title != current_title:
+                if current_title is not None:
+                    _write("\n\n")
+                _write(section_title + "\n")
+                current_title = section_title
+            _write(token)
+        if current_title is not None:
+            _write("\n\n")
+    finally:
+        for sink in sinks:
+            sink.close()
+    return "".join(pieces)
+
+
 if __name__ == "__main__":
     # from src.arXivUtils import get_pdf
     from src.XMLUtils import DocumentCreator
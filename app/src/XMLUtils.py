@@ -1,24 +1,52 @@
 import os
 import subprocess
-import xml.etree.ElementTree as ET
-from typing import Any, Dict, List, Literal, Optional
-from xml.etree.ElementTree import Element
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Literal,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
 
-import bs4
 from llama_index import Document
+from lxml import etree
 
 from src.Informations import DocsInfoDict
 
 GROBID_PATH = "/usr/lib/grobid-0.7.3"
 
+# TEIの名前空間
+TEI_NS = "http://www.tei-c.org/ns/1.0"
+XML_NS = "http://www.w3.org/XML/1998/namespace"
+NS = {"tei": TEI_NS}
+
+
+def _get_text(element: etree._Element | None) -> str:
+    """要素以下の全てのテキストを連結して返す関数
+
+    Args:
+        element (etree._Element | None): 要素
+
+    Returns:
+        str: 連結したテキスト
+    """
+    if element is None:
+        raise AttributeError("element is None")
+    return "".join(element.itertext())
+
 
 def _extract_author_names_from_authors(
-    authors: bs4.ResultSet, return_list: bool = False
+    authors: List[etree._Element], return_list: bool = False
 ) -> str | List[str]:
     """著者名を抽出する関数
 
     Args:
-        authors (ResultSet): 著者情報を含むResultSetオブジェクト
+        authors (List[etree._Element]): 著者情報を含む要素のリスト
         return_list (bool, optional): リスト形式で返すかどうか. Defaults to False.
 
     Returns:
@@ -41,28 +69,29 @@ def _extract_author_names_from_authors(
             return ""
 
 
-def _extract_author_names(author: Element) -> str:
+def _extract_author_names(author: etree._Element) -> str:
     """著者名を抽出する関数
 
     Args:
-        author (Element): 著者情報を含むElementオブジェクト
+        author (etree._Element): 著者情報を含む要素
 
     Returns:
         author_name (str): 著者名
     """
     try:
-        if len(author.find("persName")) == 2:
-            first_name = author.find("persName").find("forename").text
-            last_name = author.find("persName").find("surname").text
+        pers_name = author.find("tei:persName", NS)
+        if pers_name is None:
+            author_name = ""
+        elif len(pers_name) == 2:
+            first_name = _get_text(pers_name.find("tei:forename", NS))
+            last_name = _get_text(pers_name.find("tei:surname", NS))
             author_name = f"{first_name} {last_name}"
-        elif len(author.find("persName")) == 3:
-            first_name = author.find("persName").find("forename").text
-            middle_name = (
-                author.find("persName")
-                .find("forename", {"type": "middle"})
-                .text
+        elif len(pers_name) == 3:
+            first_name = _get_text(pers_name.find("tei:forename", NS))
+            middle_name = _get_text(
+                pers_name.find("tei:forename[@type='middle']", NS)
             )
-            last_name = author.find("persName").find("surname").text
+            last_name = _get_text(pers_name.find("tei:surname", NS))
             author_name = f"{first_name} {middle_name} {last_name}"
         else:
             author_name = ""
@@ -84,17 +113,17 @@ def _is_valid_author_name(author_name: str) -> bool:
     return bool(author_name) and not author_name.isspace()
 
 
-def _extract_abstract(abstract: bs4.ResultSet) -> str:
+def _extract_abstract(abstract: etree._Element | None) -> str:
     """論文の概要を抽出する関数
 
     Args:
-        abstract (ResultSet): 論文の概要を含むResultSetオブジェクト
+        abstract (etree._Element | None): 論文の概要を含む要素
 
     Returns:
         abstract (str): 論文の概要
     """
     try:
-        abstract = abstract.text
+        abstract = _get_text(abstract)
         abstract = abstract.removeprefix("\n").removesuffix("\n")
     except (AttributeError, TypeError) as e:
         print(f"Error in extract_abstract: {e}")
@@ -103,29 +132,33 @@ def _extract_abstract(abstract: bs4.ResultSet) -> str:
 
 
 def _extract_doc_info(
-    teiheader: bs4.ResultSet, contain_abst: bool = True
+    teiheader: etree._Element, contain_abst: bool = True
 ) -> Dict[str, str]:
     """PDFファイルの情報を抽出する関数
 
     Args:
-        teiheader (ResultSet): TEIヘッダー情報を含むResultSetオブジェクト
+        teiheader (etree._Element): TEIヘッダー要素
         contain_abst (bool, optional): 要約を含めるかどうか. Defaults to True.
     Returns:
         doc_info (Dict[str, str]): PDFファイルの情報を格納した辞書
     """
     try:
-        sourceDesc = teiheader.find("sourceDesc").find("biblStruct")
-        pdf_title = sourceDesc.find("analytic").find("title").text
-        abstract = teiheader.find("profileDesc").find("abstract")
+        sourceDesc = teiheader.find(".//tei:sourceDesc/tei:biblStruct", NS)
+        analytic = sourceDesc.find("tei:analytic", NS)
+        pdf_title = _get_text(analytic.find("tei:title", NS))
         if contain_abst:
-            abstract = _extract_abstract(abstract)
+            abstract = _extract_abstract(
+                teiheader.find("tei:profileDesc/tei:abstract", NS)
+            )
         else:
             abstract = ""
-        authors = sourceDesc.find("analytic").find_all("author")
+        authors = analytic.findall(".//tei:author", NS)
         authors = _extract_author_names_from_authors(authors)
-        published = sourceDesc.find("monogr").find("imprint").find("date").text
-        pdf_idno = sourceDesc.find("idno").text
-        pdf_lang = teiheader.get("xml:lang")
+        published = _get_text(
+            sourceDesc.find("tei:monogr/tei:imprint/tei:date", NS)
+        )
+        pdf_idno = _get_text(sourceDesc.find(".//tei:idno", NS))
+        pdf_lang = teiheader.get(f"{{{XML_NS}}}lang")
 
         doc_info = DocsInfoDict.copy()
         doc_info["Title"] = pdf_title
@@ -169,35 +202,61 @@ def run_grobid(dir_path: str) -> str | None:
         return dir_path
 
 
-def _parse_xml_file(xml_path: str) -> Dict[str, Any]:
-    """XMLファイルをパースする関数
+def iter_tei(
+    xml_path: str, contain_abst: bool = True
+) -> Iterator[Tuple[str, Any]]:
+    """TEI XMLファイルを1回の走査で読み込み、ヘッダーとセクションを順に返す関数
+
+    iterparseで要素を読み終えるたびに破棄するため、参考文献リストが
+    大きい論文でもメモリ使用量が増えない。結論のセクションを読んだ時点で
+    走査を打ち切る。
 
     Args:
-    xml_path (str): XMLファイルのパス
+        xml_path (str): XMLファイルのパス
+        contain_abst (bool, optional): 要約を含めるかどうか. Defaults to True.
 
-    Returns:
-        Dict[str, Any]: BeautifulSoupオブジェクトとElementオブジェクトを含む辞書
+    Yields:
+        Tuple[str, Any]: ("header", doc_info) を最初に1回、
+            その後 ("section", (セクションタイトル, テキスト)) をセクションごとに返す
     """
-
     if not isinstance(xml_path, str):
         raise TypeError("xml_path must be str")
 
     if not os.path.exists(xml_path):
         raise ValueError("Invalid XML file path")
 
+    header_tag = f"{{{TEI_NS}}}teiHeader"
+    body_tag = f"{{{TEI_NS}}}body"
+    div_tag = f"{{{TEI_NS}}}div"
+    head_tag = f"{{{TEI_NS}}}head"
+
+    context = etree.iterparse(
+        xml_path, events=("end",), tag=(header_tag, div_tag)
+    )
     try:
-        with open(xml_path, mode="r", encoding="utf-8") as f:
-            soup = bs4.BeautifulSoup(f.read(), features="xml")
-        tree = ET.parse(xml_path)
-        root = tree.getroot()
-    except FileNotFoundError as e:
-        print(f"Error in parse_xml_file: {e}")
-        return {}
-    except Exception as e:
-        print(f"Error in parse_xml_file: {e}")
-        return {}
-    else:
-        return {"bs4": soup, "root": root}
+        for _, element in context:
+            if element.tag == header_tag:
+                yield "header", _extract_doc_info(
+                    element, contain_abst=contain_abst
+                )
+            elif element.getparent().tag == body_tag:
+                # body直下のdivのみをセクションとして扱う
+                head = element.find(head_tag)
+                if head is not None and head.text:
+                    section_title = head.text
+                    yield "section", (section_title, _get_text(element))
+                    if _check_section_title(section_title):
+                        break
+            elif next(element.iterancestors(body_tag), None) is not None:
+                # body内でネストしたdivは親のdivと一緒に破棄する
+                continue
+
+            # 読み終えた要素と、それより前の兄弟要素を破棄する
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+    finally:
+        del context
 
 
 def __validate_doc_id_type(doc_id_type: str):
@@ -207,18 +266,13 @@ def __validate_doc_id_type(doc_id_type: str):
         raise ValueError("Invalid doc_id")
 
 
-def __get_section_title(element):
-    """セクションタイトルを取得する"""
-    if element.tag == "{http://www.tei-c.org/ns/1.0}head":
-        return element.text
-    return None
-
-
-def __add_pdf_info_to_metadata(meta_data: dict, doc_info: dict):
-    """PDFファイルの情報をメタデータに追加する"""
+def __create_meta_data(section_title: str, doc_info: dict) -> dict:
+    """セクションタイトルとPDFファイルの情報からメタデータを作成する"""
+    meta_data = {"Section Title": section_title}
     for k, v in doc_info.items():
         if v != "":
             meta_data[k] = v
+    return meta_data
 
 
 def __get_doc_id(doc_id_type: str, element_text: str, i: int):
@@ -229,66 +283,68 @@ def __get_doc_id(doc_id_type: str, element_text: str, i: int):
         return f"{i}"
 
 
-def __get_section_text(div_list, i):
-    """セクションのテキストを取得する"""
-    text = ""
-    try:
-        text = div_list[i].text
-        soup_title = div_list[i].find("head").text
-        text.removeprefix(soup_title)
-    except AttributeError as e:
-        print(f"Error in get_section_text: {e}")
-        return ""
-    except IndexError as e:
-        print(f"Error in get_section_text: {e}")
-        return None
-    except Exception as e:
-        print(f"Error in get_section_text: {e}")
-        return ""
-    else:
-        return text
-
-
 def __create_document(doc_id, text, meta_data):
     """Documentオブジェクトを作成する"""
     return Document(doc_id=doc_id, text=text, metadata=meta_data)
 
 
-def _extract_documents(
-    div_list: bs4.ResultSet,
-    root: Element,
+def _iter_documents(
+    sections: Iterator[Tuple[str, str]],
     doc_info: Dict[str, str],
     doc_id_type: str = "Serial_Number",
-) -> List[Document]:
-    """XMLからセクションを抽出し、Documentオブジェクトのリストを返す関数"""
+) -> Iterator[Document]:
+    """セクションのタイトルとテキストから、Documentオブジェクトを順に返す関数"""
     __validate_doc_id_type(doc_id_type)
 
-    documents = []
-    i = 0
-    meta_data = {"Section Title": ""}
+    for i, (section_title, text) in enumerate(sections):
+        meta_data = __create_meta_data(section_title, doc_info)
+        doc_id = __get_doc_id(doc_id_type, section_title, i)
+        yield __create_document(doc_id, text, meta_data)
 
-    try:
-        for div in root[1][0]:
-            for element in div:
-                section_title = __get_section_title(element)
-                if section_title:
-                    meta_data["Section Title"] = section_title
-                    __add_pdf_info_to_metadata(meta_data, doc_info)
-                    doc_id = __get_doc_id(doc_id_type, section_title, i)
-                    text = __get_section_text(div_list, i)
-                    # if text is None:
-                    #    break
-                    document = __create_document(doc_id, text, meta_data)
-                    documents.append(document)
-                    i += 1
-                    if _check_section_title(section_title):
-                        break
-            if _check_section_title(section_title):
-                break
-    except Exception as e:
-        print(f"Error in extract_documents: {e}")
-    finally:
-        return documents
+
+def iter_documents(
+    xml_path: str,
+    contain_abst: bool = True,
+    pdf_info: Dict[str, str] | None = None,
+    doc_id_type: str = "Serial_Number",
+) -> Iterator[Document]:
+    """TEI XMLファイルからDocumentオブジェクトを遅延生成する関数
+
+    Args:
+        xml_path (str): XMLファイルのパス
+        contain_abst (bool, optional): 要約を含めるかどうか. Defaults to True.
+        pdf_info (Dict[str, str] | None, optional): arXivから取得した論文情報. Defaults to None.
+        doc_id_type (str, optional): ドキュメントIDの種類. Defaults to "Serial_Number".
+
+    Yields:
+        Document: セクションごとのDocumentオブジェクト
+    """
+    events = iter_tei(xml_path, contain_abst=contain_abst)
+    kind, doc_info = next(events, ("header", {}))
+    if kind != "header":
+        raise ValueError("teiHeader is not found before sections")
+    if pdf_info:
+        doc_info = _marge_pdf_info(doc_info, pdf_info)
+    sections = (value for _, value in events)
+    yield from _iter_documents(sections, doc_info, doc_id_type)
+
+
+def _marge_pdf_info(
+    doc_info: Dict[str, str], pdf_info: Dict[str, str]
+) -> Dict[str, str]:
+    """arXivから取得した論文情報をPDFファイルの情報に統合する関数
+
+    Args:
+        doc_info (Dict[str, str]): PDFファイルの情報
+        pdf_info (Dict[str, str]): arXivから取得した論文情報
+
+    Returns:
+        doc_info (Dict[str, str]): 統合したPDFファイルの情報
+    """
+    doc_info = doc_info.copy()
+    for key in ["Entry_id", "Pdf_url", "Updated", "Categories", "Comment"]:
+        doc_info[key] = pdf_info[key]
+    return doc_info
 
 
 def _check_section_title(section_title: str) -> bool:
@@ -310,13 +366,73 @@ def _check_section_title(section_title: str) -> bool:
         return False
 
 
+class LoadResult(NamedTuple):
+    """DocumentCreator.load_manyの1ファイル分の結果"""
+
+    paper_id: str
+    documents: List[Document]
+    doc_info: Dict[str, str]
+    elapsed: float
+    error: str | None = None
+
+
+def _get_paper_id(xml_path: str) -> str:
+    """XMLファイルのパスから論文IDを取得する関数
+
+    Args:
+        xml_path (str): XMLファイルのパス
+
+    Returns:
+        str: ファイル名から拡張子 (.tei.xml) を除いたもの
+    """
+    return os.path.basename(xml_path).removesuffix(".xml").removesuffix(".tei")
+
+
+def _load_xml_worker(
+    xml_path: str,
+    contain_abst: bool,
+    pdf_info: Dict[str, str] | None,
+    doc_id_type: str,
+) -> LoadResult:
+    """ワーカープロセスで1つのXMLファイルを読み込む関数
+
+    Args:
+        xml_path (str): XMLファイルのパス
+        contain_abst (bool): 要約を含めるかどうか
+        pdf_info (Dict[str, str] | None): arXivから取得した論文情報
+        doc_id_type (str): ドキュメントIDの種類
+
+    Returns:
+        LoadResult: 読み込み結果
+    """
+    paper_id = _get_paper_id(xml_path)
+    start = time.perf_counter()
+    try:
+        creator = DocumentCreator()
+        if creator.load_xml(xml_path, contain_abst=contain_abst):
+            raise ValueError("Failed to parse XML file")
+        if pdf_info:
+            creator.input_pdf_info(pdf_info)
+        documents = creator.create_docs(doc_id_type=doc_id_type)
+        if not documents:
+            raise ValueError("No documents were created")
+    except Exception as e:
+        return LoadResult(paper_id, [], {}, time.perf_counter() - start, str(e))
+    else:
+        return LoadResult(
+            paper_id,
+            documents,
+            creator.get_doc_info(),
+            time.perf_counter() - start,
+        )
+
+
 class DocumentCreator:
     def __init__(self):
-        self.root = None
         self.doc_info = {}
         self.pdf_info = {}
         self.documents = []
-        self.div_list = None
+        self.sections = None
 
     def load_xml(
         self,
@@ -330,22 +446,24 @@ class DocumentCreator:
             contain_abst (bool, optional): 要約を含めるかどうか. Defaults to True.
         """
         err_flag = True
-        # XMLファイルをパースする
-        parsed_data = _parse_xml_file(xml_path)
-        if parsed_data is None:
+        # XMLファイルを1回の走査でパースし、ヘッダーとセクションを取得する
+        try:
+            self.doc_info = {}
+            self.sections = []
+            for kind, value in iter_tei(xml_path, contain_abst=contain_abst):
+                if kind == "header":
+                    self.doc_info = value
+                else:
+                    self.sections.append(value)
+        except (TypeError, ValueError, etree.XMLSyntaxError, OSError) as e:
+            print(f"Error in parse_xml_file: {e}")
             print("Failed to parse XML file")
+            self.sections = None
             return err_flag
-        soup, self.root = parsed_data["bs4"], parsed_data["root"]
 
-        # PDFファイルの情報を取得する
-        teiheader = soup.find("teiHeader")
-        self.doc_info = _extract_doc_info(teiheader, contain_abst=contain_abst)
-        if self.doc_info is {}:
+        # PDFファイルの情報を取得できたか確認する
+        if not self.doc_info:
             print("Failed to extract PDF info")
-            return err_flag
-
-        # セクションを抽出し、Documentオブジェクトのリストを作成する
-        self.div_list = soup.find("text").find_all("div")
 
         return False
 
@@ -354,11 +472,7 @@ class DocumentCreator:
 
     def _marge_info(self) -> None:
         if self.pdf_info:
-            self.doc_info["Entry_id"] = self.pdf_info["Entry_id"]
-            self.doc_info["Pdf_url"] = self.pdf_info["Pdf_url"]
-            self.doc_info["Updated"] = self.pdf_info["Updated"]
-            self.doc_info["Categories"] = self.pdf_info["Categories"]
-            self.doc_info["Comment"] = self.pdf_info["Comment"]
+            self.doc_info = _marge_pdf_info(self.doc_info, self.pdf_info)
         return None
 
     def create_docs(
@@ -377,7 +491,7 @@ class DocumentCreator:
             Optional[List[Document]]: Documentオブジェクトのリスト
         """
         try:
-            if (self.root is None) or (self.doc_info is None):
+            if (self.sections is None) or (self.doc_info is None):
                 raise ValueError(
                     "Error in DocumentReader.load_data: Invalid data"
                 )
@@ -393,11 +507,12 @@ class DocumentCreator:
             if self.pdf_info:
                 self._marge_info()
 
-            documents = _extract_documents(
-                div_list=self.div_list,
-                root=self.root,
-                doc_info=self.doc_info,
-                doc_id_type=doc_id_type,
+            documents = list(
+                _iter_documents(
+                    sections=iter(self.sections),
+                    doc_info=self.doc_info,
+                    doc_id_type=doc_id_type,
+                )
             )
             self.documents = documents
         except (ValueError, Exception) as e:
@@ -406,6 +521,61 @@ class DocumentCreator:
         else:
             return self.documents
 
+    @staticmethod
+    def load_many(
+        xml_paths: List[str],
+        workers: int | None = None,
+        contain_abst: bool = True,
+        pdf_infos: Dict[str, Dict[str, str]] | None = None,
+        doc_id_type: Literal[
+            "Section_No.", "Section_Title", "Serial_Number"
+        ] = "Serial_Number",
+    ) -> Iterator[LoadResult]:
+        """複数のXMLファイルをプロセスプールで並列に読み込むメソッド
+
+        読み込みが終わった順に結果を返す。失敗したファイルはerrorに
+        理由を入れて返し、残りのファイルの処理は続ける。
+
+        Args:
+            xml_paths (List[str]): XMLファイルのパスのリスト
+            workers (int | None, optional): ワーカープロセス数. Noneの場合はCPUコア数. Defaults to None.
+            contain_abst (bool, optional): 要約を含めるかどうか. Defaults to True.
+            pdf_infos (Dict[str, Dict[str, str]] | None, optional): 論文IDとarXivの論文情報の辞書. Defaults to None.
+            doc_id_type (Literal["Section_No.", "Section_Title", "Serial_Number"], optional): ドキュメントIDの種類. Defaults to "Serial_Number".
+
+        Yields:
+            LoadResult: (paper_id, documents, doc_info, elapsed, error)
+        """
+        if not isinstance(xml_paths, list):
+            raise TypeError("xml_paths must be list")
+        if pdf_infos is None:
+            pdf_infos = {}
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(
+                    _load_xml_worker,
+                    xml_path,
+                    contain_abst,
+                    pdf_infos.get(_get_paper_id(xml_path)),
+                    doc_id_type,
+                ): xml_path
+                for xml_path in xml_paths
+            }
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # ワーカープロセス自体が異常終了した場合
+                    paper_id = _get_paper_id(futures[future])
+                    result = LoadResult(paper_id, [], {}, 0.0, str(e))
+                if result.error is not None:
+                    print(
+                        f"Error in DocumentCreator.load_many: "
+                        f"{result.paper_id}: {result.error}"
+                    )
+                yield result
+
     def get_doc_info(self) -> Dict[str, str]:
         """PDFファイルの情報を取得するメソッド
 
@@ -1,35 +1,103 @@
 from src.arXivUtils import (
     create_paper_info,
     download_pdf,
+    download_pdfs,
     get_paper_by_id,
     get_paper_info,
+    get_paper_info_multi,
+    iter_paper_info,
+)
+from src.arXivStore import ArXivMetadataStore
+from src.GrobidUtils import (
+    GrobidServerClient,
+    TEICache,
+    process_pdf_with_grobid,
 )
 from src.Informations import DocsInfoDict, arXivInfoDict
 from src.model.llama_cpp import create_llama_cpp_model
-from src.OpenAIUtils import OpenAIModelList, get_message
-from src.SaveToNotion import write_markdown_to_notion
+from src.NotionMarkdown import iter_lines, iter_notion_blocks
+from src.OpenAICache import ResponseCache
+from src.OpenAIUtils import (
+    AsyncOpenAIClient,
+    OpenAIModelList,
+    get_message,
+    get_messages,
+)
+from src.SaveToNotion import (
+    NotionPageIndex,
+    NotionPageWriter,
+    PageProperties,
+    write_markdown_to_notion,
+    write_markdowns_to_notion,
+)
+from src.SectionCheckpoint import SectionCheckpoint, SectionCheckpointStore
+from src.SlackJobQueue import (
+    SummaryJob,
+    SummaryJobQueue,
+    SummaryResultIndex,
+)
 from src.SlackUtils import (
+    SlackStreamWriter,
     get_thread_messages,
     process_mention_event,
     write_message,
 )
-from src.Utils import write_markdown
-from src.XMLUtils import DocumentCreator, run_grobid
+from src.Utils import (
+    MarkdownFileSink,
+    consume_markdown_stream,
+    warmup_models,
+    write_markdown,
+    write_markdown_stream,
+)
+from src.XMLUtils import (
+    DocumentCreator,
+    LoadResult,
+    iter_documents,
+    run_grobid,
+)
 
 __all__ = [
     "create_paper_info",
     "download_pdf",
+    "download_pdfs",
     "get_paper_info",
+    "get_paper_info_multi",
+    "iter_paper_info",
     "get_paper_by_id",
+    "ArXivMetadataStore",
     "OpenAIModelList",
     "get_message",
+    "get_messages",
+    "AsyncOpenAIClient",
+    "ResponseCache",
+    "iter_lines",
+    "iter_notion_blocks",
     "write_markdown_to_notion",
+    "NotionPageWriter",
+    "NotionPageIndex",
+    "PageProperties",
+    "write_markdowns_to_notion",
+    "SectionCheckpoint",
+    "SectionCheckpointStore",
     "get_thread_messages",
     "process_mention_event",
+    "SlackStreamWriter",
     "write_message",
+    "SummaryJob",
+    "SummaryJobQueue",
+    "SummaryResultIndex",
     "write_markdown",
+    "write_markdown_stream",
+    "consume_markdown_stream",
+    "MarkdownFileSink",
+    "warmup_models",
     "DocumentCreator",
+    "iter_documents",
+    "LoadResult",
     "run_grobid",
+    "GrobidServerClient",
+    "process_pdf_with_grobid",
+    "TEICache",
     "create_llama_cpp_model",
     "DocsInfoDict",
     "arXivInfoDict",
@@ -0,0 +1,231 @@
+import datetime as dt
+import json
+import threading
+from typing import Any, Dict, List
+
+from src.Informations import arXivInfoDict
+from src.SQLiteUtils import SQLiteDatabase
+
+# メタデータキャッシュの保存先
+ARXIV_STORE_PATH = "./data/arxiv_cache.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS papers (
+    entry_id TEXT PRIMARY KEY,
+    published TEXT,
+    categories TEXT,
+    info TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_papers_published ON papers (published);
+CREATE TABLE IF NOT EXISTS keyword_papers (
+    keyword TEXT NOT NULL,
+    entry_id TEXT NOT NULL,
+    PRIMARY KEY (keyword, entry_id)
+);
+CREATE TABLE IF NOT EXISTS keyword_state (
+    keyword TEXT PRIMARY KEY,
+    last_published TEXT NOT NULL
+);
+"""
+
+
+def _to_text(value: Any) -> Any:
+    """arXivの値をJSONに保存できる形に変換する関数
+
+    Args:
+        value (Any): 変換する値
+
+    Returns:
+        Any: 変換した値
+    """
+    if isinstance(value, dt.datetime):
+        return value.isoformat()
+    if isinstance(value, list):
+        return [str(v) for v in value]
+    return value
+
+
+def _from_text(key: str, value: Any) -> Any:
+    """JSONから読み込んだ値を元の型に戻す関数
+
+    Args:
+        key (str): arXivInfoDictのキー
+        value (Any): 読み込んだ値
+
+    Returns:
+        Any: 元の型に戻した値
+    """
+    if key in ("Published", "Updated") and isinstance(value, str) and value:
+        try:
+            return dt.datetime.fromisoformat(value)
+        except ValueError:
+            return value
+    return value
+
+
+class ArXivMetadataStore:
+    def __init__(self, db_path: str = ARXIV_STORE_PATH) -> None:
+        """
+        ArXivMetadataStoreクラスのコンストラクタ
+
+        arXivInfoDictをEntry_idをキーにしてSQLiteに保存する。
+        キーワードごとに最後に取得した論文の投稿日時を記録し、
+        次回はそれ以降の論文だけをarXivに問い合わせる。
+
+        Args:
+            db_path (str, optional): SQLiteファイルのパス. Defaults to ARXIV_STORE_PATH.
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = SQLiteDatabase(db_path, _SCHEMA)
+
+    def upsert(
+        self,
+        paper_info: Dict[str, Any],
+        categories: List[str] | None = None,
+        keyword: str | None = None,
+    ) -> None:
+        """論文情報を保存するメソッド
+
+        Args:
+            paper_info (Dict[str, Any]): 論文情報の辞書
+            categories (List[str] | None, optional): 論文のカテゴリー. Defaults to None.
+            keyword (str | None, optional): 論文がヒットした検索キーワード. Defaults to None.
+        """
+        entry_id = paper_info.get("Entry_id")
+        if not entry_id:
+            raise ValueError("paper_info must have Entry_id")
+
+        info = {k: _to_text(v) for k, v in paper_info.items()}
+        with self._lock, self._db.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO papers"
+                " (entry_id, published, categories, info)"
+                " VALUES (?, ?, ?, ?)",
+                (
+                    entry_id,
+                    info.get("Published"),
+                    json.dumps(categories or []),
+                    json.dumps(info, ensure_ascii=False),
+                ),
+            )
+            if keyword is not None:
+                conn.execute(
+                    "INSERT OR IGNORE INTO keyword_papers (keyword, entry_id)"
+                    " VALUES (?, ?)",
+                    (keyword, entry_id),
+                )
+
+    def get(self, entry_id: str) -> Dict[str, Any] | None:
+        """Entry_idから論文情報を取得するメソッド
+
+        Args:
+            entry_id (str): 論文のID
+
+        Returns:
+            Dict[str, Any] | None: 論文情報. 保存されていない場合はNone
+        """
+        with self._db.connect() as conn:
+            row = conn.execute(
+                "SELECT info FROM papers WHERE entry_id = ?", (entry_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return self._load_info(row[0])
+
+    def search(
+        self,
+        keyword: str,
+        since: dt.datetime,
+        categories: List[str] | None = None,
+        max_result: int | None = None,
+    ) -> List[Dict[str, Any]]:
+        """キーワードにヒットした論文情報を新しい順に取得するメソッド
+
+        Args:
+            keyword (str): 検索キーワード
+            since (dt.datetime): この日時以降に投稿された論文を対象にする
+            categories (List[str] | None, optional): カテゴリーのリスト. Defaults to None.
+            max_result (int | None, optional): 取得する論文数の上限. Defaults to None.
+
+        Returns:
+            List[Dict[str, Any]]: 論文情報のリスト
+        """
+        with self._db.connect() as conn:
+            rows = conn.execute(
+                "SELECT p.info, p.categories FROM papers AS p"
+                " JOIN keyword_papers AS k ON p.entry_id = k.entry_id"
+                " WHERE k.keyword = ? AND p.published >= ?"
+                " ORDER BY p.published DESC",
+                (keyword, _to_utc(since).isoformat()),
+            ).fetchall()
+
+        category_set = set(categories) if categories else None
+        result_list = []
+        for info, paper_categories in rows:
+            if category_set is not None and not (
+                category_set & set(json.loads(paper_categories))
+            ):
+                continue
+            result_list.append(self._load_info(info))
+            if max_result is not None and len(result_list) >= max_result:
+                break
+        return result_list
+
+    def get_last_published(self, keyword: str) -> dt.datetime | None:
+        """キーワードで最後に取得した論文の投稿日時を取得するメソッド
+
+        Args:
+            keyword (str): 検索キーワード
+
+        Returns:
+            dt.datetime | None: 投稿日時. 未取得の場合はNone
+        """
+        with self._db.connect() as conn:
+            row = conn.execute(
+                "SELECT last_published FROM keyword_state WHERE keyword = ?",
+                (keyword,),
+            ).fetchone()
+        if row is None:
+            return None
+        return dt.datetime.fromisoformat(row[0])
+
+    def set_last_published(self, keyword: str, published: dt.datetime) -> None:
+        """キーワードで最後に取得した論文の投稿日時を更新するメソッド
+
+        Args:
+            keyword (str): 検索キーワード
+            published (dt.datetime): 投稿日時
+        """
+        last_published = self.get_last_published(keyword)
+        published = _to_utc(published)
+        if last_published is not None and last_published >= published:
+            return None
+        with self._lock, self._db.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO keyword_state (keyword, last_published)"
+                " VALUES (?, ?)",
+                (keyword, published.isoformat()),
+            )
+        return None
+
+    @staticmethod
+    def _load_info(info: str) -> Dict[str, Any]:
+        result = arXivInfoDict.copy()
+        for k, v in json.loads(info).items():
+            result[k] = _from_text(k, v)
+        return result
+
+
+def _to_utc(value: dt.datetime) -> dt.datetime:
+    """日時をUTCのタイムゾーン付きに変換する関数
+
+    Args:
+        value (dt.datetime): 日時. タイムゾーンがない場合はUTCとみなす
+
+    Returns:
+        dt.datetime: UTCの日時
+    """
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=dt.timezone.utc)
+    return value.astimezone(dt.timezone.utc).replace(microsecond=0)
@@ -1,10 +1,17 @@
 import datetime as dt
 import os
-from typing import Dict, List, Tuple
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Tuple
 from urllib.error import HTTPError
 
 import arxiv
+import requests
+from requests.adapters import HTTPAdapter
 
+from src.arXivStore import ArXivMetadataStore
 from src.Informations import arXivInfoDict
 
 # 興味があるカテゴリー群
@@ -14,42 +21,84 @@ CATEGORIES = [
     # ...
 ]
 
+# キャッシュを更新するときに、1つのキーワードでarXivに問い合わせるページ数の上限
+ARXIV_MAX_PAGES_PER_KEYWORD = 3
+
 # pdfの保存先
 base_dir = "./data"
 document_dir = base_dir + "/documents"
 
 
-def _generate_query(keyword: str, n_days: int) -> str:
+def _generate_category_filter(categories: List[str] | None) -> str:
+    """
+    カテゴリーで絞り込むための検索条件を生成する関数
+
+    Args:
+        categories (List[str] | None): カテゴリーのリスト
+
+    Returns:
+        str: " AND %28 cat:... OR cat:... %29" の形の条件. カテゴリーがない場合は空の文字列
+    """
+    if not categories:
+        return ""
+    conditions = " OR ".join(f"cat:{category}" for category in categories)
+    return f" AND %28 {conditions} %29"
+
+
+def _generate_query(
+    keyword: str, n_days: int, categories: List[str] | None = None
+) -> str:
     """
     検索クエリを生成する関数
 
     Args:
         keyword (str): 検索キーワード
         n_days (int): 検索する日数
+        categories (List[str] | None, optional): arXiv側で絞り込むカテゴリーのリスト. Defaults to None.
 
     Returns:
         query (str): 検索クエリ
     """
-    QUERY_TEMPLATE = (
-        "%28 ti:%22{}%22 OR abs:%22{}%22 %29 AND submittedDate: [{} TO {}]"
-    )
-
     try:
         today = dt.datetime.today()
         base_date = today - dt.timedelta(days=n_days)
-        query = QUERY_TEMPLATE.format(
-            keyword,
-            keyword,
-            base_date.strftime("%Y%m%d%H%M%S"),
-            today.strftime("%Y%m%d%H%M%S"),
-        )
-        return query
+        return _generate_query_between(keyword, base_date, today, categories)
     except Exception as e:
         # エラーが発生した場合は、空の文字列を返す
         print(f"Error in generate_query: {e}")
         return ""
 
 
+def _generate_query_between(
+    keyword: str,
+    start: dt.datetime,
+    end: dt.datetime,
+    categories: List[str] | None = None,
+) -> str:
+    """
+    投稿日時の範囲を指定して検索クエリを生成する関数
+
+    Args:
+        keyword (str): 検索キーワード
+        start (dt.datetime): 検索範囲の開始日時
+        end (dt.datetime): 検索範囲の終了日時
+        categories (List[str] | None, optional): arXiv側で絞り込むカテゴリーのリスト. Defaults to None.
+
+    Returns:
+        query (str): 検索クエリ
+    """
+    QUERY_TEMPLATE = (
+        "%28 ti:%22{}%22 OR abs:%22{}%22 %29 AND submittedDate: [{} TO {}]"
+    )
+    query = QUERY_TEMPLATE.format(
+        keyword,
+        keyword,
+        start.strftime("%Y%m%d%H%M%S"),
+        end.strftime("%Y%m%d%H%M%S"),
+    )
+    return query + _generate_category_filter(categories)
+
+
 def _search_arxiv(query: str, max_result: int) -> arxiv.Search:
     """
     arXiv APIを使って，論文情報を検索する関数
@@ -116,13 +165,7 @@ def _create_paper_list(
         result_list (List[Dict[str, str]]): 論文情報のリスト
     """
     try:
-        result_list = []
-        for paper in search.results():
-            if len((set(paper.categories) & set(categories))) == 0:
-                continue
-            else:
-                paper_info = create_paper_info(paper)
-                result_list.append(paper_info)
+        result_list = list(_iter_paper_list(search, categories))
     except Exception as e:
         # エラーが発生した場合は、空のリストを返す
         print(f"Error in create_paper_list: {e}")
@@ -131,8 +174,79 @@ def _create_paper_list(
         return result_list
 
 
+def _iter_paper_list(
+    search: arxiv.Search, categories: List[str] = CATEGORIES
+) -> Iterator[Dict[str, str]]:
+    """
+    arXiv APIの検索結果から，カテゴリーに含まれる論文情報を順に返す関数
+
+    arXivからページ単位で結果が届くたびに返すため、
+    全件の取得を待たずに後続の処理を始められる。
+
+    Args:
+        search (arxiv.Search): 検索結果
+        categories (list): カテゴリーのリスト
+
+    Yields:
+        paper_info (Dict[str, str]): 論文情報の辞書
+    """
+    category_set = set(categories)
+    for paper in search.results():
+        if category_set.isdisjoint(paper.categories):
+            continue
+        paper_info = create_paper_info(paper)
+        if paper_info:
+            yield paper_info
+
+
+def iter_paper_info(
+    keyword: str,
+    categories: List[str] = CATEGORIES,
+    n_days: int = 7,
+    max_result: int = 20,
+    server_side_filter: bool = True,
+) -> Iterator[Dict[str, str]]:
+    """
+    arXiv APIを使って，論文情報を取得できたものから順に返す関数
+
+    Args:
+        keyword (str): 検索キーワード
+        categories (list): カテゴリーのリスト
+        n_days (int): 検索する日数
+        max_result (int): 取得する論文数の上限
+        server_side_filter (bool, optional): arXiv側でもcat:でカテゴリーを絞り込むかどうか. Defaults to True.
+
+    Yields:
+        paper_info (Dict[str, str]): 論文情報の辞書
+    """
+    # 引数の例外処理
+    if not isinstance(keyword, str):
+        raise TypeError("keyword must be str")
+    if not isinstance(categories, list):
+        raise TypeError("categories must be list")
+    if not keyword:
+        return
+
+    query = _generate_query(
+        keyword, n_days, categories if server_side_filter else None
+    )
+    search = _search_arxiv(query, max_result)
+    if search is None:
+        return
+    try:
+        yield from _iter_paper_list(search, categories)
+    except Exception as e:
+        # 途中でエラーが発生した場合は、それまでの結果で打ち切る
+        print(f"Error in iter_paper_info: {e}")
+        return
+
+
 def _get_paper_info_from_arxiv(
-    query: str, max_result: int, categories: List[str] = CATEGORIES
+    query: str,
+    max_result: int,
+    categories: List[str] = CATEGORIES,
+    n_days: int = 7,
+    server_side_filter: bool = True,
 ) -> List[Dict[str, str]]:
     """
     arXiv APIを使って，論文情報を取得する関数
@@ -141,12 +255,18 @@ def _get_paper_info_from_arxiv(
         query (str): 検索クエリ
         max_result (int): 取得する論文数の上限
         categories (list): カテゴリーのリスト
+        n_days (int): 検索する日数
+        server_side_filter (bool, optional): arXiv側でもcat:でカテゴリーを絞り込むかどうか. Defaults to True.
 
     Returns:
         result_list (List[Dict[str, str]]): 論文情報のリスト
     """
     # 検索クエリを生成
-    query = _generate_query(query, n_days=7)
+    query = _generate_query(
+        query,
+        n_days=n_days,
+        categories=categories if server_side_filter else None,
+    )
 
     # arXiv APIを使って，論文情報を検索
     search = _search_arxiv(query, max_result)
@@ -159,11 +279,99 @@ def _get_paper_info_from_arxiv(
     return result_list
 
 
+def _get_state_key(keyword: str, categories: List[str] | None) -> str:
+    """
+    キーワードとカテゴリーから、前回取得した日時を記録するキーを生成する関数
+
+    カテゴリーで絞り込んで取得した場合は、別のカテゴリーの取得状況と区別する。
+
+    Args:
+        keyword (str): 検索キーワード
+        categories (List[str] | None): arXiv側で絞り込むカテゴリーのリスト
+
+    Returns:
+        str: 記録に使うキー
+    """
+    if not categories:
+        return keyword
+    return f"{keyword} [{','.join(sorted(categories))}]"
+
+
+def _update_store_from_arxiv(
+    keyword: str,
+    store: ArXivMetadataStore,
+    n_days: int,
+    max_result: int,
+    overlap_days: int = 1,
+    categories: List[str] | None = None,
+    max_pages: int = ARXIV_MAX_PAGES_PER_KEYWORD,
+) -> None:
+    """
+    前回取得した論文より新しい論文だけをarXivから取得して保存する関数
+
+    Args:
+        keyword (str): 検索キーワード
+        store (ArXivMetadataStore): 論文情報の保存先
+        n_days (int): 検索する日数
+        max_result (int): 1回の問い合わせで取得する論文数の上限
+        overlap_days (int, optional): 公開の遅れを考慮して前回分と重ねて検索する日数. Defaults to 1.
+        categories (List[str] | None, optional): arXiv側で絞り込むカテゴリーのリスト. Defaults to None.
+        max_pages (int, optional): 問い合わせる回数の上限. Defaults to ARXIV_MAX_PAGES_PER_KEYWORD.
+    """
+    state_key = _get_state_key(keyword, categories)
+    today = dt.datetime.now(dt.timezone.utc)
+    start = today - dt.timedelta(days=n_days)
+    last_published = store.get_last_published(state_key)
+    if last_published is not None:
+        start = max(start, last_published - dt.timedelta(days=overlap_days))
+
+    # arXiv APIを使って，前回以降の論文情報を検索
+    # 新しい順にmax_result件ずつ取得し、上限に達した場合は
+    # 取得した最も古い論文より前を続けて検索して、範囲内の論文を取りこぼさない
+    latest = None
+    end = today
+    for n_pages in range(1, max(max_pages, 1) + 1):
+        query = _generate_query_between(keyword, start, end, categories)
+        search = _search_arxiv(query, max_result)
+        if search is None:
+            return None
+
+        n_results = 0
+        oldest = None
+        for paper in search.results():
+            n_results += 1
+            if oldest is None or paper.published < oldest:
+                oldest = paper.published
+            paper_info = create_paper_info(paper)
+            if not paper_info:
+                continue
+            store.upsert(
+                paper_info, categories=paper.categories, keyword=keyword
+            )
+            if latest is None or paper.published > latest:
+                latest = paper.published
+
+        if n_results < max_result or oldest is None:
+            break
+        if oldest >= end or n_pages >= max_pages:
+            # 同じ日時の論文だけで上限に達した場合や、問い合わせ回数の上限に達した場合は、
+            # 次回は取得できた最も古い論文から検索する
+            latest = oldest
+            break
+        end = oldest
+
+    if latest is not None:
+        store.set_last_published(state_key, latest)
+    return None
+
+
 def get_paper_info(
     keyword: str,
     categories: List[str] = CATEGORIES,
     n_days: int = 7,
     max_result: int = 20,
+    store: ArXivMetadataStore | None = None,
+    server_side_filter: bool = True,
 ) -> List[Dict[str, str]]:
     """
     arXiv APIを使って，論文情報を取得する関数
@@ -173,6 +381,11 @@ def get_paper_info(
         categories (list): カテゴリーのリスト
         n_days (int): 検索する日数
         max_result (int): 取得する論文数の上限
+        store (ArXivMetadataStore | None, optional): 論文情報のキャッシュ.
+            指定した場合は前回以降の論文だけをarXivに問い合わせ、
+            残りはキャッシュから返す. 問い合わせはarXiv側でもcat:で絞り込み、
+            ARXIV_MAX_PAGES_PER_KEYWORD回までにする. Defaults to None.
+        server_side_filter (bool, optional): arXiv側でもcat:でカテゴリーを絞り込むかどうか. Defaults to True.
 
     Returns:
         result_list (List[Dict[str, str]]): 論文情報のリスト
@@ -192,9 +405,26 @@ def get_paper_info(
         if not keyword:
             return []
 
+        # キャッシュを使う場合は、新しい論文だけを取得してキャッシュから返す
+        if store is not None:
+            _update_store_from_arxiv(
+                keyword, store, n_days, max_result, categories=categories
+            )
+            since = dt.datetime.now(dt.timezone.utc) - dt.timedelta(days=n_days)
+            return store.search(
+                keyword,
+                since=since,
+                categories=categories,
+                max_result=max_result,
+            )
+
         # arXiv APIを使って，論文情報を取得
         result_list = _get_paper_info_from_arxiv(
-            keyword, max_result, categories
+            keyword,
+            max_result,
+            categories,
+            n_days=n_days,
+            server_side_filter=server_side_filter,
         )
 
         return result_list
@@ -205,6 +435,177 @@ def get_paper_info(
         return []
 
 
+def _generate_multi_keyword_query(
+    keywords: List[str], n_days: int, categories: List[str] | None = None
+) -> str:
+    """
+    複数のキーワードをORでつないだ検索クエリを生成する関数
+
+    Args:
+        keywords (List[str]): 検索キーワードのリスト
+        n_days (int): 検索する日数
+        categories (List[str] | None, optional): arXiv側で絞り込むカテゴリーのリスト. Defaults to None.
+
+    Returns:
+        query (str): 検索クエリ
+    """
+    today = dt.datetime.today()
+    base_date = today - dt.timedelta(days=n_days)
+    conditions = " OR ".join(
+        f"ti:%22{keyword}%22 OR abs:%22{keyword}%22" for keyword in keywords
+    )
+    query = "%28 {} %29 AND submittedDate: [{} TO {}]".format(
+        conditions,
+        base_date.strftime("%Y%m%d%H%M%S"),
+        today.strftime("%Y%m%d%H%M%S"),
+    )
+    return query + _generate_category_filter(categories)
+
+
+def _match_keywords(
+    paper_info: Dict[str, str], keywords: List[str]
+) -> List[str]:
+    """
+    論文のタイトルと概要に含まれるキーワードを判定する関数
+
+    Args:
+        paper_info (Dict[str, str]): 論文情報の辞書
+        keywords (List[str]): 検索キーワードのリスト
+
+    Returns:
+        List[str]: 論文に含まれるキーワードのリスト
+    """
+    text = f"{paper_info['Title']} {paper_info['Summary']}"
+    return [
+        keyword
+        for keyword in keywords
+        if re.search(rf"\b{re.escape(keyword)}", text, flags=re.IGNORECASE)
+    ]
+
+
+def _limit_per_keyword(
+    result_list: List[Dict[str, str]], keywords: List[str], max_result: int
+) -> List[Dict[str, str]]:
+    """
+    キーワードごとの論文数がmax_resultを超えないように、論文情報を絞り込む関数
+
+    ヒットしたキーワードのどれか1つでも上限に達していなければ残す。
+    どのキーワードにもヒットしない論文は、上限に数えずに残す。
+
+    Args:
+        result_list (List[Dict[str, str]]): "Keywords"を付けた論文情報のリスト
+        keywords (List[str]): 検索キーワードのリスト
+        max_result (int): キーワード1つあたりの論文数の上限
+
+    Returns:
+        List[Dict[str, str]]: 絞り込んだ論文情報のリスト
+    """
+    counts = {keyword: 0 for keyword in keywords}
+    limited_list = []
+    for paper_info in result_list:
+        matched = paper_info["Keywords"]
+        if matched and all(
+            counts[keyword] >= max_result for keyword in matched
+        ):
+            continue
+        for keyword in matched:
+            counts[keyword] += 1
+        limited_list.append(paper_info)
+    return limited_list
+
+
+def _merge_paper_lists(
+    paper_lists: Dict[str, List[Dict[str, str]]]
+) -> List[Dict[str, str]]:
+    """
+    キーワードごとの論文情報のリストを、Entry_idで重複を除いて1つにまとめる関数
+
+    Args:
+        paper_lists (Dict[str, List[Dict[str, str]]]): キーワードと論文情報のリストの辞書
+
+    Returns:
+        result_list (List[Dict[str, str]]): "Keywords"にヒットしたキーワードを追加した論文情報のリスト
+    """
+    merged = {}
+    for keyword, paper_list in paper_lists.items():
+        for paper_info in paper_list:
+            entry_id = paper_info["Entry_id"]
+            if entry_id not in merged:
+                merged[entry_id] = paper_info.copy()
+                merged[entry_id]["Keywords"] = []
+            if keyword not in merged[entry_id]["Keywords"]:
+                merged[entry_id]["Keywords"].append(keyword)
+    return list(merged.values())
+
+
+def get_paper_info_multi(
+    keywords: List[str],
+    categories: List[str] = CATEGORIES,
+    n_days: int = 7,
+    max_result: int = 20,
+    store: ArXivMetadataStore | None = None,
+    server_side_filter: bool = True,
+) -> List[Dict[str, str]]:
+    """
+    複数のキーワードで論文情報を検索し、重複を除いて返す関数
+
+    キャッシュを使わない場合は、キーワードをORでつないだ1回の検索で取得する。
+    キャッシュを使う場合は、キーワードごとに前回以降の論文だけを取得する。
+
+    Args:
+        keywords (List[str]): 検索キーワードのリスト
+        categories (list): カテゴリーのリスト
+        n_days (int): 検索する日数
+        max_result (int): キーワード1つあたりの取得する論文数の上限
+        store (ArXivMetadataStore | None, optional): 論文情報のキャッシュ. Defaults to None.
+        server_side_filter (bool, optional): arXiv側でもcat:でカテゴリーを絞り込むかどうか. Defaults to True.
+
+    Returns:
+        result_list (List[Dict[str, str]]): 論文情報のリスト.
+            各論文の"Keywords"にヒットしたキーワードのリストが入る
+    """
+    try:
+        # 引数の例外処理
+        if not isinstance(keywords, list):
+            raise TypeError("keywords must be list")
+        keywords = [keyword for keyword in keywords if keyword]
+        if not keywords:
+            return []
+
+        if store is not None:
+            paper_lists = {
+                keyword: get_paper_info(
+                    keyword,
+                    categories=categories,
+                    n_days=n_days,
+                    max_result=max_result,
+                    store=store,
+                )
+                for keyword in keywords
+            }
+            return _merge_paper_lists(paper_lists)
+
+        # キーワードをORでつないで1回で検索する
+        query = _generate_multi_keyword_query(
+            keywords, n_days, categories if server_side_filter else None
+        )
+        search = _search_arxiv(query, max_result * len(keywords))
+        if search is None:
+            return []
+        result_list = _create_paper_list(search, categories)
+
+        # 各論文にヒットしたキーワードを付ける
+        for paper_info in result_list:
+            paper_info["Keywords"] = _match_keywords(paper_info, keywords)
+        # 1つのキーワードの論文だけで、他のキーワードの枠を埋めないようにする
+        return _limit_per_keyword(result_list, keywords, max_result)
+
+    except Exception as e:
+        # エラーが発生した場合は、空のリストを返す
+        print(f"Error in get_paper_info_multi: {e}")
+        return []
+
+
 def get_paper_by_id(entry_id: str) -> arxiv.Result:
     """
     arXiv APIを使って，論文情報を取得する関数
@@ -233,6 +634,27 @@ def get_paper_by_id(entry_id: str) -> arxiv.Result:
     return paper
 
 
+def _get_dir_name(title: str) -> str:
+    """論文のタイトルから保存先のディレクトリ名を作成する関数
+
+    Args:
+        title (str): 論文のタイトル
+
+    Returns:
+        dir_name (str): ディレクトリ名
+    """
+    dir_name = (
+        title.replace(" ", "_")
+        .replace(":", "")
+        .replace(",", "")
+        .replace("/", "")
+        .replace("\\", "")
+        .replace("(", "")
+        .replace(")", "")
+    )
+    return dir_name
+
+
 def download_pdf(
     paper: arxiv.Result, document_root_dir_path: str
 ) -> Tuple[str, str, str]:
@@ -255,15 +677,7 @@ def download_pdf(
         if not isinstance(document_root_dir_path, str):
             raise TypeError("document_root_dir_path must be str")
 
-        dir_name = (
-            paper.title.replace(" ", "_")
-            .replace(":", "")
-            .replace(",", "")
-            .replace("/", "")
-            .replace("\\", "")
-            .replace("(", "")
-            .replace(")", "")
-        )
+        dir_name = _get_dir_name(paper.title)
         dir_path = f"{document_root_dir_path}/{dir_name}/"
 
         pdf_name = f"{dir_name}"
@@ -294,6 +708,215 @@ def download_pdf(
         return dir_path, pdf_path, pdf_name
 
 
+def _is_valid_pdf(pdf_path: str, expected_size: int | None = None) -> bool:
+    """ダウンロードしたファイルがPDFとして正しいかを確認する関数
+
+    Args:
+        pdf_path (str): ファイルのパス
+        expected_size (int | None, optional): 期待するファイルサイズ. Defaults to None.
+
+    Returns:
+        bool: Trueなら正しい
+    """
+    try:
+        if expected_size is not None:
+            if os.path.getsize(pdf_path) != expected_size:
+                return False
+        with open(pdf_path, mode="rb") as f:
+            return f.read(5) == b"%PDF-"
+    except OSError:
+        return False
+
+
+def _get_total_size(response: requests.Response, offset: int) -> int | None:
+    """レスポンスヘッダーからファイル全体のサイズを取得する関数
+
+    Args:
+        response (requests.Response): レスポンス
+        offset (int): 再開したバイト位置
+
+    Returns:
+        int | None: ファイル全体のサイズ. 不明な場合はNone
+    """
+    content_range = response.headers.get("Content-Range")
+    if content_range:
+        match = re.search(r"/(\d+)$", content_range)
+        if match:
+            return int(match.group(1))
+    content_length = response.headers.get("Content-Length")
+    if content_length is not None:
+        return offset + int(content_length)
+    return None
+
+
+def _download_file(
+    session: requests.Session,
+    url: str,
+    pdf_path: str,
+    max_retries: int = 3,
+    backoff: float = 1.0,
+    timeout: float = 60.0,
+) -> str:
+    """ファイルを途中から再開可能な形でダウンロードする関数
+
+    ダウンロード中のデータは"<pdf_path>.part"に保存し、
+    失敗した場合はRangeヘッダーで続きから再開する。
+
+    Args:
+        session (requests.Session): HTTPセッション
+        url (str): ダウンロードするURL
+        pdf_path (str): 保存先のパス
+        max_retries (int, optional): 再試行回数. Defaults to 3.
+        backoff (float, optional): 再試行までの待ち時間の基準 (秒). Defaults to 1.0.
+        timeout (float, optional): タイムアウト秒数. Defaults to 60.0.
+
+    Returns:
+        pdf_path (str): 保存したPDFのパス
+    """
+    part_path = pdf_path + ".part"
+    for cnt in range(max_retries + 1):
+        try:
+            offset = (
+                os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            )
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            with session.get(
+                url, headers=headers, stream=True, timeout=timeout
+            ) as response:
+                response.raise_for_status()
+                # サーバーがRangeに対応していない場合は最初から保存し直す
+                if offset and response.status_code != 206:
+                    offset = 0
+                total_size = _get_total_size(response, offset)
+                with open(part_path, mode="ab" if offset else "wb") as f:
+                    for chunk in response.iter_content(chunk_size=64 * 1024):
+                        f.write(chunk)
+
+            # 途中で接続が切れた場合は、続きから再開できるように残しておく
+            size = os.path.getsize(part_path)
+            if total_size is not None and size < total_size:
+                raise ValueError(
+                    f"Download incomplete ({size}/{total_size} bytes): {url}"
+                )
+            # サイズが大きすぎる場合やPDFのヘッダーがない場合は、最初からやり直す
+            if not _is_valid_pdf(part_path, total_size):
+                os.remove(part_path)
+                raise ValueError(f"Downloaded file is broken: {url}")
+            os.replace(part_path, pdf_path)
+            return pdf_path
+        except (requests.RequestException, ValueError) as e:
+            print(f"Error in download_file: {e}")
+            # 範囲外のRangeを要求した場合は最初からやり直す
+            if (
+                isinstance(e, requests.HTTPError)
+                and e.response is not None
+                and e.response.status_code == 416
+                and os.path.exists(part_path)
+            ):
+                os.remove(part_path)
+            if cnt == max_retries:
+                raise e
+            # 指数バックオフ (ジッター付き) で待ってから再試行する
+            time.sleep(backoff * 2**cnt + random.uniform(0, backoff))
+
+
+def _download_pdf_with_session(
+    session: requests.Session,
+    paper: Any,
+    document_root_dir_path: str,
+    max_retries: int,
+    backoff: float,
+) -> Tuple[str, str, str]:
+    """HTTPセッションを使って1本の論文のPDFをダウンロードする関数
+
+    Args:
+        session (requests.Session): HTTPセッション
+        paper (Any): 論文情報 (titleとpdf_urlを持つオブジェクト)
+        document_root_dir_path (str): PDFを保存する親ディレクトリのパス
+        max_retries (int): 再試行回数
+        backoff (float): 再試行までの待ち時間の基準 (秒)
+
+    Returns:
+        dir_path (str): PDFを保存したディレクトリのパス
+        pdf_path (str): PDFのパス
+        pdf_name (str): PDFのファイル名
+    """
+    try:
+        pdf_name = _get_dir_name(paper.title)
+        dir_path = f"{document_root_dir_path}/{pdf_name}/"
+        pdf_path = os.path.join(dir_path, pdf_name + ".pdf")
+        os.makedirs(dir_path, exist_ok=True)
+
+        # ダウンロード済みの場合はスキップする
+        if _is_valid_pdf(pdf_path):
+            print(f"Skip downloading {pdf_name}")
+            return dir_path, pdf_path, pdf_name
+
+        print(f"Downloading {pdf_name}...")
+        _download_file(
+            session,
+            paper.pdf_url,
+            pdf_path,
+            max_retries=max_retries,
+            backoff=backoff,
+        )
+    except Exception as e:
+        # エラーが発生した場合は、Noneを返す
+        print(f"Error in download_pdfs: {e}")
+        return None, None, None
+    else:
+        print(f"Downloaded {pdf_name}!")
+        return dir_path, pdf_path, pdf_name
+
+
+def download_pdfs(
+    papers: List[arxiv.Result],
+    document_root_dir_path: str,
+    max_concurrency: int = 4,
+    max_retries: int = 3,
+    backoff: float = 1.0,
+) -> List[Tuple[str, str, str]]:
+    """
+    複数の論文のPDFを並列にダウンロードする関数
+
+    Args:
+        papers (List[arxiv.Result]): 論文情報のリスト
+        document_root_dir_path (str): PDFを保存する親ディレクトリのパス
+        max_concurrency (int, optional): 同時にダウンロードする数. Defaults to 4.
+        max_retries (int, optional): 1本あたりの再試行回数. Defaults to 3.
+        backoff (float, optional): 再試行までの待ち時間の基準 (秒). Defaults to 1.0.
+
+    Returns:
+        List[Tuple[str, str, str]]: papersと同じ順番の(dir_path, pdf_path, pdf_name)のリスト.
+            失敗した論文は(None, None, None)
+    """
+    # 引数の例外処理
+    if not isinstance(papers, list):
+        raise TypeError("papers must be list")
+    if not isinstance(document_root_dir_path, str):
+        raise TypeError("document_root_dir_path must be str")
+    if not isinstance(max_concurrency, int) or max_concurrency < 1:
+        raise ValueError("max_concurrency must be a positive int")
+
+    # コネクションを再利用するためのセッション
+    with requests.Session() as session:
+        adapter = HTTPAdapter(pool_maxsize=max_concurrency)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            results = executor.map(
+                lambda paper: _download_pdf_with_session(
+                    session,
+                    paper,
+                    document_root_dir_path,
+                    max_retries,
+                    backoff,
+                ),
+                papers,
+            )
+            return list(results)
+
+
 if __name__ == "__main__":
     keyword = "model"  # 検索キーワード
     CATEGORIES = [
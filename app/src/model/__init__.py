@@ -1,4 +1,19 @@
 from src.model.huggingface import create_huggingface_model
-from src.model.llama_cpp import create_llama_cpp_model
+from src.model.llama_cpp import (
+    LlamaCppProfile,
+    PrefixCachedLlama,
+    create_llama_cpp_model,
+    enable_prefix_cache,
+)
+from src.model.registry import ModelKey, ModelRegistry, model_registry
 
-__all__ = ["create_huggingface_model", "create_llama_cpp_model"]
+__all__ = [
+    "create_huggingface_model",
+    "create_llama_cpp_model",
+    "enable_prefix_cache",
+    "PrefixCachedLlama",
+    "LlamaCppProfile",
+    "ModelKey",
+    "ModelRegistry",
+    "model_registry",
+]
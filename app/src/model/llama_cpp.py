@@ -1,4 +1,298 @@
-from typing import Any, Literal
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, field, replace
+from typing import Any, Dict, Iterator, List, Literal
+
+# プレフィックスを取り出すために、ユーザーの入力の代わりに入れる文字列
+_PREFIX_SENTINEL = "<<PREFIX_SENTINEL>>"
+# KVキャッシュの型とggmlの型番号の対応
+_KV_CACHE_TYPES = {"f32": 0, "f16": 1, "q4_0": 2, "q8_0": 8}
+# GPUにオフロードできる場合に、GPUに載せるレイヤー数
+LLAMA_CPP_GPU_LAYERS = 40
+
+
+def _count_physical_cores() -> int:
+    """物理コア数を取得する関数
+
+    llama.cppはハイパースレッドを使っても速くならないため、
+    論理コア数ではなく物理コア数をスレッド数の目安にする。
+
+    Returns:
+        int: 物理コア数. 取得できない場合は使用可能な論理コア数
+    """
+    try:
+        n_logical = len(os.sched_getaffinity(0))
+    except AttributeError:
+        n_logical = os.cpu_count() or 1
+    try:
+        cores = set()
+        physical_id = core_id = None
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                key = key.strip()
+                if key == "physical id":
+                    physical_id = value.strip()
+                elif key == "core id":
+                    core_id = value.strip()
+                elif not key:
+                    if core_id is not None:
+                        cores.add((physical_id, core_id))
+                    physical_id = core_id = None
+        if core_id is not None:
+            cores.add((physical_id, core_id))
+    except OSError:
+        return n_logical
+    if not cores:
+        return n_logical
+    return max(min(len(cores), n_logical), 1)
+
+
+def _supports_gpu_offload() -> bool:
+    """llama.cppがGPUにレイヤーをオフロードできるかを判定する関数
+
+    llama-cpp-pythonがCPU向けにビルドされている場合は、
+    n_gpu_layersを指定してもGPUは使われない。
+
+    Returns:
+        bool: GPUにオフロードできる場合はTrue
+    """
+    try:
+        import llama_cpp
+    except ImportError:
+        return False
+    supports_gpu_offload = getattr(
+        llama_cpp, "llama_supports_gpu_offload", None
+    )
+    try:
+        if supports_gpu_offload is not None:
+            return bool(supports_gpu_offload())
+        # 古いllama-cpp-pythonには判定用の関数がない
+        return bool(getattr(llama_cpp, "GGML_USE_CUBLAS", False))
+    except Exception as e:
+        print(f"Error in _supports_gpu_offload: {e}")
+        return False
+
+
+@dataclass(frozen=True)
+class LlamaCppProfile:
+    """llama.cppの実行時の設定
+
+    Args:
+        n_threads (int): 生成に使うスレッド数
+        n_batch (int): プロンプトを評価するときのバッチサイズ
+        n_ctx (int): コンテキストのサイズ
+        n_gpu_layers (int): GPUに載せるレイヤー数. CPUのみの場合は0
+        use_mmap (bool): モデルファイルをmmapで読み込むかどうか
+        use_mlock (bool): モデルをメモリに固定するかどうか
+        kv_cache_type (Literal["f32", "f16", "q8_0", "q4_0"]): KVキャッシュの型
+    """
+
+    n_threads: int = field(default_factory=_count_physical_cores)
+    n_batch: int = 512
+    n_ctx: int = 4096
+    n_gpu_layers: int = 0
+    use_mmap: bool = True
+    use_mlock: bool = False
+    kv_cache_type: Literal["f32", "f16", "q8_0", "q4_0"] = "f16"
+
+    def __post_init__(self) -> None:
+        if self.n_threads < 1 or self.n_batch < 1 or self.n_ctx < 1:
+            raise ValueError("n_threads, n_batch and n_ctx must be positive")
+        if self.kv_cache_type not in _KV_CACHE_TYPES:
+            raise ValueError(
+                f"kv_cache_type must be one of {list(_KV_CACHE_TYPES)}, but got {self.kv_cache_type}."
+            )
+
+    @classmethod
+    def auto(cls, **kwargs) -> "LlamaCppProfile":
+        """CPUのコア数とGPUへのオフロードの可否から設定を作成するメソッド
+
+        Args:
+            kwargs: 上書きする設定
+
+        Returns:
+            LlamaCppProfile: 設定
+        """
+        kwargs.setdefault("n_threads", _count_physical_cores())
+        if "n_gpu_layers" not in kwargs:
+            kwargs["n_gpu_layers"] = (
+                LLAMA_CPP_GPU_LAYERS if _supports_gpu_offload() else 0
+            )
+        return cls(**kwargs)
+
+    def replace(self, **kwargs) -> "LlamaCppProfile":
+        """一部の設定を変更した設定を返すメソッド"""
+        return replace(self, **kwargs)
+
+    def to_kwargs(self) -> Dict[str, Any]:
+        """llama_cpp.Llamaに渡す引数に変換するメソッド
+
+        Returns:
+            Dict[str, Any]: llama_cpp.Llamaの引数
+        """
+        kwargs = asdict(self)
+        kv_cache_type = kwargs.pop("kv_cache_type")
+        if kv_cache_type in ("f32", "f16"):
+            kwargs["f16_kv"] = kv_cache_type == "f16"
+        else:
+            # 量子化したKVキャッシュは、新しいllama-cpp-pythonでのみ使える
+            kwargs["type_k"] = _KV_CACHE_TYPES[kv_cache_type]
+            kwargs["type_v"] = _KV_CACHE_TYPES[kv_cache_type]
+        return kwargs
+
+
+def to_llama2_prompt(system: str, user: str) -> str:
+    """Llama 2形式のプロンプトを作成する関数
+
+    Args:
+        system (str): システムプロンプト
+        user (str): ユーザーの入力
+
+    Returns:
+        str: プロンプト
+    """
+    return f"[INST] <<SYS>>\n{system}\n<</SYS>>\n\n{user} [/INST]"
+
+
+class PrefixCachedLlama:
+    def __init__(self, llama: Any, prefixes: List[str]) -> None:
+        """
+        PrefixCachedLlamaクラスのコンストラクタ
+
+        llama_cpp.Llamaを包み、共通のプレフィックス (システムプロンプト) を
+        1度だけ評価して状態を保存する。プレフィックスで始まるプロンプトが
+        来たら保存した状態を復元するので、llama.cppはプレフィックス以降の
+        トークンだけを評価すればよい。
+
+        Args:
+            llama (Any): llama_cpp.Llamaのインスタンス
+            prefixes (List[str]): キャッシュするプレフィックスのリスト
+        """
+        self.llama = llama
+        # 長いプレフィックスから順に照合する
+        self.prefixes = sorted(
+            set(filter(None, prefixes)), key=len, reverse=True
+        )
+        self.hits = 0
+        self.misses = 0
+        self._states: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        # tokenizeなど、その他の属性は元のモデルに任せる
+        return getattr(self.llama, name)
+
+    def __call__(self, prompt: str, *args, **kwargs) -> Any:
+        if kwargs.get("stream"):
+            return self._stream(prompt, *args, **kwargs)
+        with self._lock:
+            return self._generate(prompt, *args, **kwargs)
+
+    def _generate(self, prompt: str, *args, **kwargs) -> Any:
+        """プレフィックスの状態を復元してから生成するメソッド. ロックを取得してから呼ぶ"""
+        prefix = self._match_prefix(prompt)
+        if prefix is None:
+            self.misses += 1
+        else:
+            self.llama.load_state(self._get_state(prefix))
+            self.hits += 1
+        # 復元した状態と共通するトークンは、llama.cppが評価を省略する
+        return self.llama(prompt, *args, **kwargs)
+
+    def _stream(self, prompt: str, *args, **kwargs) -> Iterator[Any]:
+        """ストリーミングで生成するジェネレータ
+
+        llama.cppはトークンを取り出すたびにモデルの状態を進めるため、
+        全てのトークンを返し終わるか、ジェネレータが閉じられるまでロックを保持する。
+        """
+        with self._lock:
+            yield from self._generate(prompt, *args, **kwargs)
+
+    def _match_prefix(self, prompt: str) -> str | None:
+        """プロンプトが始まるプレフィックスを探すメソッド"""
+        for prefix in self.prefixes:
+            if prompt.startswith(prefix):
+                return prefix
+        return None
+
+    def _get_state(self, prefix: str) -> Any:
+        """プレフィックスを評価した状態を取得するメソッド"""
+        if prefix not in self._states:
+            # ライブラリと同じ方法でトークン化されるように、1トークンだけ生成して評価する
+            self.llama.reset()
+            self.llama(prefix, max_tokens=1)
+            self._states[prefix] = self.llama.save_state()
+        return self._states[prefix]
+
+    def warmup(self) -> None:
+        """全てのプレフィックスを事前に評価するメソッド"""
+        with self._lock:
+            for prefix in self.prefixes:
+                self._get_state(prefix)
+
+    def stats(self) -> Dict[str, int]:
+        """キャッシュのヒット数とミス数を返すメソッド
+
+        Returns:
+            Dict[str, int]: ヒット数・ミス数・プレフィックス数
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "prefixes": len(self._states),
+        }
+
+
+def get_system_prompt_prefixes(model: Any, system_prompt: str) -> List[str]:
+    """システムプロンプトから、プロンプトの共通プレフィックスを作成する関数
+
+    Args:
+        model (Any): LlamaCPPモデル
+        system_prompt (str): システムプロンプト
+
+    Returns:
+        List[str]: チャット形式とLlama 2形式のプレフィックスのリスト
+    """
+    prefixes = [to_llama2_prompt(system_prompt, _PREFIX_SENTINEL)]
+    messages_to_prompt = getattr(model, "messages_to_prompt", None)
+    if messages_to_prompt is not None:
+        from llama_index.llms.base import ChatMessage, MessageRole
+
+        prefixes.append(
+            messages_to_prompt(
+                [
+                    ChatMessage(content=system_prompt, role=MessageRole.SYSTEM),
+                    ChatMessage(
+                        content=_PREFIX_SENTINEL, role=MessageRole.USER
+                    ),
+                ]
+            )
+        )
+    return [prefix.split(_PREFIX_SENTINEL)[0] for prefix in prefixes]
+
+
+def enable_prefix_cache(model: Any, system_prompt: str) -> PrefixCachedLlama:
+    """LlamaCPPモデルでシステムプロンプトのKVキャッシュを再利用する関数
+
+    Args:
+        model (Any): llama_indexまたはlangchainのLlamaCPPモデル
+        system_prompt (str): システムプロンプト
+
+    Returns:
+        PrefixCachedLlama: モデルに設定したラッパー
+    """
+    prefixes = get_system_prompt_prefixes(model, system_prompt)
+    if hasattr(model, "client"):
+        # langchainのLlamaCpp
+        cached = PrefixCachedLlama(model.client, prefixes)
+        model.client = cached
+    else:
+        # llama_indexのLlamaCPP
+        cached = PrefixCachedLlama(model._model, prefixes)
+        model._model = cached
+    return cached
 
 
 def create_llama_cpp_model(
@@ -8,6 +302,8 @@ def create_llama_cpp_model(
     temperature: float = 0.0,
     context_window: int = 4096,
     max_tokens: int = 2048,
+    system_prompt: str | None = None,
+    profile: LlamaCppProfile | None = None,
 ) -> Any:
     """
     LlamaCPPモデルを生成する関数
@@ -18,6 +314,8 @@ def create_llama_cpp_model(
         model_path (str | None): モデルのパス
         temperature (float): 生成される文章の多様性を調整する温度パラメータ
         context_window (int): コンテキストウィンドウのサイズ
+        system_prompt (str | None): 指定した場合は、このシステムプロンプトのKVキャッシュを再利用する
+        profile (LlamaCppProfile | None): 実行時の設定. Noneの場合はCPUのコア数とGPUへのオフロードの可否から決める
 
     Returns:
         LlamaCPP: 生成されたLlamaCPPモデル
@@ -30,6 +328,10 @@ def create_llama_cpp_model(
     else:
         raise ValueError("Either model_url or model_path must be specified.")
 
+    if profile is None:
+        profile = LlamaCppProfile.auto(n_ctx=context_window)
+    print(f"llama.cpp profile: {profile}")
+
     if package_name == "llama_index":
         model = _create_llama_index_cpp_model(
             model_url=model_url_or_path,
@@ -37,17 +339,21 @@ def create_llama_cpp_model(
             temperature=temperature,
             context_window=context_window,
             max_tokens=max_tokens,
+            profile=profile,
         )
     elif package_name == "langchain":
         model = _create_langchain_cpp_model(
             model_path=model_url_or_path,
             temperature=temperature,
             max_tokens=max_tokens,
+            profile=profile,
         )
     else:
         raise ValueError(
             f"package_name must be one of ['llama_cpp', 'langchain'], but got {package_name}."
         )
+    if system_prompt is not None:
+        enable_prefix_cache(model, system_prompt).warmup()
     return model
 
 
@@ -57,6 +363,7 @@ def _create_llama_index_cpp_model(
     temperature: float = 0.0,
     context_window: int = 4096,
     max_tokens: int = 2048,
+    profile: LlamaCppProfile | None = None,
 ) -> Any:
     """
     llama_indexパッケージを使用して、LlamaCPPモデルを生成する関数
@@ -67,6 +374,7 @@ def _create_llama_index_cpp_model(
         temperature (float): 生成される文章の多様性を調整する温度パラメータ
         context_window (int): コンテキストウィンドウのサイズ
         max_tokens (int): 生成される文章の最大トークン数
+        profile (LlamaCppProfile | None): 実行時の設定
 
     Returns:
         LlamaCPP: 生成されたLlamaCPPモデル
@@ -74,10 +382,11 @@ def _create_llama_index_cpp_model(
 
     from llama_index.llms import LlamaCPP as LlamaIndexCPP
 
-    # GPU を使用する場合の設定
-    n_gpu_layers = 40
-    n_batch = 16
-    n_ctx = 4096
+    if profile is None:
+        profile = LlamaCppProfile.auto(n_ctx=context_window)
+    # n_ctxはcontext_windowから設定される
+    model_kwargs = profile.to_kwargs()
+    model_kwargs.pop("n_ctx")
 
     # モデルのURLまたはパスを取得する
     if isinstance(model_url, str):
@@ -95,11 +404,7 @@ def _create_llama_index_cpp_model(
             temperature=temperature,
             max_new_tokens=max_tokens,
             context_window=context_window,
-            model_kwargs={
-                "n_gpu_layers=": n_gpu_layers,
-                "n_batch=": n_batch,
-                "n_ctx=": n_ctx,
-            },
+            model_kwargs=model_kwargs,
             verbose=True,
         )
         return model
@@ -116,6 +421,7 @@ def _create_langchain_cpp_model(
     model_path: str | None = None,
     temperature: float = 0.0,
     max_tokens: int = 2048,
+    profile: LlamaCppProfile | None = None,
 ) -> Any:
     """
     langchainパッケージを使用して、LlamaCPPモデルを生成する関数
@@ -123,16 +429,22 @@ def _create_langchain_cpp_model(
     Args:
         model_path (str | None): モデルのパス
         temperature (float): 生成される文章の多様性を調整する温度パラメータ
+        profile (LlamaCppProfile | None): 実行時の設定
 
     Returns:
         LlamaCPP: 生成されたLlamaCPPモデル
     """
     from langchain.llms import LlamaCpp as LangchainCPP
 
-    # GPU を使用する場合の設定
-    n_gpu_layers = 40
-    n_batch = 16
-    n_ctx = 4096
+    if profile is None:
+        profile = LlamaCppProfile.auto()
+    llama_kwargs = profile.to_kwargs()
+    # LlamaCppのフィールドにない引数は、model_kwargsで渡す
+    model_kwargs = {
+        key: llama_kwargs.pop(key)
+        for key in ("type_k", "type_v")
+        if key in llama_kwargs
+    }
 
     try:
         # LlamaCPPモデルを生成する
@@ -140,10 +452,9 @@ def _create_langchain_cpp_model(
             model_path=model_path,
             temperature=temperature,
             max_tokens=max_tokens,
-            n_batch=n_batch,
-            n_ctx=n_ctx,
-            n_gpu_layers=n_gpu_layers,
+            model_kwargs=model_kwargs,
             verbose=True,
+            **llama_kwargs,
         )
         return model
     except FileNotFoundError as e:
@@ -153,3 +464,167 @@ def _create_langchain_cpp_model(
 
     except Exception as e:
         raise (f"Error occurred during LlamaCPP model creation: {e}")
+
+
+def benchmark_prefix_cache(
+    llama: Any, system_prompt: str, sections: List[str]
+) -> Dict[str, float]:
+    """システムプロンプトのKVキャッシュの有無で、セクションあたりのプロンプト評価時間を計測する関数
+
+    1トークンだけ生成させるので、計測時間はほぼプロンプトの評価時間になる。
+
+    Args:
+        llama (Any): llama_cpp.Llamaのインスタンス
+        system_prompt (str): システムプロンプト
+        sections (List[str]): セクションのテキストのリスト
+
+    Returns:
+        Dict[str, float]: キャッシュなし・ありの、セクションあたりの平均時間 (秒)
+    """
+    prompts = [to_llama2_prompt(system_prompt, text) for text in sections]
+
+    # キャッシュなし: 毎回プロンプト全体を評価する
+    latencies = []
+    for prompt in prompts:
+        llama.reset()
+        start = time.perf_counter()
+        llama(prompt, max_tokens=1)
+        latencies.append(time.perf_counter() - start)
+    without_cache = sum(latencies) / len(latencies)
+
+    # キャッシュあり: プレフィックスの状態を復元してから評価する
+    prefix = to_llama2_prompt(system_prompt, _PREFIX_SENTINEL)
+    cached = PrefixCachedLlama(llama, [prefix.split(_PREFIX_SENTINEL)[0]])
+    cached.warmup()
+    latencies = []
+    for prompt in prompts:
+        start = time.perf_counter()
+        cached(prompt, max_tokens=1)
+        latencies.append(time.perf_counter() - start)
+    with_cache = sum(latencies) / len(latencies)
+
+    return {
+        "without_cache": without_cache,
+        "with_cache": with_cache,
+        "speedup": without_cache / with_cache if with_cache else 0.0,
+    }
+
+
+def benchmark_profiles(
+    model_path: str,
+    profiles: List[LlamaCppProfile],
+    prompt: str,
+    n_predict: int = 64,
+) -> List[Dict[str, Any]]:
+    """設定ごとにプロンプト評価と生成の速度 (tokens/s) を計測する関数
+
+    Args:
+        model_path (str): モデルのパス
+        profiles (List[LlamaCppProfile]): 計測する設定のリスト
+        prompt (str): 計測に使うプロンプト
+        n_predict (int, optional): 生成するトークン数. Defaults to 64.
+
+    Returns:
+        List[Dict[str, Any]]: 設定ごとのプロンプト評価・生成の速度
+    """
+    from llama_cpp import Llama
+
+    results = []
+    for profile in profiles:
+        try:
+            llama = Llama(
+                model_path=model_path, verbose=False, **profile.to_kwargs()
+            )
+        except Exception as e:
+            print(f"Error in benchmark_profiles: {e}")
+            continue
+        n_prompt = len(llama.tokenize(prompt.encode("utf-8")))
+
+        # プロンプトの評価速度 (1トークンだけ生成する)
+        start = time.perf_counter()
+        llama(prompt, max_tokens=1)
+        prompt_time = time.perf_counter() - start
+
+        # 生成速度 (プロンプトは評価済みなので、ほぼ生成の時間になる)
+        start = time.perf_counter()
+        output = llama(prompt, max_tokens=n_predict, temperature=0.0)
+        eval_time = time.perf_counter() - start
+        n_generated = output["usage"]["completion_tokens"]
+
+        results.append(
+            {
+                **asdict(profile),
+                "prompt_tokens_per_sec": n_prompt / prompt_time,
+                "eval_tokens_per_sec": n_generated / eval_time,
+            }
+        )
+        del llama
+    return results
+
+
+def _parse_int_list(text: str) -> List[int]:
+    """カンマ区切りの整数のリストを読み込む関数"""
+    return [int(value) for value in text.split(",") if value]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="llama.cppの設定を計測する")
+    parser.add_argument("mode", choices=["sweep", "prefix"], help="計測する内容")
+    parser.add_argument(
+        "--model-path",
+        default="/home/paper_translator/data/models/ELYZA-japanese-Llama-2-7b-fast-instruct-q4_K_M.gguf",
+    )
+    parser.add_argument("--threads", type=_parse_int_list, default=None)
+    parser.add_argument("--batch", type=_parse_int_list, default=[64, 256, 512])
+    # 指定しない場合は、GPUにオフロードできるかどうかで決める
+    parser.add_argument("--n-gpu-layers", type=int, default=None)
+    parser.add_argument("--n-predict", type=int, default=64)
+    parser.add_argument("--mlock", action="store_true")
+    parser.add_argument(
+        "--kv-cache-type", choices=list(_KV_CACHE_TYPES), default="f16"
+    )
+    args = parser.parse_args()
+
+    from src.translator.llamaindex_summarizer import SUMMARY_SYSTEM_PROMPT
+
+    overrides = {"use_mlock": args.mlock, "kv_cache_type": args.kv_cache_type}
+    if args.n_gpu_layers is not None:
+        overrides["n_gpu_layers"] = args.n_gpu_layers
+    base = LlamaCppProfile.auto(**overrides)
+    if args.mode == "sweep":
+        # スレッド数は物理コア数の前後を試す
+        threads = args.threads or sorted(
+            {max(base.n_threads // 2, 1), base.n_threads, os.cpu_count() or 1}
+        )
+        profiles = [
+            base.replace(n_threads=n_threads, n_batch=n_batch)
+            for n_threads in threads
+            for n_batch in args.batch
+        ]
+        prompt = to_llama2_prompt(SUMMARY_SYSTEM_PROMPT, "Hello")
+        for result in benchmark_profiles(
+            args.model_path, profiles, prompt, n_predict=args.n_predict
+        ):
+            print(
+                f"threads={result['n_threads']:>3} batch={result['n_batch']:>4} "
+                f"prompt={result['prompt_tokens_per_sec']:8.1f} tok/s "
+                f"eval={result['eval_tokens_per_sec']:6.1f} tok/s"
+            )
+    else:
+        from llama_cpp import Llama
+
+        from src.XMLUtils import DocumentCreator
+
+        document_name = "On_Task-personalized_Multimodal_Few-shot_Learning_for_Visually-rich_Document_Entity_Retrieval"
+        xml_path = f"/home/paper_translator/data/documents/{document_name}/{document_name}.tei.xml"
+
+        creator = DocumentCreator()
+        creator.load_xml(xml_path, contain_abst=False)
+        sections = [doc.text[:1000] for doc in creator.create_docs()]
+
+        llama = Llama(
+            model_path=args.model_path, verbose=False, **base.to_kwargs()
+        )
+        print(benchmark_prefix_cache(llama, SUMMARY_SYSTEM_PROMPT, sections))
@@ -0,0 +1,352 @@
+import gc
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+import torch
+from huggingface_hub import try_to_load_from_cache
+from huggingface_hub.utils import HFValidationError
+
+# 重みファイルの拡張子. 同じ重みを複数の形式で持つ場合は、先に見つかった形式だけを数える
+_WEIGHT_EXTENSIONS = (".safetensors", ".bin", ".gguf", ".pt", ".pth")
+
+
+@dataclass(frozen=True)
+class ModelKey:
+    """モデルレジストリのキー
+
+    Args:
+        backend (str): バックエンド名 ("huggingface", "llama_index", "langchain", "embedding")
+        model_path (str): モデルのパスまたはリポジトリID
+        context_window (int): コンテキストウィンドウのサイズ
+        max_tokens (int): 生成される文章の最大トークン数
+        device (str): デバイス
+        temperature (float): 温度パラメータ
+    """
+
+    backend: str
+    model_path: str
+    context_window: int = 0
+    max_tokens: int = 0
+    device: str = "cpu"
+    temperature: float = 0.0
+
+
+@dataclass
+class _RegistryEntry:
+    model: Any
+    size_bytes: int
+    ref_count: int = 0
+
+
+def _get_weights_size(dir_path: str) -> int:
+    """ディレクトリ内の重みファイルの合計サイズを返す関数
+
+    Args:
+        dir_path (str): モデルのディレクトリ
+
+    Returns:
+        size_bytes (int): 重みファイルの合計サイズ. 重みファイルがない場合は全ファイルの合計
+    """
+    sizes: Dict[str, int] = {}
+    for root, _, files in os.walk(dir_path):
+        for file in files:
+            ext = os.path.splitext(file)[1]
+            # HuggingFaceのキャッシュはシンボリックリンクなので、リンク先のサイズを数える
+            size = os.path.getsize(os.path.join(root, file))
+            sizes[ext] = sizes.get(ext, 0) + size
+    for ext in _WEIGHT_EXTENSIONS:
+        if ext in sizes:
+            return sizes[ext]
+    return sum(sizes.values())
+
+
+def _estimate_model_size(model_path: str) -> int:
+    """モデルファイルのサイズからメモリ使用量を見積もる関数
+
+    model_pathがHuggingFace Hubのリポジトリの場合は、
+    ダウンロード済みのスナップショットの重みファイルから見積もる。
+
+    Args:
+        model_path (str): モデルのパスまたはリポジトリID
+
+    Returns:
+        size_bytes (int): 見積もったサイズ. 不明な場合は0
+    """
+    try:
+        if os.path.isfile(model_path):
+            return os.path.getsize(model_path)
+        if os.path.isdir(model_path):
+            return _get_weights_size(model_path)
+        # ダウンロード済みのスナップショットのディレクトリを、config.jsonの場所から探す
+        config_path = try_to_load_from_cache(model_path, "config.json")
+        if isinstance(config_path, str):
+            return _get_weights_size(os.path.dirname(config_path))
+    except HFValidationError:
+        # リポジトリIDではない、存在しないパス
+        return 0
+    except OSError as e:
+        print(f"Error in estimate_model_size: {e}")
+    return 0
+
+
+class ModelRegistry:
+    def __init__(self, memory_budget_bytes: int | None = None) -> None:
+        """
+        ModelRegistryクラスのコンストラクタ
+
+        ロード済みのモデルをプロセス内で保持し、同じキーの要求には
+        同じインスタンスを返す。参照されていないモデルは、メモリ予算を
+        超えたときに最も古く使われたものから破棄される。
+
+        Args:
+            memory_budget_bytes (int | None, optional): 保持するモデルの合計サイズの上限. Defaults to None.
+        """
+        self.memory_budget_bytes = memory_budget_bytes
+        self._entries: "OrderedDict[ModelKey, _RegistryEntry]" = OrderedDict()
+        self._lock = threading.RLock()
+        # キーごとのロード用ロック (同じモデルを同時に2回ロードしないため)
+        self._load_locks: Dict[ModelKey, threading.Lock] = {}
+
+    def acquire(
+        self,
+        key: ModelKey,
+        loader: Callable[[], Any],
+        size_bytes: int | None = None,
+    ) -> Any:
+        """モデルを取得し、参照カウントを1増やすメソッド
+
+        Args:
+            key (ModelKey): モデルのキー
+            loader (Callable[[], Any]): モデルが未ロードの場合に呼び出すロード関数
+            size_bytes (int | None, optional): モデルのサイズ. Noneの場合はファイルサイズから見積もる. Defaults to None.
+
+        Returns:
+            model (Any): ロード済みのモデル
+        """
+        if not isinstance(key, ModelKey):
+            raise TypeError("key must be ModelKey")
+        if not callable(loader):
+            raise TypeError("loader must be callable")
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    # ロード済みの場合は、LRUの末尾に移動して返す
+                    entry.ref_count += 1
+                    self._entries.move_to_end(key)
+                    return entry.model
+
+            # ロードする前に、新しいモデルの分を空けておく
+            # (ロード後に破棄すると、一時的に古いモデルと新しいモデルが両方載る)
+            if size_bytes is None:
+                size_bytes = _estimate_model_size(key.model_path)
+            with self._lock:
+                evicted = self._evict_if_needed(reserve_bytes=size_bytes)
+            self._free(evicted)
+
+            # 未ロードの場合は、ロックの外でモデルをロードする
+            print(f"Loading model: {key}")
+            model = loader()
+
+            with self._lock:
+                self._entries[key] = _RegistryEntry(
+                    model=model, size_bytes=size_bytes, ref_count=1
+                )
+                evicted = self._evict_if_needed()
+            self._free(evicted)
+            return model
+
+    def release(self, key: ModelKey) -> None:
+        """モデルの参照カウントを1減らすメソッド
+
+        Args:
+            key (ModelKey): モデルのキー
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry.ref_count = max(entry.ref_count - 1, 0)
+            evicted = self._evict_if_needed()
+        self._free(evicted)
+        return None
+
+    @contextmanager
+    def use(
+        self,
+        key: ModelKey,
+        loader: Callable[[], Any],
+        size_bytes: int | None = None,
+    ) -> Iterator[Any]:
+        """with文でモデルを取得・返却するメソッド
+
+        Args:
+            key (ModelKey): モデルのキー
+            loader (Callable[[], Any]): モデルのロード関数
+            size_bytes (int | None, optional): モデルのサイズ. Defaults to None.
+
+        Yields:
+            model (Any): ロード済みのモデル
+        """
+        model = self.acquire(key, loader, size_bytes=size_bytes)
+        try:
+            yield model
+        finally:
+            self.release(key)
+
+    def warmup(self, specs: List[Tuple[ModelKey, Callable[[], Any]]]) -> None:
+        """起動時にモデルを事前ロードするメソッド
+
+        Args:
+            specs (List[Tuple[ModelKey, Callable[[], Any]]]): キーとロード関数の組のリスト
+        """
+        for key, loader in specs:
+            try:
+                self.acquire(key, loader)
+            except Exception as e:
+                print(f"Error in ModelRegistry.warmup: {e}")
+            else:
+                self.release(key)
+
+    def evict(self, key: ModelKey) -> bool:
+        """参照されていないモデルを破棄するメソッド
+
+        Args:
+            key (ModelKey): モデルのキー
+
+        Returns:
+            bool: 破棄できたかどうか
+        """
+        with self._lock:
+            entry = self._pop_idle(key)
+        if entry is None:
+            return False
+        self._free([(key, entry)])
+        return True
+
+    def _pop_idle(self, key: ModelKey) -> _RegistryEntry | None:
+        """参照されていないモデルをレジストリから外すメソッド
+
+        self._lockを取得した状態で呼び出す。ロード用のロックは、
+        同じキーをロード中の他のスレッドが使っている可能性があるため残す。
+
+        Args:
+            key (ModelKey): モデルのキー
+
+        Returns:
+            _RegistryEntry | None: 外したエントリ. 参照されている場合はNone
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry.ref_count > 0:
+            return None
+        del self._entries[key]
+        return entry
+
+    @staticmethod
+    def _free(evicted: List[Tuple[ModelKey, _RegistryEntry]]) -> None:
+        """レジストリから外したモデルのメモリを解放するメソッド
+
+        gc.collectは時間がかかるため、self._lockの外で呼び出す。
+
+        Args:
+            evicted (List[Tuple[ModelKey, _RegistryEntry]]): 外したキーとエントリのリスト
+        """
+        if not evicted:
+            return None
+        keys = [key for key, _ in evicted]
+        # 参照を外してから、GPUのキャッシュも解放する
+        evicted.clear()
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        for key in keys:
+            print(f"Evicted model: {key}")
+        return None
+
+    def clear(self) -> None:
+        """参照されていない全てのモデルを破棄するメソッド"""
+        with self._lock:
+            keys = list(self._entries.keys())
+        for key in keys:
+            self.evict(key)
+
+    def total_size(self) -> int:
+        """保持しているモデルの合計サイズを返すメソッド
+
+        Returns:
+            int: 合計サイズ
+        """
+        with self._lock:
+            return sum(entry.size_bytes for entry in self._entries.values())
+
+    def stats(self) -> Dict[str, Any]:
+        """レジストリの状態を返すメソッド
+
+        Returns:
+            Dict[str, Any]: 保持しているモデル数、合計サイズ、参照カウント
+        """
+        with self._lock:
+            return {
+                "n_models": len(self._entries),
+                "total_size": self.total_size(),
+                "ref_counts": {
+                    key: entry.ref_count for key, entry in self._entries.items()
+                },
+            }
+
+    def _evict_if_needed(
+        self, reserve_bytes: int = 0
+    ) -> List[Tuple[ModelKey, _RegistryEntry]]:
+        """メモリ予算を超えている場合に、古いモデルをレジストリから外すメソッド
+
+        self._lockを取得した状態で呼び出し、返したエントリは
+        ロックの外で_freeに渡してメモリを解放する。
+
+        Args:
+            reserve_bytes (int, optional): これからロードするモデルのために空けておくサイズ. Defaults to 0.
+
+        Returns:
+            List[Tuple[ModelKey, _RegistryEntry]]: 外したキーとエントリのリスト
+        """
+        evicted: List[Tuple[ModelKey, _RegistryEntry]] = []
+        if self.memory_budget_bytes is None:
+            return evicted
+        budget = self.memory_budget_bytes - reserve_bytes
+        # OrderedDictの先頭が最も古く使われたモデル
+        for key in list(self._entries.keys()):
+            if self.total_size() <= budget:
+                break
+            entry = self._pop_idle(key)
+            if entry is not None:
+                evicted.append((key, entry))
+        return evicted
+
+
+def _get_memory_budget_from_env() -> int | None:
+    """環境変数MODEL_MEMORY_BUDGET_GBからメモリ予算を取得する関数
+
+    Returns:
+        int | None: メモリ予算 (バイト). 未設定の場合はNone
+    """
+    budget_gb = os.getenv("MODEL_MEMORY_BUDGET_GB")
+    if not budget_gb:
+        return None
+    try:
+        return int(float(budget_gb) * 1024**3)
+    except ValueError as e:
+        print(f"Error in get_memory_budget_from_env: {e}")
+        return None
+
+
+# プロセス全体で共有するモデルレジストリ
+model_registry = ModelRegistry(
+    memory_budget_bytes=_get_memory_budget_from_env()
+)
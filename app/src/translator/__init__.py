@@ -1,10 +1,14 @@
+from src.translator.batch_summarizer import BatchSummarizer
 from src.translator.langchain_summarizer import langchain_summarizer
 from src.translator.llamaindex_summarizer import LlamaIndexSummarizer
+from src.translator.mmap_vector_store import MmapVectorStore
 from src.translator.pipeline import Pipeline
 
 __all__ = [
     "create_llama_cpp_model",
     "Pipeline",
+    "MmapVectorStore",
+    "BatchSummarizer",
     "langchain_summarizer",
     "LlamaIndexSummarizer",
 ]
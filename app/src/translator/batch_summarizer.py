@@ -0,0 +1,693 @@
+import itertools
+import re
+from typing import Any, Dict, Iterator, List, Tuple
+
+from llama_index import Document
+
+from src.model.llama_cpp import to_llama2_prompt
+from src.translator.llamaindex_summarizer import SUMMARY_SYSTEM_PROMPT
+
+# 1回のプロンプトにまとめるセクション数の上限
+MAX_SECTIONS_PER_BATCH = 8
+# セクションごとに出力用に確保するトークン数
+OUTPUT_TOKENS_PER_SECTION = 384
+
+BATCH_SUMMARY_PROMPT = (
+    "以下の複数のセクションをそれぞれ要約してください。\n"
+    "各要約の前には、必ず対応する見出し行 ([SECTION 番号]) をそのまま書いてください。\n"
+    "見出し行以外の説明は書かないでください。\n"
+    "---------------------\n"
+    "{sections}\n"
+    "---------------------\n"
+    "Answer:\n"
+)
+SECTION_HEADER = "[SECTION {no}]"
+_SECTION_HEADER_PATTERN = re.compile(r"^\s*\[SECTION\s+(\d+)\]\s*$", re.M)
+
+
+class BatchSummaryIndex:
+    def __init__(self, summaries: Dict[str, str]) -> None:
+        """
+        BatchSummaryIndexクラスのコンストラクタ
+
+        DocumentSummaryIndexと同じget_document_summaryで要約を取得できるようにする。
+
+        Args:
+            summaries (Dict[str, str]): doc_idと要約の辞書
+        """
+        self.summaries = summaries
+
+    def get_document_summary(self, doc_id: str) -> str:
+        """doc_idの要約を取得するメソッド
+
+        Args:
+            doc_id (str): ドキュメントのID
+
+        Returns:
+            str: 要約
+        """
+        if doc_id not in self.summaries:
+            raise ValueError(f"doc_id {doc_id} not in index")
+        return self.summaries[doc_id]
+
+
+def _format_section(no: int, document: Document) -> str:
+    """セクションを見出し行付きのテキストにする関数
+
+    Args:
+        no (int): プロンプト内のセクション番号
+        document (Document): セクションのDocument
+
+    Returns:
+        str: 見出し行付きのテキスト
+    """
+    title = document.metadata.get("Section Title", "")
+    header = SECTION_HEADER.format(no=no)
+    return f"{header}\n{title}\n{document.text}"
+
+
+def split_batch_output(output: str, n_sections: int) -> List[str | None]:
+    """まとめて生成した出力をセクションごとに分割する関数
+
+    Args:
+        output (str): LLMの出力
+        n_sections (int): プロンプトに含めたセクション数
+
+    Returns:
+        List[str | None]: セクションごとの要約. 見つからなかったセクションはNone
+    """
+    summaries: List[str | None] = [None] * n_sections
+    matches = list(_SECTION_HEADER_PATTERN.finditer(output))
+    for i, match in enumerate(matches):
+        no = int(match.group(1))
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(output)
+        text = output[match.end() : end].strip()
+        if 1 <= no <= n_sections and text and summaries[no - 1] is None:
+            summaries[no - 1] = text
+    return summaries
+
+
+def _is_header_prefix(text: str) -> bool:
+    """生成途中の行が、見出し行の先頭部分かどうかを判定する関数
+
+    Args:
+        text (str): 改行までの行
+
+    Returns:
+        bool: 見出し行になる可能性がある場合はTrue
+    """
+    text = text.lstrip()
+    prefix = "[SECTION "
+    if len(text) <= len(prefix):
+        return prefix.startswith(text)
+    return re.fullmatch(r"\[SECTION\s+\d*\]?\s*", text) is not None
+
+
+class _SectionStreamSplitter:
+    def __init__(self, n_sections: int) -> None:
+        """
+        _SectionStreamSplitterクラスのコンストラクタ
+
+        まとめて生成した出力を、トークンが届くたびに見出し行でセクションに振り分ける。
+        各セクションのテキストは、split_batch_outputと同じく前後の空白を除いたものになる。
+        見出し行になる可能性がある行だけは、改行まで待ってから判定する。
+
+        Args:
+            n_sections (int): プロンプトに含めたセクション数
+        """
+        self.n_sections = n_sections
+        self.texts = [""] * n_sections
+        self.output = ""
+        # セクションが1つの場合は、見出し行がなくても出力全体をそのセクションとする
+        self._no: int | None = 0 if n_sections == 1 else None
+        self._line = ""
+        self._at_line_start = True
+        self._trailing_space = ""
+
+    def feed(self, token: str) -> List[Tuple[int, str]]:
+        """生成されたトークンを振り分けるメソッド
+
+        Args:
+            token (str): 生成されたトークン
+
+        Returns:
+            List[Tuple[int, str]]: (セクションの番号 (0始まり), テキスト) のリスト
+        """
+        self.output += token
+        events: List[Tuple[int, str]] = []
+        self._line += token
+        while "\n" in self._line:
+            line, self._line = self._line.split("\n", 1)
+            if not (self._at_line_start and self._switch(line)):
+                events += self._emit(line + "\n")
+            self._at_line_start = True
+        if self._line and not (
+            self._at_line_start and _is_header_prefix(self._line)
+        ):
+            events += self._emit(self._line)
+            self._line = ""
+            self._at_line_start = False
+        return events
+
+    def close(self) -> List[Tuple[int, str]]:
+        """生成が終わったときに、残りのテキストを振り分けるメソッド
+
+        Returns:
+            List[Tuple[int, str]]: (セクションの番号 (0始まり), テキスト) のリスト
+        """
+        line, self._line = self._line, ""
+        if self._at_line_start and self._switch(line):
+            return []
+        return self._emit(line)
+
+    def _switch(self, line: str) -> bool:
+        """見出し行の場合に、振り分け先のセクションを切り替えるメソッド
+
+        Args:
+            line (str): 改行を含まない1行
+
+        Returns:
+            bool: 見出し行だった場合はTrue
+        """
+        match = _SECTION_HEADER_PATTERN.fullmatch(line)
+        if match is None:
+            return False
+        no = int(match.group(1)) - 1
+        self._trailing_space = ""
+        # 範囲外の番号や、既にテキストがあるセクションの見出しは無視する
+        if 0 <= no < self.n_sections and not self.texts[no]:
+            self._no = no
+        else:
+            self._no = None
+        return True
+
+    def _emit(self, text: str) -> List[Tuple[int, str]]:
+        """テキストを現在のセクションに追加するメソッド
+
+        Args:
+            text (str): テキスト
+
+        Returns:
+            List[Tuple[int, str]]: (セクションの番号 (0始まり), 前後の空白を除いたテキスト) のリスト
+        """
+        if self._no is None:
+            # 最初の見出し行より前の説明などは捨てる
+            return []
+        if not self.texts[self._no]:
+            text = text.lstrip()
+        # 末尾の空白は、続くテキストが届くまで保留する
+        text = self._trailing_space + text
+        stripped = text.rstrip()
+        self._trailing_space = text[len(stripped) :]
+        if not stripped:
+            return []
+        self.texts[self._no] += stripped
+        return [(self._no, stripped)]
+
+
+class BatchSummarizer:
+    def __init__(
+        self,
+        llm_model: Any,
+        context_window: int = 4096,
+        max_tokens: int = 2048,
+        max_sections_per_batch: int = MAX_SECTIONS_PER_BATCH,
+        output_tokens_per_section: int = OUTPUT_TOKENS_PER_SECTION,
+        system_prompt: str = SUMMARY_SYSTEM_PROMPT,
+        checkpoint: Any | None = None,
+    ) -> None:
+        """
+        BatchSummarizerクラスのコンストラクタ
+
+        短いセクションをcontext_windowに収まるだけ1つのプロンプトにまとめて要約し、
+        出力を見出し行でセクションごとに分割する。長いシステムプロンプトを
+        セクションごとに処理し直さずに済む。HuggingFaceのモデルの場合は、
+        セクションごとのプロンプトをパディングしてまとめて生成する。
+
+        Args:
+            llm_model (Any): LLMモデル
+            context_window (int, optional): コンテキストウィンドウのサイズ. Defaults to 4096.
+            max_tokens (int, optional): 生成される文章の最大トークン数. Defaults to 2048.
+            max_sections_per_batch (int, optional): 1回にまとめるセクション数の上限. Defaults to MAX_SECTIONS_PER_BATCH.
+            output_tokens_per_section (int, optional): セクションごとに出力用に確保するトークン数. Defaults to OUTPUT_TOKENS_PER_SECTION.
+            system_prompt (str, optional): システムプロンプト. Defaults to SUMMARY_SYSTEM_PROMPT.
+            checkpoint (Any | None, optional): セクションの要約を保存するSectionCheckpoint. Defaults to None.
+        """
+        self.llm_model = llm_model
+        self.context_window = context_window
+        self.max_tokens = max_tokens
+        self.max_sections_per_batch = max(max_sections_per_batch, 1)
+        self.output_tokens_per_section = output_tokens_per_section
+        self.system_prompt = system_prompt
+        self.checkpoint = checkpoint
+        self.n_calls = 0
+        # プロンプトの固定部分のトークン数
+        self._overhead_tokens = self.count_tokens(
+            to_llama2_prompt(
+                system_prompt, BATCH_SUMMARY_PROMPT.format(sections="")
+            )
+        )
+
+    def count_tokens(self, text: str) -> int:
+        """モデルのトークナイザーでトークン数を数えるメソッド
+
+        トークナイザーが使えない場合は、文字数から概算する。
+
+        Args:
+            text (str): テキスト
+
+        Returns:
+            int: トークン数
+        """
+        tokenizer = getattr(self.llm_model, "_tokenizer", None)
+        if tokenizer is not None:
+            return len(tokenizer.encode(text))
+        llama = getattr(self.llm_model, "_model", None) or getattr(
+            self.llm_model, "client", None
+        )
+        if hasattr(llama, "tokenize"):
+            return len(llama.tokenize(text.encode("utf-8")))
+        # 日本語は1文字が1トークン前後になるため、文字数をそのまま使う
+        return len(text)
+
+    def _is_huggingface(self) -> bool:
+        """HuggingFaceのモデルかどうかを判定するメソッド"""
+        return hasattr(self.llm_model, "_tokenizer") and hasattr(
+            getattr(self.llm_model, "_model", None), "generate"
+        )
+
+    def pack_batches(
+        self, documents: List[Document]
+    ) -> List[List[Tuple[int, Document]]]:
+        """セクションをcontext_windowに収まるようにまとめるメソッド
+
+        Args:
+            documents (List[Document]): セクションのDocumentリスト
+
+        Returns:
+            List[List[Tuple[int, Document]]]: (インデックス, Document) のリストのリスト
+        """
+        budget = self.context_window - self._overhead_tokens
+        # 出力の合計がmax_tokensを超えないように、まとめる数を制限する
+        max_sections = min(
+            self.max_sections_per_batch,
+            max(self.max_tokens // self.output_tokens_per_section, 1),
+        )
+        batches: List[List[Tuple[int, Document]]] = []
+        batch: List[Tuple[int, Document]] = []
+        used = 0
+        for i, document in enumerate(documents):
+            for part in self._split_long_document(document, budget):
+                n_tokens = (
+                    self.count_tokens(_format_section(len(batch) + 1, part))
+                    + self.output_tokens_per_section
+                )
+                if batch and (
+                    used + n_tokens > budget or len(batch) >= max_sections
+                ):
+                    batches.append(batch)
+                    batch, used = [], 0
+                batch.append((i, part))
+                used += n_tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _split_long_document(
+        self, document: Document, budget: int
+    ) -> List[Document]:
+        """1つで予算を超えるセクションを、予算に収まる長さに分割するメソッド
+
+        Args:
+            document (Document): セクションのDocument
+            budget (int): 1回のプロンプトに使えるトークン数
+
+        Returns:
+            List[Document]: 分割したDocumentのリスト
+        """
+        budget -= self.output_tokens_per_section
+        n_tokens = self.count_tokens(_format_section(1, document))
+        if n_tokens <= budget or not document.text:
+            return [document]
+        # トークン数と文字数の比から、1つあたりの文字数を決める
+        n_chars = max(int(len(document.text) * budget / n_tokens), 1)
+        return [
+            Document(
+                text=document.text[start : start + n_chars],
+                metadata=document.metadata,
+            )
+            for start in range(0, len(document.text), n_chars)
+        ]
+
+    def _complete(self, prompt: str) -> str:
+        """LLMで文章を生成するメソッド
+
+        Args:
+            prompt (str): プロンプト
+
+        Returns:
+            str: 生成した文章
+        """
+        self.n_calls += 1
+        if hasattr(self.llm_model, "complete"):
+            # llama_indexのLLM
+            return self.llm_model.complete(prompt).text
+        # langchainのLLM
+        return self.llm_model(prompt)
+
+    def _stream_complete(self, prompt: str) -> Iterator[str]:
+        """LLMで文章を生成し、生成されたトークンを順に返すジェネレータ
+
+        ストリーミングに対応していないLLMの場合は、生成した文章をまとめて返す。
+
+        Args:
+            prompt (str): プロンプト
+
+        Yields:
+            str: 生成されたトークン
+        """
+        if not hasattr(self.llm_model, "stream_complete"):
+            yield self._complete(prompt)
+            return None
+        self.n_calls += 1
+        # llama_indexのLLM
+        for response in self.llm_model.stream_complete(prompt):
+            if response.delta:
+                yield response.delta
+        return None
+
+    def _generate_huggingface(self, prompts: List[str]) -> List[str]:
+        """HuggingFaceのモデルで、パディングしたプロンプトをまとめて生成するメソッド
+
+        Args:
+            prompts (List[str]): プロンプトのリスト
+
+        Returns:
+            List[str]: 生成した文章のリスト
+        """
+        import torch
+
+        model = self.llm_model._model
+        tokenizer = self.llm_model._tokenizer
+        # 生成はプロンプトの末尾から続けるため、左側をパディングする
+        tokenizer.padding_side = "left"
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(
+            model.device
+        )
+        self.n_calls += 1
+        with torch.no_grad():
+            outputs = model.generate(
+                **inputs,
+                max_new_tokens=self.output_tokens_per_section,
+                do_sample=False,
+                pad_token_id=tokenizer.pad_token_id,
+            )
+        n_input = inputs["input_ids"].shape[1]
+        return tokenizer.batch_decode(
+            outputs[:, n_input:], skip_special_tokens=True
+        )
+
+    def _summarize_batch(self, batch: List[Tuple[int, Document]]) -> List[str]:
+        """まとめたセクションを1回のプロンプトで要約するメソッド
+
+        Args:
+            batch (List[Tuple[int, Document]]): (インデックス, Document) のリスト
+
+        Returns:
+            List[str]: セクションごとの要約
+        """
+        summaries = [""] * len(batch)
+        for no, text in self._stream_batch(batch):
+            summaries[no] += text
+        return summaries
+
+    def _stream_batch(
+        self, batch: List[Tuple[int, Document]]
+    ) -> Iterator[Tuple[int, str]]:
+        """まとめたセクションを1回のプロンプトで要約し、生成されたテキストを順に返すジェネレータ
+
+        Args:
+            batch (List[Tuple[int, Document]]): (インデックス, Document) のリスト
+
+        Yields:
+            Tuple[int, str]: (バッチ内のセクションの番号 (0始まり), テキスト)
+        """
+        sections = "\n\n".join(
+            _format_section(no, document)
+            for no, (_, document) in enumerate(batch, start=1)
+        )
+        prompt = to_llama2_prompt(
+            self.system_prompt, BATCH_SUMMARY_PROMPT.format(sections=sections)
+        )
+        splitter = _SectionStreamSplitter(len(batch))
+        for token in self._stream_complete(prompt):
+            yield from splitter.feed(token)
+        yield from splitter.close()
+
+        # 見出し行が崩れたセクションは、1つずつ要約し直す
+        for no, text in enumerate(splitter.texts):
+            if not text and len(batch) > 1:
+                for _, retry_text in self._stream_batch([batch[no]]):
+                    yield no, retry_text
+
+    def summarize(self, documents: List[Document]) -> List[str]:
+        """セクションごとの要約を作成するメソッド
+
+        checkpointを指定した場合は、保存済みのセクションを飛ばし、
+        要約が完成したセクションから順に保存する。
+
+        Args:
+            documents (List[Document]): セクションのDocumentリスト
+
+        Returns:
+            List[str]: documentsと同じ順番の要約
+        """
+        summaries = [""] * len(documents)
+        for i, summary in self.iter_summaries(documents):
+            summaries[i] = summary
+        return summaries
+
+    def iter_summaries(
+        self, documents: List[Document]
+    ) -> Iterator[Tuple[int, str]]:
+        """要約が完成したセクションを、documentsの順番に返すジェネレータ
+
+        バッチの要約が終わるたびに、それまでに完成したセクションを返すため、
+        全てのセクションの要約を待たずに書き込みを始められる。
+
+        Args:
+            documents (List[Document]): セクションのDocumentリスト
+
+        Yields:
+            Tuple[int, str]: (セクションのインデックス, 要約)
+        """
+        summaries, is_done, pending = self._load_checkpoint(documents)
+        next_i = 0
+        completed = self._summarize_pending(documents, pending, summaries)
+        # 保存済みのセクションは、要約を待たずに先に返す
+        for i in itertools.chain([None], completed):
+            if i is not None:
+                is_done[i] = True
+            # 前のセクションが完成するまでは返さず、順番を保つ
+            while next_i < len(documents) and is_done[next_i]:
+                yield next_i, summaries[next_i]
+                next_i += 1
+
+    def stream_summaries(
+        self, documents: List[Document]
+    ) -> Iterator[Tuple[int, str]]:
+        """要約を生成されたテキストごとに、documentsの順番に返すジェネレータ
+
+        複数のセクションをまとめて生成した出力を、見出し行でセクションに振り分けながら返す。
+        前のセクションが完成していない間に届いたテキストは、順番が来るまで保留する。
+        HuggingFaceのモデルの場合は、バッチが終わるたびにセクションの要約をまとめて返す。
+
+        Args:
+            documents (List[Document]): セクションのDocumentリスト
+
+        Yields:
+            Tuple[int, str]: (セクションのインデックス, テキスト)
+        """
+        if self._is_huggingface():
+            yield from self.iter_summaries(documents)
+            return None
+
+        summaries, is_done, pending = self._load_checkpoint(documents)
+        # セクションごとの、返したテキストの長さ
+        n_yielded = [0] * len(documents)
+        next_i = 0
+
+        def _flush() -> List[Tuple[int, str]]:
+            """順番が来たセクションの、まだ返していないテキストを返す"""
+            nonlocal next_i
+            events = []
+            while next_i < len(documents):
+                rest = summaries[next_i][n_yielded[next_i] :]
+                if rest:
+                    events.append((next_i, rest))
+                    n_yielded[next_i] += len(rest)
+                if not is_done[next_i]:
+                    break
+                next_i += 1
+            return events
+
+        def _complete(j: int) -> List[Tuple[int, str]]:
+            """セクションを完成として保存し、順番が来たテキストを返す"""
+            i = pending[j]
+            if not is_done[i]:
+                is_done[i] = True
+                self._save_checkpoint(i, documents[i], summaries[i])
+            return _flush()
+
+        # 保存済みのセクションは、要約を待たずに先に返す
+        yield from _flush()
+
+        batches = self.pack_batches([documents[i] for i in pending])
+        # 分割したセクションは、最後の断片を要約したときに完成とする
+        last_batch = {}
+        for n, batch in enumerate(batches):
+            for j, _ in batch:
+                last_batch[j] = n
+        for n, batch in enumerate(batches):
+            started = set()
+            current = None
+            for no, text in self._stream_batch(batch):
+                j = batch[no][0]
+                if current is not None and no != current:
+                    # 次のセクションに移ったら、前のセクションは生成し終わっている
+                    prev_j = batch[current][0]
+                    if (
+                        last_batch[prev_j] == n
+                        and prev_j != j
+                        and all(
+                            k in started
+                            for k, (j2, _) in enumerate(batch)
+                            if j2 == prev_j
+                        )
+                    ):
+                        yield from _complete(prev_j)
+                current = no
+                if no not in started:
+                    started.add(no)
+                    # 分割したセクションは、要約をつなげる
+                    if summaries[pending[j]]:
+                        text = "\n" + text
+                summaries[pending[j]] += text
+                yield from _flush()
+            for j in sorted({j for j, _ in batch}):
+                if last_batch[j] == n:
+                    yield from _complete(j)
+        return None
+
+    def _load_checkpoint(
+        self, documents: List[Document]
+    ) -> Tuple[List[str], List[bool], List[int]]:
+        """保存済みのセクションの要約を読み込むメソッド
+
+        Args:
+            documents (List[Document]): セクションのDocumentリスト
+
+        Returns:
+            Tuple[List[str], List[bool], List[int]]: 要約のリスト、完成したかどうかのリスト、
+                要約するセクションのインデックスのリスト
+        """
+        summaries = [""] * len(documents)
+        is_done = [False] * len(documents)
+        pending = []
+        for i, document in enumerate(documents):
+            summary = None
+            if self.checkpoint is not None:
+                summary = self.checkpoint.get(i, document)
+            if summary is None:
+                pending.append(i)
+            else:
+                summaries[i] = summary
+                is_done[i] = True
+        return summaries, is_done, pending
+
+    def _summarize_pending(
+        self,
+        documents: List[Document],
+        pending: List[int],
+        summaries: List[str],
+    ) -> Iterator[int]:
+        """保存されていないセクションを要約し、完成したセクションのインデックスを返すジェネレータ
+
+        Args:
+            documents (List[Document]): セクションのDocumentリスト
+            pending (List[int]): 要約するセクションのインデックス
+            summaries (List[str]): 要約を書き込むリスト
+
+        Yields:
+            int: 要約が完成したセクションのインデックス
+        """
+        if self._is_huggingface():
+            for start in range(0, len(pending), self.max_sections_per_batch):
+                batch = pending[start : start + self.max_sections_per_batch]
+                prompts = [
+                    to_llama2_prompt(
+                        self.system_prompt,
+                        BATCH_SUMMARY_PROMPT.format(
+                            sections=_format_section(1, documents[i])
+                        ),
+                    )
+                    for i in batch
+                ]
+                outputs = self._generate_huggingface(prompts)
+                for i, output in zip(batch, outputs):
+                    summary = split_batch_output(output, 1)[0]
+                    summaries[i] = summary or output.strip()
+                    self._save_checkpoint(i, documents[i], summaries[i])
+                    yield i
+            return None
+
+        batches = self.pack_batches([documents[i] for i in pending])
+        # 分割したセクションは、最後の断片を要約したときに完成とする
+        last_batch = {}
+        for n, batch in enumerate(batches):
+            for j, _ in batch:
+                last_batch[j] = n
+        for n, batch in enumerate(batches):
+            for (j, _), summary in zip(batch, self._summarize_batch(batch)):
+                i = pending[j]
+                # 分割したセクションは、要約をつなげる
+                summaries[i] = "\n".join(filter(None, [summaries[i], summary]))
+            for j in sorted({j for j, _ in batch}):
+                if last_batch[j] == n:
+                    i = pending[j]
+                    self._save_checkpoint(i, documents[i], summaries[i])
+                    yield i
+        return None
+
+    def _save_checkpoint(
+        self, i: int, document: Document, summary: str
+    ) -> None:
+        """要約が完成したセクションを保存するメソッド
+
+        Args:
+            i (int): セクションのインデックス
+            document (Document): セクションのDocument
+            summary (str): 要約
+        """
+        if self.checkpoint is not None:
+            self.checkpoint.put(i, document, summary)
+        return None
+
+    def from_documents(self, documents: List[Document]) -> BatchSummaryIndex:
+        """ドキュメントのリストから要約のインデックスを作成するメソッド
+
+        Args:
+            documents (List[Document]): セクションのDocumentリスト
+
+        Returns:
+            BatchSummaryIndex: doc_idで要約を取得できるインデックス
+        """
+        summaries = self.summarize(documents)
+        return BatchSummaryIndex(
+            {
+                document.doc_id: summary
+                for document, summary in zip(documents, summaries)
+            }
+        )
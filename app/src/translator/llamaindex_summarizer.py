@@ -1,4 +1,8 @@
-from typing import Any, List, Literal
+import hashlib
+import json
+import os
+import tempfile
+from typing import Any, Dict, Iterator, List, Literal, Tuple
 
 import nest_asyncio
 from llama_index import (
@@ -6,6 +10,7 @@ from llama_index import (
     ServiceContext,
     StorageContext,
     get_response_synthesizer,
+    load_index_from_storage,
 )
 from llama_index.indices.document_summary import DocumentSummaryIndex
 from llama_index.llms.base import ChatMessage, MessageRole
@@ -15,6 +20,32 @@ from llama_index.storage.index_store import SimpleIndexStore
 from llama_index.vector_stores import SimpleVectorStore
 
 
+# 要約のシステムプロンプト
+SUMMARY_SYSTEM_PROMPT = (
+    "#依頼\n"
+    "あなたは高度な理解能力を持ち、複雑なテキストも簡潔に要約することができるAIです。\n"
+    "事前知識ではなく、提供されたコンテキストに基づいて精確な回答を行ってください。\n"
+    "#従うべきルール\n"
+    "1. 略語や初出の用語には解説を加え、AI分野やコンピュータの初心者も理解できるように工夫してください。\n"
+    "2. 回答内で指定されたコンテキストを直接参照しないでください。\n"
+    "3. 「コンテキストに基づいて、...」や「コンテキスト情報は...」、またはそれに類するような記述は避けてください。\n"
+    "4. 出力は日本語で行ってください。"
+    "#手順\n"
+    "1. 与えられたコンテキストに含まれる主要なポイントやコンセプトを細かく分解してください。\n"
+    "2. それぞれのポイントやコンセプトに対して詳細な説明を加えてください。\n"
+    "3. まずは指示に従って、文書の初版を作成してください。\n"
+    "4. 作成した初版をルールに従っているか自己分析してください。\n"
+    "5. 自己分析の結果を踏まえて、文書を改善してください。\n"
+)
+
+
+# 要約クエリ
+SUMMARY_QUERY = "提供されたテキストの内容を要約してください。"
+
+# 保存したインデックスの作成条件を記録するファイル名
+INDEX_FINGERPRINT_FILE = "summary_index_fingerprint.json"
+
+
 def _select_node_parser(node_parser: Literal["simple", "sentence"]) -> Any:
     """
     ノードパーサーを選択する関数
@@ -59,6 +90,24 @@ def _set_sentence_window_node_parser(parser: Any) -> Any:
     return parser
 
 
+def _get_model_id(llm_model: Any, embed_model: Any) -> str:
+    """LLMモデルとEmbeddingモデルの名前からモデルのIDを作成する関数
+
+    Args:
+        llm_model (Any): LLMモデル
+        embed_model (Any): Embeddingモデル
+
+    Returns:
+        str: モデルのID
+    """
+    metadata = getattr(llm_model, "metadata", None)
+    llm_name = getattr(metadata, "model_name", None) or type(llm_model).__name__
+    embed_name = (
+        getattr(embed_model, "model_name", None) or type(embed_model).__name__
+    )
+    return f"{llm_name}:{embed_name}"
+
+
 class LlamaIndexSummarizer:
     def __init__(
         self,
@@ -67,18 +116,29 @@ class LlamaIndexSummarizer:
         persist_dir: str | None = None,
         node_parser: Literal["simple", "sentence"] | None = None,
         is_debug: bool = False,
+        model_id: str | None = None,
     ) -> None:
         """
         LlamaIndexSummarizerクラスのコンストラクタ
 
+        persist_dirを指定した場合は、作成したDocumentSummaryIndexを保存し、
+        次回からは保存したインデックスを読み込む。モデル・プロンプトが
+        保存時と異なる場合は作り直し、本文が変わったセクションだけを要約し直す。
+
         Args:
             llm_model: LLMモデル
             embed_model: Embeddingモデル
             persist_dir: Contextの保存先ディレクトリ
             node_parser (Literal["simple", "sentence"], optional): ノードパーサーの種類. Defaults to None.
             is_debug (bool, optional): デバッグモードかどうか. Defaults to False.
+            model_id (str | None, optional): インデックスの作成条件に含めるモデルのID. Defaults to None.
         """
         self.is_debug = is_debug
+        self.llm_model = llm_model
+        self.persist_dir = persist_dir
+        self.model_id = model_id or _get_model_id(llm_model, embed_model)
+        self.node_parser_type = node_parser
+        self._doc_summary_index = None
         # デバッグの設定
         if is_debug:
             from llama_index.callbacks import CallbackManager, LlamaDebugHandler
@@ -103,9 +163,7 @@ class LlamaIndexSummarizer:
             callback_manager=self.callback_manager,
             node_parser=self.node_parser,
         )
-        self._storage_context = self._SimpleStorageContext(
-            persist_dir=persist_dir
-        )
+        self._storage_context = self._SimpleStorageContext()
 
         # 非同期処理の有効化
         nest_asyncio.apply()
@@ -119,18 +177,19 @@ class LlamaIndexSummarizer:
         if hasattr(self, "_service_context"):
             del self._service_context
 
-    def _SimpleStorageContext(self, persist_dir: str | None) -> None:
+    def _SimpleStorageContext(self) -> StorageContext:
         """
-        StorageContextを作成する関数
+        空のStorageContextを作成する関数
 
-        Args:
-            persist_dir (str | None): Contextの保存先ディレクトリ
+        保存済みのインデックスは、_load_doc_summary_indexで読み込む。
+
+        Returns:
+            StorageContext: StorageContext
         """
-        self._storage_context = StorageContext.from_defaults(
+        return StorageContext.from_defaults(
             docstore=SimpleDocumentStore(),
             vector_store=SimpleVectorStore(),
             index_store=SimpleIndexStore(),
-            persist_dir=persist_dir,
         )
 
     def _SimpleServiceContext(
@@ -139,7 +198,7 @@ class LlamaIndexSummarizer:
         embed_model: Any,
         callback_manager: Any,
         node_parser: Any,
-    ) -> None:
+    ) -> ServiceContext:
         """
         ServiceContextを作成する関数
 
@@ -148,8 +207,11 @@ class LlamaIndexSummarizer:
             embed_model (Any): Embeddingモデル
             callback_manager (Any): CallbackManager
             node_parser (Any): ノードパーサー
+
+        Returns:
+            ServiceContext: ServiceContext
         """
-        self._service_context = ServiceContext.from_defaults(
+        return ServiceContext.from_defaults(
             llm=llm_model,
             embed_model=embed_model,
             callback_manager=callback_manager,
@@ -167,9 +229,6 @@ class LlamaIndexSummarizer:
         Returns:
             doc_summary_index (DocumentSummaryIndex): DocumentSummaryIndexオブジェクト
         """
-        # Summaryクエリ
-        SUMMARY_QUERY = "提供されたテキストの内容を要約してください。"
-
         # レスポンスシンセサイザーの準備
         response_synthesizer = get_response_synthesizer(
             service_context=self._service_context,
@@ -180,15 +239,214 @@ class LlamaIndexSummarizer:
             use_async=True,
         )
 
-        # DocumentSummaryIndexの準備
-        doc_summary_index = self._get_doc_summary_index(
-            documents=documents,
-            response_synthesizer=response_synthesizer,
-            summary_query=SUMMARY_QUERY,  # 要約クエリ
+        if self.persist_dir is None:
+            # DocumentSummaryIndexの準備
+            return self._get_doc_summary_index(
+                documents=documents,
+                response_synthesizer=response_synthesizer,
+                summary_query=SUMMARY_QUERY,  # 要約クエリ
+            )
+
+        if self._doc_summary_index is None:
+            self._doc_summary_index = self._load_doc_summary_index(
+                response_synthesizer
+            )
+        if self._doc_summary_index is None:
+            self._doc_summary_index = self._get_doc_summary_index(
+                documents=documents,
+                response_synthesizer=response_synthesizer,
+                summary_query=SUMMARY_QUERY,  # 要約クエリ
+            )
+            is_changed = self._doc_summary_index is not None
+        else:
+            is_changed = self._refresh_doc_summary_index(documents)
+
+        if is_changed:
+            self._persist_doc_summary_index(documents)
+        return self._doc_summary_index
+
+    def _get_config_fingerprint(self) -> str:
+        """
+        インデックスの作成条件 (モデル・プロンプト・ノードパーサー) のハッシュ値を作成する関数
+
+        Returns:
+            str: SHA-256のハッシュ値
+        """
+        prompts = [
+            message.content
+            for template in (
+                self._get_text_qa_prompt_template(),
+                self._get_tree_summarize_prompt_template(),
+            )
+            for message in template.message_templates
+        ]
+        raw = json.dumps(
+            [self.model_id, self.node_parser_type, SUMMARY_QUERY, prompts],
+            ensure_ascii=False,
         )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _read_fingerprint(self) -> Dict[str, Any] | None:
+        """
+        保存したインデックスの作成条件を読み込む関数
 
+        Returns:
+            Dict[str, Any] | None: 作成条件. 保存されていない場合はNone
+        """
+        path = os.path.join(self.persist_dir, INDEX_FINGERPRINT_FILE)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, mode="r") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error in _read_fingerprint: {e}")
+            return None
+
+    def _load_doc_summary_index(
+        self, response_synthesizer: Any
+    ) -> DocumentSummaryIndex | None:
+        """
+        persist_dirに保存したDocumentSummaryIndexを読み込む関数
+
+        Args:
+            response_synthesizer (Any): レスポンスシンセサイザー
+
+        Returns:
+            DocumentSummaryIndex | None: 作成条件が一致した場合はインデックス. それ以外はNone
+        """
+        fingerprint = self._read_fingerprint()
+        if fingerprint is None:
+            return None
+        if fingerprint.get("config") != self._get_config_fingerprint():
+            print("Model or prompts changed. Rebuilding summary index.")
+            return None
+
+        try:
+            storage_context = StorageContext.from_defaults(
+                docstore=SimpleDocumentStore.from_persist_dir(
+                    persist_dir=self.persist_dir
+                ),
+                vector_store=SimpleVectorStore.from_persist_dir(
+                    persist_dir=self.persist_dir
+                ),
+                index_store=SimpleIndexStore.from_persist_dir(
+                    persist_dir=self.persist_dir
+                ),
+            )
+            # 保存が途中で止まった場合は、記録した本文と一致しない
+            for doc_id, doc_hash in fingerprint.get("documents", {}).items():
+                if (
+                    storage_context.docstore.get_document_hash(doc_id)
+                    != doc_hash
+                ):
+                    print("Persisted summary index is stale. Rebuilding.")
+                    return None
+            doc_summary_index = load_index_from_storage(
+                storage_context,
+                service_context=self._service_context,
+                response_synthesizer=response_synthesizer,
+                summary_query=SUMMARY_QUERY,
+            )
+        except Exception as e:
+            print(f"Error in _load_doc_summary_index: {e}")
+            return None
+
+        self._storage_context = storage_context
         return doc_summary_index
 
+    def _refresh_doc_summary_index(self, documents: List[Document]) -> bool:
+        """
+        本文が変わったセクションと、新しいセクションだけを要約し直す関数
+
+        Args:
+            documents (List[Document]): ドキュメントのリスト
+
+        Returns:
+            bool: 要約し直したセクションがある場合はTrue
+        """
+        try:
+            refreshed = self._doc_summary_index.refresh_ref_docs(documents)
+        except Exception as e:
+            print(f"Error in _refresh_doc_summary_index: {e}")
+            return False
+        if any(refreshed):
+            print(f"Refreshed {sum(refreshed)} of {len(documents)} sections")
+        return any(refreshed)
+
+    def _persist_doc_summary_index(self, documents: List[Document]) -> None:
+        """
+        DocumentSummaryIndexと作成条件をpersist_dirに保存する関数
+
+        Args:
+            documents (List[Document]): ドキュメントのリスト
+        """
+        fingerprint = self._read_fingerprint() or {}
+        if fingerprint.get("config") != self._get_config_fingerprint():
+            fingerprint = {}
+        doc_hashes = fingerprint.get("documents", {})
+        doc_hashes.update({doc.doc_id: doc.hash for doc in documents})
+        fingerprint = {
+            "config": self._get_config_fingerprint(),
+            "documents": doc_hashes,
+        }
+        try:
+            self._doc_summary_index.storage_context.persist(
+                persist_dir=self.persist_dir
+            )
+            # 読み込み中に壊れたファイルを見ないように、置き換えで書き込む
+            fd, tmp_path = tempfile.mkstemp(dir=self.persist_dir)
+            with os.fdopen(fd, mode="w") as f:
+                json.dump(fingerprint, f)
+            os.replace(
+                tmp_path, os.path.join(self.persist_dir, INDEX_FINGERPRINT_FILE)
+            )
+        except OSError as e:
+            print(f"Error in _persist_doc_summary_index: {e}")
+        return None
+
+    def stream_summaries(
+        self, documents: List[Document]
+    ) -> Iterator[Tuple[int, str]]:
+        """
+        ドキュメントを1つずつ要約し、生成されたトークンを順に返すジェネレータ
+
+        DocumentSummaryIndexを作らずに、ツリー要約プロンプトで直接LLMに問い合わせる。
+
+        Args:
+            documents (List[Document]): ドキュメントのリスト
+
+        Yields:
+            Tuple[int, str]: (ドキュメントのインデックス, 生成されたトークン)
+        """
+        for i, document in enumerate(documents):
+            try:
+                for delta in self.stream_summary(document):
+                    yield i, delta
+            except Exception as e:
+                # 1つのセクションの失敗で、残りの要約を止めない
+                print(f"Error in stream_summaries: {e}")
+
+    def stream_summary(self, document: Document) -> Iterator[str]:
+        """
+        1つのドキュメントを要約し、生成されたトークンを順に返すジェネレータ
+
+        stream_summariesと違い、LLMのエラーはそのまま送出する。
+
+        Args:
+            document (Document): ドキュメント
+
+        Yields:
+            str: 生成されたトークン
+        """
+        template = self._get_tree_summarize_prompt_template()
+        messages = template.format_messages(
+            context_str=document.text, query_str=SUMMARY_QUERY
+        )
+        for response in self.llm_model.stream_chat(messages):
+            if response.delta:
+                yield response.delta
+
     def _get_text_qa_prompt_template(self) -> ChatPromptTemplate:
         """
         QAプロンプトテンプレートを作成する関数
@@ -198,22 +456,7 @@ class LlamaIndexSummarizer:
         """
         # QAシステムプロンプト
         TEXT_QA_SYSTEM_PROMPT = ChatMessage(
-            content=(
-                "#依頼\n"
-                "あなたは高度な理解能力を持ち、複雑なテキストも簡潔に要約することができるAIです。\n"
-                "事前知識ではなく、提供されたコンテキストに基づいて精確な回答を行ってください。\n"
-                "#従うべきルール\n"
-                "1. 略語や初出の用語には解説を加え、AI分野やコンピュータの初心者も理解できるように工夫してください。\n"
-                "2. 回答内で指定されたコンテキストを直接参照しないでください。\n"
-                "3. 「コンテキストに基づいて、...」や「コンテキスト情報は...」、またはそれに類するような記述は避けてください。\n"
-                "4. 出力は日本語で行ってください。"
-                "#手順\n"
-                "1. 与えられたコンテキストに含まれる主要なポイントやコンセプトを細かく分解してください。\n"
-                "2. それぞれのポイントやコンセプトに対して詳細な説明を加えてください。\n"
-                "3. まずは指示に従って、文書の初版を作成してください。\n"
-                "4. 作成した初版をルールに従っているか自己分析してください。\n"
-                "5. 自己分析の結果を踏まえて、文書を改善してください。\n"
-            ),
+            content=SUMMARY_SYSTEM_PROMPT,
             role=MessageRole.SYSTEM,
         )
 
@@ -251,22 +494,7 @@ class LlamaIndexSummarizer:
         """
         # QAシステムプロンプト
         TEXT_QA_SYSTEM_PROMPT = ChatMessage(
-            content=(
-                "#依頼\n"
-                "あなたは高度な理解能力を持ち、複雑なテキストも簡潔に要約することができるAIです。\n"
-                "事前知識ではなく、提供されたコンテキストに基づいて精確な回答を行ってください。\n"
-                "#従うべきルール\n"
-                "1. 略語や初出の用語には解説を加え、AI分野やコンピュータの初心者も理解できるように工夫してください。\n"
-                "2. 回答内で指定されたコンテキストを直接参照しないでください。\n"
-                "3. 「コンテキストに基づいて、...」や「コンテキスト情報は...」、またはそれに類するような記述は避けてください。\n"
-                "4. 出力は日本語で行ってください。"
-                "#手順\n"
-                "1. 与えられたコンテキストに含まれる主要なポイントやコンセプトを細かく分解してください。\n"
-                "2. それぞれのポイントやコンセプトに対して詳細な説明を加えてください。\n"
-                "3. まずは指示に従って、文書の初版を作成してください。\n"
-                "4. 作成した初版をルールに従っているか自己分析してください。\n"
-                "5. 自己分析の結果を踏まえて、文書を改善してください。\n"
-            ),
+            content=SUMMARY_SYSTEM_PROMPT,
             role=MessageRole.SYSTEM,
         )
 
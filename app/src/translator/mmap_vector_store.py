@@ -0,0 +1,334 @@
+import json
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, List
+
+import numpy as np
+from llama_index.schema import BaseNode
+from llama_index.vector_stores.types import (
+    VectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+
+# 埋め込み行列とIDの対応を保存するファイル名
+MMAP_VECTOR_FILE = "vector_store.f32"
+MMAP_META_FILE = "vector_store_meta.json"
+# 最初に確保する行数. 足りなくなったら2倍に広げる
+MMAP_INITIAL_CAPACITY = 1024
+
+
+class MmapVectorStore(VectorStore):
+    """埋め込みをメモリマップしたfloat32の行列で保持するベクトルストア
+
+    SimpleVectorStoreは埋め込みをPythonのリストで保持し、JSONで保存するため、
+    論文数が増えると読み込みに時間とメモリがかかる。このストアは正規化した
+    埋め込みを (capacity, dim) のfloat32行列としてファイルに書き込み、
+    np.memmapで開くため、読み込み時に解析するのはIDの対応表だけになる。
+    コサイン類似度は行列とクエリの内積1回で計算し、argpartitionで上位k件を選ぶ。
+    """
+
+    stores_text: bool = False
+    is_embedding_query: bool = True
+
+    def __init__(
+        self,
+        persist_dir: str,
+        dim: int | None = None,
+        initial_capacity: int = MMAP_INITIAL_CAPACITY,
+    ) -> None:
+        """
+        MmapVectorStoreクラスのコンストラクタ
+
+        persist_dirに保存済みのストアがある場合は、それを開く。
+
+        Args:
+            persist_dir (str): 埋め込みの保存先ディレクトリ
+            dim (int | None, optional): 埋め込みの次元数. Noneの場合は最初に追加した埋め込みから決める. Defaults to None.
+            initial_capacity (int, optional): 最初に確保する行数. Defaults to MMAP_INITIAL_CAPACITY.
+        """
+        self.persist_dir = persist_dir
+        self.dim = dim
+        self.initial_capacity = max(initial_capacity, 1)
+        self._ids: List[str | None] = []
+        self._ref_doc_ids: List[str | None] = []
+        self._id_to_row: Dict[str, int] = {}
+        self._matrix: np.memmap | None = None
+        self._n_deleted = 0
+        os.makedirs(persist_dir, exist_ok=True)
+        if os.path.exists(os.path.join(persist_dir, MMAP_META_FILE)):
+            self._load()
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir: str) -> "MmapVectorStore":
+        """保存済みのストアを開くメソッド
+
+        Args:
+            persist_dir (str): 埋め込みの保存先ディレクトリ
+
+        Returns:
+            MmapVectorStore: ベクトルストア
+        """
+        if not os.path.exists(os.path.join(persist_dir, MMAP_META_FILE)):
+            raise FileNotFoundError(f"No vector store found in {persist_dir}")
+        return cls(persist_dir)
+
+    @property
+    def client(self) -> None:
+        """外部のクライアントは使わない"""
+        return None
+
+    @property
+    def _vector_path(self) -> str:
+        return os.path.join(self.persist_dir, MMAP_VECTOR_FILE)
+
+    def __len__(self) -> int:
+        return len(self._id_to_row)
+
+    def __bool__(self) -> bool:
+        # StorageContext.from_defaultsは"vector_store or SimpleVectorStore()"で
+        # 判定するため、空のストアでも置き換えられないようにする
+        return True
+
+    def _load(self) -> None:
+        """IDの対応表を読み込み、埋め込み行列をメモリマップで開くメソッド"""
+        with open(os.path.join(self.persist_dir, MMAP_META_FILE)) as f:
+            meta = json.load(f)
+        self.dim = meta["dim"]
+        self._ids = meta["ids"]
+        self._ref_doc_ids = meta["ref_doc_ids"]
+        self._id_to_row = {
+            node_id: row
+            for row, node_id in enumerate(self._ids)
+            if node_id is not None
+        }
+        self._n_deleted = len(self._ids) - len(self._id_to_row)
+        if self.dim is not None:
+            capacity = os.path.getsize(self._vector_path) // (4 * self.dim)
+            self._matrix = np.memmap(
+                self._vector_path,
+                dtype=np.float32,
+                mode="r+",
+                shape=(capacity, self.dim),
+            )
+
+    def _reserve(self, n_rows: int) -> None:
+        """n_rows行を書き込めるように、埋め込み行列のファイルを広げるメソッド
+
+        Args:
+            n_rows (int): 必要な行数
+        """
+        capacity = 0 if self._matrix is None else self._matrix.shape[0]
+        if n_rows <= capacity:
+            return None
+        new_capacity = max(capacity, self.initial_capacity)
+        while new_capacity < n_rows:
+            new_capacity *= 2
+        if self._matrix is not None:
+            self._matrix.flush()
+            del self._matrix
+        # ファイルの末尾を伸ばすだけなので、既存の行はコピーしない
+        with open(self._vector_path, "ab") as f:
+            f.truncate(new_capacity * self.dim * 4)
+        self._matrix = np.memmap(
+            self._vector_path,
+            dtype=np.float32,
+            mode="r+",
+            shape=(new_capacity, self.dim),
+        )
+        return None
+
+    @staticmethod
+    def _normalize(embeddings: np.ndarray) -> np.ndarray:
+        """コサイン類似度を内積で計算できるように、長さを1にする関数
+
+        Args:
+            embeddings (np.ndarray): 埋め込み
+
+        Returns:
+            np.ndarray: 正規化した埋め込み. 長さが0の埋め込みはそのまま
+        """
+        norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+        return embeddings / np.where(norms == 0, 1, norms)
+
+    def add(self, nodes: List[BaseNode]) -> List[str]:
+        """ノードの埋め込みを追加するメソッド
+
+        Args:
+            nodes (List[BaseNode]): 埋め込みを持つノードのリスト
+
+        Returns:
+            List[str]: 追加したノードのID
+        """
+        if not nodes:
+            return []
+        embeddings = np.asarray(
+            [node.get_embedding() for node in nodes], dtype=np.float32
+        )
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+        if embeddings.shape[1] != self.dim:
+            raise ValueError(
+                f"Embedding dim must be {self.dim}, but got {embeddings.shape[1]}."
+            )
+        embeddings = self._normalize(embeddings)
+
+        # 同じIDのノードは、古い行を削除してから追加する
+        for node in nodes:
+            self._delete_row(node.node_id)
+        start = len(self._ids)
+        self._reserve(start + len(nodes))
+        self._matrix[start : start + len(nodes)] = embeddings
+        for row, node in enumerate(nodes, start=start):
+            self._ids.append(node.node_id)
+            self._ref_doc_ids.append(node.ref_doc_id)
+            self._id_to_row[node.node_id] = row
+        return [node.node_id for node in nodes]
+
+    def _delete_row(self, node_id: str) -> None:
+        """ノードの行を削除済みにするメソッド
+
+        Args:
+            node_id (str): ノードのID
+        """
+        row = self._id_to_row.pop(node_id, None)
+        if row is None:
+            return None
+        self._ids[row] = None
+        self._ref_doc_ids[row] = None
+        self._matrix[row] = 0.0
+        self._n_deleted += 1
+        return None
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        """元のドキュメントのIDに対応するノードを削除するメソッド
+
+        Args:
+            ref_doc_id (str): 元のドキュメントのID
+        """
+        node_ids = [
+            node_id
+            for node_id, doc_id in zip(self._ids, self._ref_doc_ids)
+            if node_id is not None and doc_id == ref_doc_id
+        ]
+        for node_id in node_ids:
+            self._delete_row(node_id)
+        return None
+
+    def query(
+        self, query: VectorStoreQuery, **kwargs: Any
+    ) -> VectorStoreQueryResult:
+        """コサイン類似度が高い順にk件のノードを取得するメソッド
+
+        Args:
+            query (VectorStoreQuery): クエリ
+
+        Returns:
+            VectorStoreQueryResult: 類似度とノードのID
+        """
+        if query.filters is not None:
+            raise ValueError(
+                "Metadata filters not implemented for MmapVectorStore yet."
+            )
+        if self._matrix is None or not self._id_to_row:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+
+        query_embedding = self._normalize(
+            np.asarray(query.query_embedding, dtype=np.float32)
+        )
+        if query.node_ids is not None:
+            rows = np.fromiter(
+                (
+                    self._id_to_row[node_id]
+                    for node_id in query.node_ids
+                    if node_id in self._id_to_row
+                ),
+                dtype=np.int64,
+            )
+        else:
+            rows = None
+
+        n_rows = len(self._ids)
+        matrix = self._matrix[:n_rows] if rows is None else self._matrix[rows]
+        similarities = matrix @ query_embedding
+        if rows is None and self._n_deleted:
+            # 削除済みの行は選ばれないようにする
+            alive = np.fromiter(
+                (node_id is not None for node_id in self._ids),
+                dtype=bool,
+                count=n_rows,
+            )
+            similarities[~alive] = -np.inf
+
+        top_k = min(query.similarity_top_k, len(similarities))
+        if top_k <= 0:
+            return VectorStoreQueryResult(similarities=[], ids=[])
+        # 全体を並べ替えずに上位k件を選び、k件だけを並べ替える
+        top = np.argpartition(-similarities, top_k - 1)[:top_k]
+        top = top[np.argsort(-similarities[top])]
+        top = top[np.isfinite(similarities[top])]
+        top_rows = top if rows is None else rows[top]
+        return VectorStoreQueryResult(
+            similarities=similarities[top].tolist(),
+            ids=[self._ids[row] for row in top_rows],
+        )
+
+    def compact(self) -> None:
+        """削除済みの行を詰めて、ファイルを小さくするメソッド"""
+        if not self._n_deleted or self._matrix is None:
+            return None
+        alive_rows = sorted(self._id_to_row.values())
+        embeddings = np.array(self._matrix[alive_rows])
+        ids = [self._ids[row] for row in alive_rows]
+        ref_doc_ids = [self._ref_doc_ids[row] for row in alive_rows]
+        del self._matrix
+        self._matrix = None
+        os.remove(self._vector_path)
+        self._ids, self._ref_doc_ids, self._id_to_row = [], [], {}
+        self._n_deleted = 0
+        if ids:
+            self._reserve(len(ids))
+            self._matrix[: len(ids)] = embeddings
+        self._ids = ids
+        self._ref_doc_ids = ref_doc_ids
+        self._id_to_row = {node_id: row for row, node_id in enumerate(ids)}
+        return None
+
+    def persist(self, persist_path: str | None = None, fs: Any = None) -> None:
+        """埋め込み行列をファイルに書き出し、IDの対応表を保存するメソッド
+
+        StorageContext.persistから呼ばれた場合は、persist_pathのディレクトリに保存する。
+
+        Args:
+            persist_path (str | None, optional): 保存先のパス. Defaults to None.
+            fs (Any, optional): fsspecのファイルシステム. 使わない. Defaults to None.
+        """
+        # 削除済みの行が半分を超えたら詰める
+        if self._n_deleted * 2 > len(self._ids):
+            self.compact()
+        if self._matrix is not None:
+            self._matrix.flush()
+
+        persist_dir = self.persist_dir
+        if persist_path is not None:
+            persist_dir = os.path.dirname(os.path.abspath(persist_path))
+        os.makedirs(persist_dir, exist_ok=True)
+        if os.path.abspath(persist_dir) != os.path.abspath(self.persist_dir):
+            if self._matrix is not None:
+                shutil.copyfile(
+                    self._vector_path,
+                    os.path.join(persist_dir, MMAP_VECTOR_FILE),
+                )
+
+        meta = {
+            "dim": self.dim,
+            "ids": self._ids,
+            "ref_doc_ids": self._ref_doc_ids,
+        }
+        # 読み込み中に壊れたファイルを見ないように、置き換えで書き込む
+        fd, tmp_path = tempfile.mkstemp(dir=persist_dir)
+        with os.fdopen(fd, mode="w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(persist_dir, MMAP_META_FILE))
+        return None
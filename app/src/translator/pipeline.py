@@ -1,3 +1,4 @@
+import os
 from typing import Any, List, Optional
 
 from langchain.embeddings import HuggingFaceEmbeddings
@@ -13,6 +14,12 @@ from llama_index.storage.docstore import SimpleDocumentStore
 from llama_index.storage.index_store import SimpleIndexStore
 from llama_index.vector_stores import SimpleVectorStore
 
+from src.translator.mmap_vector_store import (
+    MMAP_META_FILE,
+    MMAP_VECTOR_FILE,
+    MmapVectorStore,
+)
+
 
 class Pipeline:
     def __init__(
@@ -23,6 +30,7 @@ class Pipeline:
         prompt_temp_path: str | None = "prompt_templates/default.txt",
         service_context: Optional[ServiceContext] = None,
         is_debug: bool = False,
+        vector_store_dir: str | None = None,
     ) -> None:
         """
         Pipelineクラスのコンストラクタ
@@ -33,7 +41,9 @@ class Pipeline:
             embed_model (Optional[Any], optional): Embeddingsのモデル. Defaults to None.
             prompt_temp_path (str | None, optional): Prompt Templateのパス. Defaults to "prompt_templates/default.txt".
             is_debug (bool, optional): デバッグモードかどうか. Defaults to False.
+            vector_store_dir (str | None, optional): 埋め込みをメモリマップしたファイルに保存するディレクトリ. Noneの場合はSimpleVectorStoreを使う. Defaults to None.
         """
+        self.vector_store_dir = vector_store_dir
         self._prompt_template = self._load_prompt_template(prompt_temp_path)
         self.is_debug = is_debug
         self._storage_context = None
@@ -69,10 +79,23 @@ class Pipeline:
             )
 
     def _create_strage_context(self) -> None:
-        """Storage Contextを作成する関数"""
+        """Storage Contextを作成する関数
+
+        保存済みのインデックスを開く場合は、read_vector_indexを使う。
+        """
+        if self.vector_store_dir is not None:
+            # 新しくインデックスを作るため、前回の埋め込みが混ざらないように消す
+            for file_name in (MMAP_VECTOR_FILE, MMAP_META_FILE):
+                file_path = os.path.join(self.vector_store_dir, file_name)
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+            # 論文数が多い場合は、埋め込みをメモリマップしたファイルに保存する
+            vector_store = MmapVectorStore(self.vector_store_dir)
+        else:
+            vector_store = SimpleVectorStore()
         self._storage_context = StorageContext.from_defaults(
             docstore=SimpleDocumentStore(),
-            vector_store=SimpleVectorStore(),
+            vector_store=vector_store,
             index_store=SimpleIndexStore(),
         )
 
@@ -126,6 +149,8 @@ class Pipeline:
         Args:
             docs (List[str]): ドキュメントのリスト
         """
+        if self._storage_context is None:
+            self._create_strage_context()
         try:
             # VectorStoreIndexを作成し、ドキュメントをベクトル化する
             self.vector_store_index = VectorStoreIndex.from_documents(
@@ -138,6 +163,38 @@ class Pipeline:
             print(f"Error while vectorizing documents: {e}")
             self.vector_store_index = None
 
+    def persist_vector_index(self, index_dir_path: str) -> None:
+        """ベクトルインデックスを保存する関数
+
+        Args:
+            index_dir_path (str): ベクトルインデックスの保存先ディレクトリへのパス
+        """
+        if self.vector_store_index is None:
+            raise ValueError(
+                "You need to vectorize documents before persisting."
+            )
+        try:
+            self.vector_store_index.storage_context.persist(
+                persist_dir=index_dir_path
+            )
+        except Exception as e:
+            print(f"Error while persisting vector index: {e}")
+
+    @staticmethod
+    def _load_vector_store(index_dir_path: str) -> Any:
+        """保存されている形式に合わせて、ベクトルストアを読み込む関数
+
+        Args:
+            index_dir_path (str): ベクトルインデックスが保存されたディレクトリへのパス
+
+        Returns:
+            Any: MmapVectorStoreまたはSimpleVectorStore
+        """
+        if os.path.exists(os.path.join(index_dir_path, MMAP_META_FILE)):
+            # 埋め込み行列はメモリマップで開くため、JSONの解析は不要
+            return MmapVectorStore.from_persist_dir(index_dir_path)
+        return SimpleVectorStore.from_persist_dir(persist_dir=index_dir_path)
+
     def read_vector_index(self, index_dir_path: str) -> None:
         """ベクトルインデックスを読み込む関数
 
@@ -150,9 +207,7 @@ class Pipeline:
                 docstore=SimpleDocumentStore.from_persist_dir(
                     persist_dir=index_dir_path
                 ),
-                vector_store=SimpleVectorStore.from_persist_dir(
-                    persist_dir=index_dir_path
-                ),
+                vector_store=self._load_vector_store(index_dir_path),
                 index_store=SimpleIndexStore.from_persist_dir(
                     persist_dir=index_dir_path
                 ),
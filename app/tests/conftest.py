@@ -0,0 +1,13 @@
+import os
+import sys
+import types
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# src/__init__はSlackのAppやLLMを読み込み、トークンやネットワークが必要になるため、
+# テストではパッケージの初期化を実行せずに、テスト対象のモジュールだけを読み込む
+for package_name in ("src", "src.model", "src.translator"):
+    if package_name not in sys.modules:
+        package = types.ModuleType(package_name)
+        package.__path__ = [os.path.join(APP_DIR, *package_name.split("."))]
+        sys.modules[package_name] = package
@@ -0,0 +1,131 @@
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("arxiv")
+pytest.importorskip("requests")
+
+from src.arXivUtils import _limit_per_keyword, download_pdfs  # noqa: E402
+
+PDF_BYTES = b"%PDF-1.4\n" + bytes(range(256)) * 1200
+DROP_AFTER = 100 * 1024
+
+
+class _StubPDFHandler(BaseHTTPRequestHandler):
+    """drop_onceの場合は1回だけ、DROP_AFTERバイトを送った後に接続を切るハンドラ"""
+
+    def do_GET(self) -> None:
+        if self.path != "/paper.pdf":
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.server.ranges.append(self.headers.get("Range"))
+        match = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range") or "")
+        offset = int(match.group(1)) if match else 0
+        body = PDF_BYTES[offset:]
+        self.send_response(206 if offset else 200)
+        if offset:
+            self.send_header(
+                "Content-Range",
+                f"bytes {offset}-{len(PDF_BYTES) - 1}/{len(PDF_BYTES)}",
+            )
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.server.drop_once:
+            # ボディの途中で接続を切る
+            self.server.drop_once = False
+            self.wfile.write(body[:DROP_AFTER])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        return None
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubPDFHandler)
+    server.ranges = []
+    server.drop_once = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _create_paper(stub_server, title="Stub Paper"):
+    host, port = stub_server.server_address
+    return SimpleNamespace(
+        title=title, pdf_url=f"http://{host}:{port}/paper.pdf"
+    )
+
+
+def test_download_pdfs_resumes_after_connection_drop(stub_server, tmp_path):
+    paper = _create_paper(stub_server)
+
+    [(dir_path, pdf_path, pdf_name)] = download_pdfs(
+        [paper], str(tmp_path), backoff=0.0
+    )
+
+    assert pdf_name == "Stub_Paper"
+    with open(pdf_path, mode="rb") as f:
+        assert f.read() == PDF_BYTES
+    assert not os.path.exists(pdf_path + ".part")
+    # 2回目は、途中まで保存した続きから要求する
+    assert stub_server.ranges == [None, f"bytes={DROP_AFTER}-"]
+
+
+def test_download_pdfs_skips_downloaded_pdf(stub_server, tmp_path):
+    stub_server.drop_once = False
+    paper = _create_paper(stub_server)
+    download_pdfs([paper], str(tmp_path), backoff=0.0)
+    stub_server.ranges.clear()
+
+    [(_, pdf_path, _)] = download_pdfs([paper], str(tmp_path), backoff=0.0)
+
+    assert os.path.exists(pdf_path)
+    assert stub_server.ranges == []
+
+
+def test_download_pdfs_returns_none_for_failed_paper(stub_server, tmp_path):
+    stub_server.drop_once = False
+    paper = _create_paper(stub_server)
+    host, port = stub_server.server_address
+    missing = SimpleNamespace(
+        title="Missing", pdf_url=f"http://{host}:{port}/missing.pdf"
+    )
+
+    results = download_pdfs(
+        [missing, paper], str(tmp_path), max_retries=0, backoff=0.0
+    )
+
+    assert results[0] == (None, None, None)
+    assert results[1][2] == "Stub_Paper"
+
+
+def test_limit_per_keyword_keeps_other_keywords():
+    result_list = [
+        {"Title": f"busy{i}", "Keywords": ["busy"]} for i in range(5)
+    ] + [
+        {"Title": "both", "Keywords": ["busy", "rare"]},
+        {"Title": "rare", "Keywords": ["rare"]},
+        {"Title": "none", "Keywords": []},
+    ]
+
+    limited = _limit_per_keyword(result_list, ["busy", "rare"], max_result=2)
+
+    # busyは上限の2件まで. rareにもヒットする論文は、rareの枠で残す
+    assert [paper["Title"] for paper in limited] == [
+        "busy0",
+        "busy1",
+        "both",
+        "rare",
+        "none",
+    ]
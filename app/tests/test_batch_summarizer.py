@@ -0,0 +1,141 @@
+import re
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("nest_asyncio")
+try:
+    import llama_index  # noqa: F401
+except Exception as e:
+    # llama_indexは読み込み時にtiktokenのデータをダウンロードするため、
+    # オフラインではImportError以外の例外になる
+    pytest.skip(f"llama_index is not available: {e}", allow_module_level=True)
+
+from llama_index import Document  # noqa: E402
+
+from src.translator.batch_summarizer import (  # noqa: E402
+    BatchSummarizer,
+    _SectionStreamSplitter,
+    split_batch_output,
+)
+
+
+class FakeLLM:
+    """プロンプトの各セクションに"[SECTION n]"付きの要約を、数文字ずつ返すLLM"""
+
+    def __init__(self, skip_sections=()):
+        self.skip_sections = set(skip_sections)
+        self.n_finished = 0
+
+    def _answer(self, prompt):
+        sections = prompt.split("---------------------")[1]
+        titles = re.findall(r"\[SECTION (\d+)\]\n(.*)", sections)
+        if len(titles) == 1:
+            self.skip_sections = set()
+        return "".join(
+            f"[SECTION {no}]\n{title}の要約\n\n"
+            for no, title in titles
+            if title not in self.skip_sections
+        )
+
+    def stream_complete(self, prompt):
+        output = self._answer(prompt)
+        for start in range(0, len(output), 3):
+            yield SimpleNamespace(delta=output[start : start + 3])
+        self.n_finished += 1
+
+
+class FakeCheckpoint:
+    def __init__(self, saved=None):
+        self.saved = dict(saved or {})
+
+    def get(self, i, document):
+        return self.saved.get(i)
+
+    def put(self, i, document, summary):
+        self.saved[i] = summary
+
+
+def _create_docs(n_docs):
+    return [
+        Document(text="本文", metadata={"Section Title": f"title{i}"})
+        for i in range(n_docs)
+    ]
+
+
+def _join(events, n_docs):
+    summaries = [""] * n_docs
+    for i, text in events:
+        summaries[i] += text
+    return summaries
+
+
+def test_splitter_matches_split_batch_output():
+    output = "説明\n[SECTION 1]\n 要約1 \n\n[SECTION 2]\n要約\n2\n"
+    splitter = _SectionStreamSplitter(2)
+
+    events = []
+    for char in output:
+        events += splitter.feed(char)
+    events += splitter.close()
+
+    assert _join(events, 2) == split_batch_output(output, 2)
+    assert splitter.texts == ["要約1", "要約\n2"]
+
+
+def test_stream_summaries_yields_tokens_before_batch_finishes():
+    llm = FakeLLM()
+    summarizer = BatchSummarizer(llm, context_window=4096, max_tokens=2048)
+
+    events = summarizer.stream_summaries(_create_docs(3))
+    first = next(events)
+
+    # 1回の生成が終わる前に、最初のセクションのテキストが届く
+    assert first[0] == 0
+    assert llm.n_finished == 0
+    summaries = _join([first, *events], 3)
+    assert summaries == ["title0の要約", "title1の要約", "title2の要約"]
+    assert summarizer.n_calls == 1
+
+
+def test_stream_summaries_resumes_from_checkpoint():
+    checkpoint = FakeCheckpoint({1: "保存済み"})
+    summarizer = BatchSummarizer(
+        FakeLLM(), context_window=4096, max_tokens=2048, checkpoint=checkpoint
+    )
+
+    events = list(summarizer.stream_summaries(_create_docs(3)))
+
+    # documentsの順番に返す
+    assert [i for i, _ in events] == sorted(i for i, _ in events)
+    assert _join(events, 3) == ["title0の要約", "保存済み", "title2の要約"]
+    assert checkpoint.saved == {
+        0: "title0の要約",
+        1: "保存済み",
+        2: "title2の要約",
+    }
+
+
+def test_stream_summaries_retries_missing_section():
+    llm = FakeLLM(skip_sections={"title1"})
+    summarizer = BatchSummarizer(llm, context_window=4096, max_tokens=2048)
+
+    events = list(summarizer.stream_summaries(_create_docs(3)))
+
+    assert [i for i, _ in events] == sorted(i for i, _ in events)
+    assert _join(events, 3) == ["title0の要約", "title1の要約", "title2の要約"]
+    assert summarizer.n_calls == 2
+
+
+def test_stream_summaries_matches_summarize():
+    docs = _create_docs(5)
+    # 出力のトークン数の上限から、1回にまとめるのは2セクションまで
+    streaming = BatchSummarizer(FakeLLM(), context_window=4096, max_tokens=800)
+    streamed = _join(streaming.stream_summaries(docs), 5)
+    summarized = BatchSummarizer(
+        FakeLLM(), context_window=4096, max_tokens=800
+    ).summarize(docs)
+
+    assert streamed == summarized
+    assert streamed == [f"title{i}の要約" for i in range(5)]
+    assert streaming.n_calls == 3
@@ -0,0 +1,161 @@
+import os
+
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("lxml")
+try:
+    import llama_index  # noqa: F401
+except Exception as e:
+    # llama_indexは読み込み時にtiktokenのデータをダウンロードするため、
+    # オフラインではImportError以外の例外になる
+    pytest.skip(f"llama_index is not available: {e}", allow_module_level=True)
+
+from src import GrobidUtils  # noqa: E402
+from src.GrobidUtils import (  # noqa: E402
+    STUB_TEI_XML,
+    GrobidServerClient,
+    TEICache,
+    process_pdf_with_grobid,
+    start_stub_grobid_server,
+)
+
+CLI_TEI_XML = "<TEI>cli</TEI>"
+
+
+@pytest.fixture
+def stub_server():
+    server = start_stub_grobid_server()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(stub_server):
+    host, port = stub_server.server_address
+    client = GrobidServerClient(server_url=f"http://{host}:{port}")
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return TEICache(cache_dir=str(tmp_path / "cache"))
+
+
+@pytest.fixture
+def pdf_dir(tmp_path):
+    dir_path = tmp_path / "paper"
+    dir_path.mkdir()
+    (dir_path / "paper.pdf").write_bytes(b"%PDF-1.4 stub")
+    return str(dir_path)
+
+
+@pytest.fixture
+def cli_calls(monkeypatch):
+    """run_grobidを、TEI XMLを書き込むだけの関数に置き換える"""
+    calls = []
+
+    def run_grobid(dir_path):
+        calls.append(dir_path)
+        with open(os.path.join(dir_path, "paper.tei.xml"), mode="w") as f:
+            f.write(CLI_TEI_XML)
+        return dir_path
+
+    monkeypatch.setattr(GrobidUtils, "run_grobid", run_grobid)
+    return calls
+
+
+def _read_tei(dir_path):
+    with open(os.path.join(dir_path, "paper.tei.xml")) as f:
+        return f.read()
+
+
+def test_process_pdf_with_grobid_uses_server(pdf_dir, client, cache, cli_calls):
+    result = process_pdf_with_grobid(
+        pdf_dir, "paper", client=client, cache=cache
+    )
+
+    assert result == pdf_dir
+    assert _read_tei(pdf_dir) == STUB_TEI_XML
+    assert cli_calls == []
+
+
+def test_process_pdf_with_grobid_falls_back_to_cli(
+    pdf_dir, client, cache, cli_calls, monkeypatch
+):
+    monkeypatch.setattr(client, "is_alive", lambda: False)
+
+    result = process_pdf_with_grobid(
+        pdf_dir, "paper", client=client, cache=cache
+    )
+
+    assert result == pdf_dir
+    assert _read_tei(pdf_dir) == CLI_TEI_XML
+    assert cli_calls == [pdf_dir]
+
+
+def test_process_pdf_with_grobid_uses_cache_on_second_call(
+    pdf_dir, client, cache, cli_calls, monkeypatch
+):
+    process_pdf_with_grobid(pdf_dir, "paper", client=client, cache=cache)
+    os.remove(os.path.join(pdf_dir, "paper.tei.xml"))
+
+    def process_pdf(pdf_path, output_path=None):
+        raise AssertionError("Grobid must not run on a cache hit")
+
+    monkeypatch.setattr(client, "process_pdf", process_pdf)
+    result = process_pdf_with_grobid(
+        pdf_dir, "paper", client=client, cache=cache
+    )
+
+    assert result == pdf_dir
+    assert _read_tei(pdf_dir) == STUB_TEI_XML
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+    assert cli_calls == []
+
+
+def test_cli_output_is_not_cached_under_server_key(
+    pdf_dir, client, cache, cli_calls, monkeypatch
+):
+    pdf_path = os.path.join(pdf_dir, "paper.pdf")
+    # サーバーは起動しているが、処理に失敗してCLIにフォールバックする
+    with monkeypatch.context() as m:
+        m.setattr(client, "process_pdf", lambda pdf_path: None)
+        process_pdf_with_grobid(pdf_dir, "paper", client=client, cache=cache)
+
+    assert cli_calls == [pdf_dir]
+    cli_key = cache.make_key(
+        pdf_path, backend="cli", flags=GrobidUtils.GROBID_FLAGS
+    )
+    server_key = cache.make_key(pdf_path, backend="server", flags=client.flags)
+    assert os.path.exists(cache._get_path(cli_key))
+    assert not os.path.exists(cache._get_path(server_key))
+
+    # 次にサーバーで処理できた場合は、CLIの出力を使わない
+    result = process_pdf_with_grobid(
+        pdf_dir, "paper", client=client, cache=cache
+    )
+    assert result == pdf_dir
+    assert _read_tei(pdf_dir) == STUB_TEI_XML
+    assert os.path.exists(cache._get_path(server_key))
+
+
+def test_cache_key_depends_on_flags(pdf_dir, cache):
+    pdf_path = os.path.join(pdf_dir, "paper.pdf")
+
+    assert cache.make_key(pdf_path, flags={"consolidateHeader": "1"}) != (
+        cache.make_key(pdf_path, flags={"consolidateHeader": "0"})
+    )
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [("512", 512 * 1024**2), ("0.5", 512 * 1024), ("abc", 1024**3)],
+)
+def test_get_cache_max_bytes_from_env(monkeypatch, value, expected):
+    monkeypatch.setenv("GROBID_CACHE_MAX_MB", value)
+
+    assert GrobidUtils._get_cache_max_bytes_from_env() == expected
@@ -0,0 +1,19 @@
+from src.model import llama_cpp
+from src.model.llama_cpp import LLAMA_CPP_GPU_LAYERS, LlamaCppProfile
+
+
+def test_default_profile_runs_on_cpu_with_physical_cores():
+    profile = LlamaCppProfile()
+
+    assert profile.n_threads == llama_cpp._count_physical_cores()
+    assert profile.n_gpu_layers == 0
+
+
+def test_auto_offloads_only_when_supported(monkeypatch):
+    monkeypatch.setattr(llama_cpp, "_supports_gpu_offload", lambda: False)
+    assert LlamaCppProfile.auto().n_gpu_layers == 0
+
+    monkeypatch.setattr(llama_cpp, "_supports_gpu_offload", lambda: True)
+    assert LlamaCppProfile.auto().n_gpu_layers == LLAMA_CPP_GPU_LAYERS
+    # 明示した値は上書きしない
+    assert LlamaCppProfile.auto(n_gpu_layers=8).n_gpu_layers == 8
@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("huggingface_hub")
+
+from src.model import registry as registry_module  # noqa: E402
+from src.model.registry import ModelKey, ModelRegistry  # noqa: E402
+
+KEY_A = ModelKey(backend="test", model_path="model-a")
+KEY_B = ModelKey(backend="test", model_path="model-b")
+
+
+@pytest.fixture
+def registry():
+    return ModelRegistry(memory_budget_bytes=100)
+
+
+def test_idle_model_is_evicted_before_loading_new_model(registry):
+    with registry.use(KEY_A, lambda: "a", size_bytes=80):
+        pass
+    loaded = []
+
+    def load_b():
+        # ロードする時点で、古いモデルは破棄されている
+        loaded.append(registry.stats()["n_models"])
+        return "b"
+
+    with registry.use(KEY_B, load_b, size_bytes=80) as model:
+        assert model == "b"
+
+    assert loaded == [0]
+    assert list(registry.stats()["ref_counts"]) == [KEY_B]
+
+
+def test_model_in_use_is_not_evicted(registry):
+    with registry.use(KEY_A, lambda: "a", size_bytes=80):
+        with registry.use(KEY_B, lambda: "b", size_bytes=80):
+            assert registry.stats()["n_models"] == 2
+        # 参照が残っているAは破棄されず、使い終わったBが破棄される
+        assert list(registry.stats()["ref_counts"]) == [KEY_A]
+
+
+def test_evict_keeps_load_lock(registry):
+    with registry.use(KEY_A, lambda: "a", size_bytes=10):
+        pass
+    load_lock = registry._load_locks[KEY_A]
+
+    assert registry.evict(KEY_A)
+
+    # 同じキーをロード中のスレッドと、別のロックで2回ロードしない
+    assert registry._load_locks[KEY_A] is load_lock
+
+
+def test_gc_runs_outside_registry_lock(registry, monkeypatch):
+    is_locked = []
+
+    def collect():
+        # 別のスレッドからレジストリのロックを取得できるかを確認する
+        def try_lock():
+            acquired = registry._lock.acquire(blocking=False)
+            if acquired:
+                registry._lock.release()
+            is_locked.append(not acquired)
+
+        thread = threading.Thread(target=try_lock)
+        thread.start()
+        thread.join()
+
+    monkeypatch.setattr(registry_module.gc, "collect", collect)
+    with registry.use(KEY_A, lambda: "a", size_bytes=80):
+        pass
+    with registry.use(KEY_B, lambda: "b", size_bytes=80):
+        pass
+
+    assert is_locked == [False]
@@ -0,0 +1,80 @@
+import pytest
+
+from src.NotionMarkdown import iter_lines, markdown_to_blocks
+
+
+def _summarize(blocks):
+    """ブロックを (種類, テキスト) のリストにする"""
+    return [
+        (
+            block["type"],
+            "".join(
+                rich_text["text"]["content"]
+                for rich_text in block[block["type"]]["rich_text"]
+            ),
+        )
+        for block in blocks
+    ]
+
+
+@pytest.mark.parametrize(
+    "line, expected",
+    [
+        ("# Title", ("heading_1", "Title")),
+        ("## Title ##", ("heading_2", "Title")),
+        ("###Title", ("heading_3", "Title")),
+        ("##Title", ("heading_2", "Title")),
+        ("#### Title", ("paragraph", "Title")),
+        # 見出しの文字がない行は、見出しにしない
+        ("# ", ("paragraph", "# ")),
+        ("###", ("paragraph", "###")),
+        # Cのプリプロセッサやハッシュタグは、見出しにしない
+        ("#include <x>", ("paragraph", "#include <x>")),
+        ("#tag", ("paragraph", "#tag")),
+    ],
+)
+def test_heading(line, expected):
+    assert _summarize(markdown_to_blocks(line)) == [expected]
+
+
+@pytest.mark.parametrize(
+    "line, expected",
+    [
+        ("1. 項目", ("numbered_list_item", "項目")),
+        ("123) 項目", ("numbered_list_item", "項目")),
+        # 年から始まる文は、番号付きリストにしない
+        ("2023. 年に提案された", ("paragraph", "2023. 年に提案された")),
+        ("- 項目", ("bulleted_list_item", "項目")),
+    ],
+)
+def test_list_item(line, expected):
+    assert _summarize(markdown_to_blocks(line)) == [expected]
+
+
+def test_paragraphs_and_code_block():
+    markdown_text = "\n".join(
+        [
+            "1行目",
+            "2行目",
+            "",
+            "```py",
+            "# コメント",
+            "```",
+            "3行目",
+        ]
+    )
+
+    blocks = markdown_to_blocks(markdown_text)
+
+    assert _summarize(blocks) == [
+        ("paragraph", "1行目\n2行目"),
+        ("code", "# コメント"),
+        ("paragraph", "3行目"),
+    ]
+    assert blocks[1]["code"]["language"] == "python"
+
+
+def test_iter_lines_joins_chunks():
+    chunks = ["## Ti", "tle\n本", "文\n", "最後"]
+
+    assert list(iter_lines(chunks)) == ["## Title", "本文", "最後"]
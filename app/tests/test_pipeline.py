@@ -0,0 +1,110 @@
+import os
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("langchain")
+try:
+    import llama_index  # noqa: F401
+except Exception as e:
+    # llama_indexは読み込み時にtiktokenのデータをダウンロードするため、
+    # オフラインではImportError以外の例外になる
+    pytest.skip(f"llama_index is not available: {e}", allow_module_level=True)
+
+from llama_index import Document, ServiceContext  # noqa: E402
+from llama_index.embeddings.base import BaseEmbedding  # noqa: E402
+from llama_index.llms import MockLLM  # noqa: E402
+
+from src.translator.mmap_vector_store import MMAP_META_FILE  # noqa: E402
+from src.translator.pipeline import Pipeline  # noqa: E402
+
+KEYWORDS = ["apple", "banana", "cherry"]
+
+
+def _embed(text):
+    # 含まれるキーワードだけが1になる埋め込み. 長さが0にならないように定数を足す
+    return [float(keyword in text) for keyword in KEYWORDS] + [0.1]
+
+
+class KeywordEmbedding(BaseEmbedding):
+    """キーワードの有無で埋め込みを作る、ダウンロード不要のモデル"""
+
+    @classmethod
+    def class_name(cls):
+        return "KeywordEmbedding"
+
+    def _get_query_embedding(self, query):
+        return _embed(query)
+
+    async def _aget_query_embedding(self, query):
+        return _embed(query)
+
+    def _get_text_embedding(self, text):
+        return _embed(text)
+
+
+@pytest.fixture
+def prompt_temp_path(tmp_path):
+    path = tmp_path / "prompt.txt"
+    path.write_text("{context_str}\n{query_str}")
+    return str(path)
+
+
+@pytest.fixture
+def create_pipeline(tmp_path, prompt_temp_path):
+    service_context = ServiceContext.from_defaults(
+        llm=MockLLM(), embed_model=KeywordEmbedding()
+    )
+
+    def create_pipeline():
+        return Pipeline(
+            llm_model=None,
+            prompt_temp_path=prompt_temp_path,
+            service_context=service_context,
+            vector_store_dir=str(tmp_path / "vector_store"),
+        )
+
+    return create_pipeline
+
+
+def _retrieve(pipeline, query, top_k=1):
+    retriever = pipeline.vector_store_index.as_retriever(similarity_top_k=top_k)
+    return [node.node.get_content() for node in retriever.retrieve(query)]
+
+
+def _create_docs(*texts):
+    return [Document(text=text) for text in texts]
+
+
+def test_persist_reopen_and_query(tmp_path, create_pipeline):
+    index_dir = str(tmp_path / "index")
+    pipeline = create_pipeline()
+    pipeline.vectorize_documents(
+        _create_docs("apple pie recipe", "banana bread recipe")
+    )
+    pipeline.persist_vector_index(index_dir)
+    assert os.path.exists(os.path.join(index_dir, MMAP_META_FILE))
+
+    reopened = create_pipeline()
+    reopened.read_vector_index(index_dir)
+
+    assert reopened.vector_store_index is not None
+    assert _retrieve(reopened, "banana") == ["banana bread recipe"]
+    assert _retrieve(reopened, "apple") == ["apple pie recipe"]
+
+
+def test_new_index_does_not_contain_stale_vectors(tmp_path, create_pipeline):
+    pipeline = create_pipeline()
+    pipeline.vectorize_documents(
+        _create_docs("apple pie recipe", "banana bread recipe")
+    )
+    # vector_store_dirにインデックスを保存すると、IDの対応表も残る
+    pipeline.persist_vector_index(pipeline.vector_store_dir)
+
+    # 同じvector_store_dirで、別のドキュメントから作り直す
+    pipeline = create_pipeline()
+    pipeline.vectorize_documents(_create_docs("cherry tart recipe"))
+
+    vector_store = pipeline.vector_store_index.storage_context.vector_store
+    assert len(vector_store) == 1
+    assert _retrieve(pipeline, "apple", top_k=3) == ["cherry tart recipe"]
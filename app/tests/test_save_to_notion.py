@@ -0,0 +1,227 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("notion_client")
+httpx = pytest.importorskip("httpx")
+
+from notion_client import errors  # noqa: E402
+
+from src import SaveToNotion  # noqa: E402
+from src.SaveToNotion import (  # noqa: E402
+    NotionPageIndex,
+    NotionPageWriter,
+    NotionRateLimiter,
+)
+
+PAGE = {"parent": {"database_id": "database-1"}, "properties": {}}
+
+
+def _create_api_error(status, code="", headers=None, message=None):
+    response = httpx.Response(status, headers=headers)
+    return errors.APIResponseError(response, message or f"HTTP {status}", code)
+
+
+class FakeNotion:
+    """呼び出しを記録し、errorsに積んだ例外を順に送出するnotion_clientの代わり"""
+
+    def __init__(self):
+        self.calls = []
+        self.errors = []
+        self.archived = set()
+        self._n_pages = 0
+        self._n_blocks = 0
+        self.pages = SimpleNamespace(
+            create=self._endpoint("pages.create", self._create),
+            update=self._endpoint("pages.update", lambda **kwargs: {}),
+            retrieve=self._endpoint("pages.retrieve", self._retrieve),
+        )
+        self.blocks = SimpleNamespace(
+            delete=self._endpoint("blocks.delete", lambda **kwargs: {}),
+            children=SimpleNamespace(
+                append=self._endpoint("blocks.children.append", self._append),
+                list=self._endpoint("blocks.children.list", self._list),
+            ),
+        )
+        self.databases = SimpleNamespace(
+            query=self._endpoint("databases.query", self._list)
+        )
+
+    def _endpoint(self, name, handler):
+        def call(**kwargs):
+            self.calls.append((name, kwargs))
+            if self.errors:
+                error = self.errors.pop(0)
+                if error is not None:
+                    raise error
+            return handler(**kwargs)
+
+        return call
+
+    def _create(self, **kwargs):
+        self._n_pages += 1
+        page_id = f"page-{self._n_pages}"
+        return {"id": page_id, "url": f"https://www.notion.so/{page_id}"}
+
+    def _retrieve(self, page_id):
+        return {"id": page_id, "archived": page_id in self.archived}
+
+    def _list(self, **kwargs):
+        return {"results": [], "has_more": False}
+
+    def _append(self, block_id, children, **kwargs):
+        results = []
+        for _ in children:
+            self._n_blocks += 1
+            results.append({"id": f"block-{self._n_blocks}"})
+        return {"results": results}
+
+    def names(self):
+        return [name for name, _ in self.calls]
+
+
+@pytest.fixture
+def notion():
+    return FakeNotion()
+
+
+@pytest.fixture
+def writer(notion):
+    limiter = NotionRateLimiter(requests_per_second=0, max_concurrency=1)
+    return NotionPageWriter(notion=notion, limiter=limiter)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(SaveToNotion.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def _create_blocks(n_blocks):
+    return [
+        {"object": "block", "type": "paragraph", "paragraph": {"n": i}}
+        for i in range(n_blocks)
+    ]
+
+
+def test_create_page_sends_blocks_in_chunks_of_100(notion, writer, sleeps):
+    blocks = _create_blocks(250)
+
+    page_url = writer.create_page(PAGE, blocks)
+
+    assert page_url == "https://www.notion.so/page-1"
+    assert notion.names() == [
+        "pages.create",
+        "blocks.children.append",
+        "blocks.children.append",
+    ]
+    (_, create), (_, first), (_, second) = notion.calls
+    assert create["children"] == blocks[:100]
+    assert first["block_id"] == "page-1"
+    assert first["children"] == blocks[100:200]
+    assert second["children"] == blocks[200:]
+    assert sleeps == []
+
+
+def test_429_is_retried_after_retry_after(notion, writer, sleeps):
+    notion.errors = [
+        _create_api_error(429, "rate_limited", headers={"Retry-After": "7"})
+    ]
+
+    page_url = writer.create_page(PAGE, _create_blocks(1))
+
+    assert page_url == "https://www.notion.so/page-1"
+    assert notion.names() == ["pages.create", "pages.create"]
+    assert sleeps == [7.0]
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        pytest.param(lambda: _create_api_error(502), id="5xx"),
+        pytest.param(lambda: errors.RequestTimeoutError(), id="timeout"),
+    ],
+)
+def test_5xx_and_timeout_are_retried_with_backoff(
+    notion, writer, sleeps, error
+):
+    notion.errors = [error(), error()]
+
+    page_url = writer.create_page(PAGE, _create_blocks(1))
+
+    assert page_url == "https://www.notion.so/page-1"
+    assert notion.names() == ["pages.create"] * 3
+    assert sleeps == [1.0, 2.0]
+
+
+def test_400_is_not_retried(notion, writer, sleeps):
+    notion.errors = [_create_api_error(400, "validation_error")]
+
+    page_url = writer.create_page(PAGE, _create_blocks(1))
+
+    assert page_url is None
+    assert notion.names() == ["pages.create"]
+    assert sleeps == []
+
+
+def test_retries_stop_at_max_retries(notion, sleeps):
+    writer = NotionPageWriter(
+        notion=notion,
+        limiter=NotionRateLimiter(requests_per_second=0),
+        max_retries=2,
+    )
+    notion.errors = [_create_api_error(503) for _ in range(3)]
+
+    assert writer.create_page(PAGE, _create_blocks(1)) is None
+    assert notion.names() == ["pages.create"] * 3
+    assert sleeps == [1.0, 2.0]
+
+
+@pytest.fixture
+def index(tmp_path):
+    return NotionPageIndex(db_path=str(tmp_path / "notion_pages.sqlite3"))
+
+
+def test_upsert_unchanged_page_returns_existing_url(notion, writer, index):
+    blocks = _create_blocks(3)
+    writer.upsert_page("entry-1", PAGE, blocks, index)
+    notion.calls = []
+
+    page_url = writer.upsert_page("entry-1", PAGE, blocks, index)
+
+    assert page_url == "https://www.notion.so/page-1"
+    assert notion.names() == ["pages.retrieve"]
+
+
+def test_upsert_recreates_page_archived_in_notion(notion, writer, index):
+    blocks = _create_blocks(3)
+    writer.upsert_page("entry-1", PAGE, blocks, index)
+    notion.archived.add("page-1")
+
+    page_url = writer.upsert_page("entry-1", PAGE, blocks, index)
+
+    assert page_url == "https://www.notion.so/page-2"
+    assert index.get("entry-1")["page_id"] == "page-2"
+
+
+def test_upsert_recreates_page_when_update_hits_archived_page(
+    notion, writer, index, sleeps
+):
+    writer.upsert_page("entry-1", PAGE, _create_blocks(3), index)
+    notion.errors = [
+        _create_api_error(
+            400,
+            "validation_error",
+            message="Can't edit block that is archived."
+            " You must unarchive the block before editing.",
+        )
+    ]
+    notion.calls = []
+
+    page_url = writer.upsert_page("entry-1", PAGE, _create_blocks(4), index)
+
+    assert page_url == "https://www.notion.so/page-2"
+    assert notion.names() == ["blocks.children.list", "pages.create"]
+    assert index.get("entry-1")["page_id"] == "page-2"
+    assert sleeps == []